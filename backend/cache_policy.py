@@ -0,0 +1,136 @@
+"""
+Bounded, cost-aware eviction policy for the per-filter index cache
+"""
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Any, Optional, Iterable
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rough resident size of a SuperCluster index per input point, summed over
+# all zoom levels (kd-tree coordinates, count, id and parent columns)
+INDEX_BYTES_PER_POINT = 256
+
+# Number of recent evictions reported in stats
+EVICTION_HISTORY = 50
+
+
+class CacheEntry:
+    """Bookkeeping for a single cached index"""
+    def __init__(self, points: int, build_seconds: float, nbytes: int):
+        self.points = points
+        self.build_seconds = build_seconds
+        self.nbytes = nbytes
+
+    @property
+    def rebuild_cost(self) -> float:
+        """Cost of rebuilding this entry (point count x build time)"""
+        return max(self.points, 1) * max(self.build_seconds, 1e-3)
+
+
+class IndexCachePolicy:
+    """
+    Decides which cached indexes to evict
+
+    The cache can be bounded by entry count, by memory budget, or both.
+    Entries are ranked by rebuild cost divided by time since last access,
+    so cheap, stale entries are evicted before expensive, hot ones. Pinned
+    keys (the "all" index) are never evicted and do not count against the
+    bounds.
+    """
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 max_memory_mb: Optional[float] = None,
+                 pinned: Iterable[str] = ("all",)):
+        self.max_entries = max_entries
+        self.max_memory_mb = max_memory_mb
+        self.pinned = set(pinned)
+
+        self.entries: Dict[str, CacheEntry] = {}
+        self.evictions = 0
+        self.evicted_mb = 0.0
+        self.recent_evictions = deque(maxlen=EVICTION_HISTORY)
+
+    def record_build(self, key: str, points: int, build_seconds: float, nbytes: int) -> None:
+        """Record a newly built (or rebuilt) entry"""
+        self.entries[key] = CacheEntry(points, build_seconds, nbytes)
+
+    def clear(self) -> None:
+        """Stop tracking all entries"""
+        self.entries = {}
+
+    @property
+    def total_mb(self) -> float:
+        """Estimated memory held by evictable (non-pinned) entries in MB"""
+        return sum(entry.nbytes for key, entry in self.entries.items()
+                   if key not in self.pinned) / (1024 * 1024)
+
+    def _over_budget(self, entries: int, memory_mb: float) -> bool:
+        if self.max_entries is not None and entries > self.max_entries:
+            return True
+        if self.max_memory_mb is not None and memory_mb > self.max_memory_mb:
+            return True
+        return False
+
+    def select_victims(self, last_accessed: Dict[str, float], now: Optional[float] = None) -> List[str]:
+        """
+        Choose the entries to evict so the cache fits its bounds
+
+        Args:
+            last_accessed: Last access timestamp per key
+            now: Current time (defaults to time.time())
+
+        Returns:
+            Keys to evict, least valuable first
+        """
+        if now is None:
+            now = time.time()
+
+        entries = len([k for k in self.entries if k not in self.pinned])
+        memory_mb = self.total_mb
+        if not self._over_budget(entries, memory_mb):
+            return []
+
+        def score(key: str) -> float:
+            age = max(now - last_accessed.get(key, 0.0), 0.0)
+            return self.entries[key].rebuild_cost / (age + 1.0)
+
+        candidates = sorted((k for k in self.entries if k not in self.pinned), key=score)
+
+        victims = []
+        for key in candidates:
+            if not self._over_budget(entries, memory_mb):
+                break
+            victims.append(key)
+            entries -= 1
+            memory_mb -= self.entries[key].nbytes / (1024 * 1024)
+
+        return victims
+
+    def record_eviction(self, key: str) -> None:
+        """Record that an entry was evicted"""
+        entry = self.entries.pop(key, None)
+        size_mb = entry.nbytes / (1024 * 1024) if entry else 0.0
+        self.evictions += 1
+        self.evicted_mb += size_mb
+        self.recent_evictions.append({
+            "timestamp": time.time(),
+            "key": key,
+            "size_mb": round(size_mb, 2),
+            "points": entry.points if entry else 0
+        })
+        logger.info(f"Evicted index {key} ({size_mb:.2f} MB)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get eviction statistics"""
+        return {
+            "max_entries": self.max_entries,
+            "max_memory_mb": self.max_memory_mb,
+            "estimated_memory_mb": round(self.total_mb, 2),
+            "pinned": sorted(self.pinned),
+            "evictions": self.evictions,
+            "evicted_mb": round(self.evicted_mb, 2),
+            "recent_evictions": list(self.recent_evictions)
+        }
@@ -1,10 +1,14 @@
 import pymysql
 import os
 import logging
+import re
+import threading
 import time
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional, Tuple
-from constants import FIELD_MAPPING, REVERSE_FIELD_MAPPING
+from typing import List, Dict, Any, Optional, Tuple, Set
+from constants import FIELD_MAPPING, REVERSE_FIELD_MAPPING, FILTER_TYPES
+from feature_store import FeatureStore, FeatureStoreBuilder
+from db_pool import ConnectionPool
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,6 +19,41 @@ load_dotenv()
 # Set default data limit (for preloading)
 DEFAULT_DATA_LIMIT = 10000000 # Limit to 10k rows instead of all 1.4M
 
+# Rows fetched per round trip by the streaming loader
+LOAD_CHUNK_SIZE = int(os.getenv('DB_LOAD_CHUNK_SIZE', '10000'))
+
+# Columns selected for learner points, in query order
+LEARNER_COLUMNS = (
+    'hashed_email',
+    'full_name',
+    'country_of_residence',
+    'latitude',
+    'longitude',
+    'gender',
+    'is_graduate_learner',
+    'is_wage_employed',
+    'is_running_a_venture',
+    'is_featured',
+    'is_featured_video'
+)
+
+# SELECT list and table for learner points (LEARNER_COLUMNS order)
+LEARNER_SELECT = """
+        SELECT
+            hashed_email,
+            full_name,
+            country_of_residence,
+            round(meta_ui_lat, 5) as latitude,
+            round(meta_ui_lng, 5) as longitude,
+            gender,
+            is_graduate_learner,
+            is_wage_employed,
+            is_running_a_venture,
+            is_featured,
+            is_featured_video
+        FROM
+            impact_learners_profile"""
+
 # Database connection parameters
 DB_CONFIG = {
     'host': os.getenv('DATABASE_HOST', 'localhost'),
@@ -23,9 +62,21 @@ DB_CONFIG = {
     'database': os.getenv('DATABASE_NAME', ''),
     'port': int(os.getenv('DATABASE_PORT', '3306')),
     'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
+    'cursorclass': pymysql.cursors.DictCursor,
+    # Pooled connections are long-lived; without autocommit every SELECT would
+    # keep reading the snapshot of the connection's first transaction
+    'autocommit': True
 }
 
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', '30'))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
 def get_connection():
     """Get a database connection"""
     logger.debug(f"Establishing database connection to {DB_CONFIG['host']}:{DB_CONFIG['port']}")
@@ -35,69 +86,72 @@ def get_connection():
         logger.error(f"Database connection error: {e}")
         raise
 
+def get_pool() -> ConnectionPool:
+    """
+    Get the process-wide connection pool, creating it on first use
+    
+    A pool inherited through fork is dropped rather than reused, since its
+    sockets are shared with the parent process.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                lambda: get_connection(),
+                size=DB_POOL_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                ping_interval=DB_POOL_PING_INTERVAL
+            )
+            _pool_pid = os.getpid()
+            logger.info(f"Created database connection pool (size {DB_POOL_SIZE})")
+        return _pool
+
+def close_pool() -> None:
+    """Close the connection pool's idle connections (e.g. on shutdown)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.close()
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Connection pool metrics, or an empty dict if no pool was created yet"""
+    pool = _pool
+    return pool.get_stats() if pool is not None and _pool_pid == os.getpid() else {}
+
 def execute_query(query: str, params: Optional[Tuple] = None) -> List[Dict[str, Any]]:
-    """Execute a database query and return the results"""
+    """Execute a database query on a pooled connection and return the results"""
     start_time = time.time()
-    connection = None
     
     try:
         logger.debug(f"Executing query: {query}")
         logger.debug(f"Query params: {params}")
         
-        connection = get_connection()
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchall()
         
-        with connection.cursor() as cursor:
-            cursor.execute(query, params)
-            result = cursor.fetchall()
-            
-            query_time = time.time() - start_time
-            logger.debug(f"Query executed in {query_time:.4f} seconds, returned {len(result)} rows")
-            
-            return result
+        query_time = time.time() - start_time
+        logger.debug(f"Query executed in {query_time:.4f} seconds, returned {len(result)} rows")
+        
+        return result
     except Exception as e:
         logger.error(f"Database query error: {e}")
         raise
-    finally:
-        if connection:
-            connection.close()
-            logger.debug("Database connection closed")
 
-def load_learner_points(limit: Optional[int] = None, offset: int = 0, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+def _learner_points_query(filters: Optional[Dict[str, Any]] = None) -> Tuple[str, Tuple]:
     """
-    Load learner points from the database with optional filtering
+    Build the learner points SELECT (without LIMIT) and its parameters
     
     Args:
-        limit: Maximum number of points to return
-        offset: Offset for pagination
         filters: Dictionary of filter key-value pairs
         
     Returns:
-        List of learner point dictionaries
+        Tuple of (query, params)
     """
-    # Use default limit if not specified
-    if limit is None:
-        limit = DEFAULT_DATA_LIMIT
-        logger.info(f"Using default limit of {DEFAULT_DATA_LIMIT} rows")
-    
-    logger.info(f"Loading learner points with filters: {filters}")
-    logger.debug(f"Query parameters - limit: {limit}, offset: {offset}")
-    
     # Start with base query
-    query = """
-        SELECT
-            hashed_email,
-            full_name,
-            country_of_residence,
-            round(meta_ui_lat, 5) as latitude,
-            round(meta_ui_lng, 5) as longitude,
-            gender,
-            is_graduate_learner,
-            is_wage_employed,
-            is_running_a_venture,
-            is_featured,
-            is_featured_video
-        FROM
-            impact_learners_profile
+    query = LEARNER_SELECT + """
         WHERE
             meta_ui_lat IS NOT NULL
             AND meta_ui_lng IS NOT NULL
@@ -108,16 +162,40 @@ def load_learner_points(limit: Optional[int] = None, offset: int = 0, filters: O
     # Apply filters if provided
     if filters:
         for key, value in filters.items():
-            if key in ['gender', 'country_of_residence']:
+            if key in FILTER_TYPES['string_filters']:
                 query += f" AND {key} = %s"
                 params.append(value)
                 logger.debug(f"Added filter: {key} = {value}")
-            elif key in ['is_graduate_learner', 'is_wage_employed', 'is_running_a_venture', 
-                         'is_featured', 'is_featured_video']:
+            elif key in FILTER_TYPES['boolean_filters']:
                 query += f" AND {key} = %s"
                 params.append(1 if value else 0)
                 logger.debug(f"Added filter: {key} = {1 if value else 0}")
     
+    return query, tuple(params)
+
+def load_learner_points(limit: Optional[int] = None, offset: int = 0, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Load learner points from the database with optional filtering
+    
+    Args:
+        limit: Maximum number of points to return
+        offset: Offset for pagination
+        filters: Dictionary of filter key-value pairs
+        
+    Returns:
+        List of learner point dictionaries
+    """
+    # Use default limit if not specified
+    if limit is None:
+        limit = DEFAULT_DATA_LIMIT
+        logger.info(f"Using default limit of {DEFAULT_DATA_LIMIT} rows")
+    
+    logger.info(f"Loading learner points with filters: {filters}")
+    logger.debug(f"Query parameters - limit: {limit}, offset: {offset}")
+    
+    query, params = _learner_points_query(filters)
+    params = list(params)
+    
     # Add limit and offset
     query += " LIMIT %s OFFSET %s"
     params.extend([limit, offset])
@@ -130,6 +208,189 @@ def load_learner_points(limit: Optional[int] = None, offset: int = 0, filters: O
     logger.info(f"Loaded {len(results)} learner points in {query_time:.4f} seconds")
     return results
 
+class LoadProgress:
+    """
+    Progress of a streaming load
+    
+    Updated by the loading thread and read by stats requests; the counters
+    are only ever replaced, so readers see a consistent enough snapshot.
+    """
+    def __init__(self):
+        self.rows_expected = 0
+        self.rows_loaded = 0
+        self.started = None
+        self.finished = None
+    
+    def start(self, rows_expected: int) -> None:
+        """Start a load of about rows_expected rows (0 if unknown)"""
+        self.rows_expected = rows_expected
+        self.rows_loaded = 0
+        self.started = time.time()
+        self.finished = None
+    
+    def advance(self, rows: int) -> None:
+        self.rows_loaded += rows
+    
+    def finish(self) -> None:
+        self.rows_expected = self.rows_loaded
+        self.finished = time.time()
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """Progress as reported in stats"""
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0.0
+        return {
+            "running": self.started is not None and self.finished is None,
+            "rows_expected": self.rows_expected,
+            "rows_expected_approximate": self.finished is None,
+            "rows_loaded": self.rows_loaded,
+            "percent": min(round(100.0 * self.rows_loaded / self.rows_expected, 1), 100.0) if self.rows_expected else None,
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(self.rows_loaded / elapsed) if elapsed > 0 else None
+        }
+
+def _estimate_learner_rows(cursor) -> int:
+    """
+    Estimate the learner table's row count from its statistics
+    
+    This reads information_schema instead of scanning the table. InnoDB
+    estimates can be off by tens of percent, so the result is only a
+    capacity hint and a progress total.
+    """
+    cursor.execute(
+        "SELECT TABLE_ROWS AS count FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        ("impact_learners_profile",))
+    row = cursor.fetchone()
+    return int(row["count"] or 0) if row else 0
+
+def load_learner_store(filters: Optional[Dict[str, Any]] = None,
+                       chunk_size: int = LOAD_CHUNK_SIZE,
+                       progress: Optional[LoadProgress] = None) -> FeatureStore:
+    """
+    Stream learner points from the database into a columnar feature store
+    
+    Rows are read as tuples through an unbuffered server-side cursor
+    (SSCursor) in chunks of chunk_size. Each chunk is written into the
+    columns and dropped, so peak memory is the final store plus one chunk
+    instead of every row as a dict. Rows are not counted first, which would
+    scan the table twice: an unfiltered load sizes the columns and reports
+    progress from the table statistics, and filtered loads grow the columns
+    as rows arrive.
+    
+    Args:
+        filters: Dictionary of filter key-value pairs
+        chunk_size: Rows fetched per round trip
+        progress: Optional progress tracker updated after every chunk
+        
+    Returns:
+        FeatureStore holding the rows with valid coordinates
+    """
+    query, params = _learner_points_query(filters)
+    progress = progress or LoadProgress()
+    logger.info(f"Streaming learner points with filters: {filters}")
+    
+    try:
+        with get_pool().connection() as connection:
+            expected = 0
+            if not filters:
+                with connection.cursor() as cursor:
+                    expected = min(_estimate_learner_rows(cursor), DEFAULT_DATA_LIMIT)
+            
+            progress.start(expected)
+            builder = FeatureStoreBuilder(LEARNER_COLUMNS, capacity=expected)
+            
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(query + " LIMIT %s", params + (DEFAULT_DATA_LIMIT,))
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    builder.append(rows)
+                    progress.advance(len(rows))
+        
+        progress.finish()
+    except Exception as e:
+        logger.error(f"Database streaming error: {e}")
+        raise
+    
+    store = builder.finish()
+    stats = progress.as_dict()
+    logger.info(f"Streamed {stats['rows_loaded']} rows into {len(store)} points in {stats['elapsed_seconds']:.2f} seconds")
+    return store
+
+def _check_column(column: str) -> str:
+    """Reject watermark column names that are not plain identifiers (they are interpolated into SQL)"""
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", column or ""):
+        raise ValueError(f"Invalid watermark column: {column!r}")
+    return column
+
+def get_learner_watermark(column: str) -> Any:
+    """
+    Get the current high-water mark of a learner change column
+    
+    Read before a full load, so changes made while the load runs are picked
+    up again by the first incremental refresh.
+    
+    Args:
+        column: Column that increases whenever a row changes (e.g. updated_at)
+        
+    Returns:
+        The column's maximum value, or None if the table is empty
+    """
+    result = execute_query(f"SELECT MAX({_check_column(column)}) AS watermark FROM impact_learners_profile")
+    return result[0]["watermark"] if result else None
+
+def load_learner_changes(column: str, since: Any, seen_ids: Optional[Set[str]] = None) -> Tuple[List[tuple], Any, Set[str]]:
+    """
+    Load learner rows changed since a watermark
+    
+    Rows are read with `column >= since` so rows written later within the
+    same watermark value are not missed; rows at exactly `since` whose ids
+    are in `seen_ids` were already applied and are skipped. Without a
+    watermark (the table was empty at the full load) every row with a
+    non-NULL column is read. Rows are not
+    restricted to valid coordinates, so a learner whose coordinates were
+    cleared comes back as a row the store drops. Hard-deleted rows are not
+    detected; a full reload removes them.
+    
+    Args:
+        column: Column that increases whenever a row changes (e.g. updated_at)
+        since: Watermark returned by the previous call (or get_learner_watermark),
+            or None to read from the beginning
+        seen_ids: Ids returned by the previous call
+        
+    Returns:
+        Tuple of (rows as tuples in LEARNER_COLUMNS order, new watermark,
+        ids of the rows at the new watermark)
+    """
+    column = _check_column(column)
+    condition, params = (f"{column} IS NOT NULL", ()) if since is None else (f"{column} >= %s", (since,))
+    query = LEARNER_SELECT.replace("\n        FROM", f",\n            {column} AS watermark\n        FROM", 1) + f"""
+        WHERE
+            {condition}
+        ORDER BY
+            {column}
+    """
+    
+    start_time = time.time()
+    with get_pool().connection() as connection:
+        with connection.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+    
+    seen_ids = seen_ids or set()
+    id_position = LEARNER_COLUMNS.index('hashed_email')
+    rows = [row[:-1] for row in result if not (str(row[-1]) == str(since) and row[id_position] in seen_ids)]
+    
+    if not result:
+        return rows, since, seen_ids
+    watermark = result[-1][-1]
+    at_watermark = {row[id_position] for row in result if row[-1] == watermark}
+    if str(watermark) == str(since):
+        at_watermark |= seen_ids
+    
+    logger.info(f"Loaded {len(rows)} changed learner rows since {since} in {time.time() - start_time:.2f} seconds")
+    return rows, watermark, at_watermark
+
 def convert_to_geojson(points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Convert database points to GeoJSON format
@@ -0,0 +1,214 @@
+"""
+Bounded, thread-safe pool of database connections
+"""
+import threading
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(TimeoutError):
+    """Raised when no connection becomes available within the pool timeout"""
+
+
+class _Idle:
+    """An idle connection and when it was returned to the pool"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.since = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Hands out at most `size` connections to concurrent callers
+
+    Connections are opened lazily and reused LIFO, so a quiet pool keeps
+    using its most recently active connections. A connection that sat idle
+    for longer than `ping_interval` is pinged before it is handed out and
+    replaced if the server dropped it. Callers beyond `size` wait up to
+    `timeout` seconds for a connection to be released.
+
+    A connection released after an error is closed instead of reused,
+    since it may hold unread results or a broken session.
+    """
+    def __init__(self,
+                 connect: Callable[[], Any],
+                 size: int = 4,
+                 timeout: float = 30.0,
+                 ping_interval: float = 30.0):
+        """
+        Args:
+            connect: Opens a new connection
+            size: Maximum number of open connections
+            timeout: Seconds to wait for a free connection before raising PoolTimeoutError
+            ping_interval: Ping connections idle for longer than this many seconds before reuse
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._connect = connect
+        self._available = threading.Condition(threading.Lock())
+        self._idle = deque()
+        self._open = 0
+        self._closed = False
+
+        # Stats
+        self.acquires = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.health_check_failures = 0
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Take a connection from the pool, opening one if below the size limit
+
+        Args:
+            timeout: Seconds to wait for a free connection (pool default if None)
+
+        Returns:
+            An open connection; pass it back with `release()`
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None
+        start_time = None
+
+        with self._available:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    idle = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    idle = None
+                    self._open += 1
+                    break
+
+                if start_time is None:
+                    start_time = time.monotonic()
+                    deadline = start_time + timeout
+                    self.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self._record_wait(start_time)
+                    raise PoolTimeoutError(f"No database connection available after {timeout:.1f} seconds "
+                                           f"({self.size} in use)")
+                self._available.wait(remaining)
+
+            self.acquires += 1
+            if start_time is not None:
+                self._record_wait(start_time)
+
+        # Connecting and pinging happen outside the lock; the slot is already reserved
+        try:
+            if idle is not None:
+                if time.monotonic() - idle.since <= self.ping_interval or self._is_healthy(idle.connection):
+                    return idle.connection
+                self._close_quietly(idle.connection)
+            connection = self._connect()
+            with self._available:
+                self.connects += 1
+            return connection
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self, connection, discard: bool = False) -> None:
+        """
+        Return a connection to the pool
+
+        Args:
+            connection: Connection obtained from `acquire()`
+            discard: Close the connection instead of reusing it
+        """
+        if discard or self._closed or not getattr(connection, "open", True):
+            self._close_quietly(connection)
+            self._release_slot()
+            return
+
+        with self._available:
+            self._idle.append(_Idle(connection))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Borrow a connection for the duration of a with block
+
+        The connection is discarded if the block raises.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def close(self) -> None:
+        """Close idle connections and refuse new acquires; borrowed connections close on release"""
+        with self._available:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._available.notify_all()
+        for entry in idle:
+            self._close_quietly(entry.connection)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool usage and contention counters"""
+        with self._available:
+            idle = len(self._idle)
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._open - idle,
+                "idle": idle,
+                "acquires": self.acquires,
+                "connects": self.connects,
+                "waits": self.waits,
+                "wait_time_seconds": round(self.wait_time, 4),
+                "max_wait_seconds": round(self.max_wait_time, 4),
+                "timeouts": self.timeouts,
+                "health_check_failures": self.health_check_failures
+            }
+
+    def _record_wait(self, start_time: float) -> None:
+        # Called with the lock held
+        waited = time.monotonic() - start_time
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+
+    def _release_slot(self) -> None:
+        with self._available:
+            self._open -= 1
+            self._available.notify()
+
+    def _is_healthy(self, connection) -> bool:
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.info(f"Replacing pooled database connection that failed its health check: {e}")
+            with self._available:
+                self.health_check_failures += 1
+            return False
+
+    @staticmethod
+    def _close_quietly(connection) -> None:
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing database connection: {e}")
@@ -0,0 +1,606 @@
+"""
+Columnar, NumPy-backed storage for learner features
+"""
+import json
+import logging
+import os
+from typing import Dict, List, Any, Optional, Iterable, Sequence, Tuple
+
+import numpy as np
+
+from constants import REVERSE_FIELD_MAPPING, FILTER_TYPES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sentinel stored in int8 flag columns and categorical codes for NULL values
+NULL_CODE = -1
+
+# Describes the column files of a saved store
+MANIFEST_FILE = "store.json"
+
+
+class StringColumn:
+    """
+    Offsets-based UTF-8 string column
+
+    Row i is stored in data[offsets[i]:offsets[i + 1]]. NULL values are
+    tracked in a separate boolean mask so they round-trip as None. `data`
+    is bytes or a bytearray, or a uint8 array when the column was loaded
+    from disk.
+    """
+    def __init__(self, data: bytes, offsets: np.ndarray, nulls: Optional[np.ndarray] = None):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @classmethod
+    def from_values(cls, values: Iterable[Optional[str]]) -> "StringColumn":
+        """
+        Build a string column from an iterable of strings (or None)
+
+        Args:
+            values: Column values in row order
+
+        Returns:
+            StringColumn holding the encoded values
+        """
+        encoded = []
+        null_rows = []
+        for i, value in enumerate(values):
+            if value is None:
+                null_rows.append(i)
+                encoded.append(b"")
+            else:
+                encoded.append(str(value).encode("utf-8"))
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+        nulls = None
+        if null_rows:
+            nulls = np.zeros(len(encoded), dtype=bool)
+            nulls[null_rows] = True
+
+        return cls(b"".join(encoded), offsets, nulls)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def find(self, values: Iterable[str]) -> np.ndarray:
+        """
+        Return the rows holding any of the given values
+
+        Args:
+            values: Values to look for
+
+        Returns:
+            Sorted int64 array of matching row indices
+        """
+        wanted = {str(value).encode("utf-8") for value in values}
+        if not wanted:
+            return np.empty(0, dtype=np.int64)
+
+        # Only rows whose encoded length matches a wanted value are decoded
+        lengths = np.diff(self.offsets)
+        candidates = np.flatnonzero(np.isin(lengths, [len(value) for value in wanted]))
+        data = self.data if isinstance(self.data, bytes) else bytes(self.data)
+        starts = self.offsets[candidates].tolist()
+        ends = self.offsets[candidates + 1].tolist()
+        rows = [i for i, a, b in zip(candidates.tolist(), starts, ends) if data[a:b] in wanted]
+        if self.nulls is not None:
+            rows = [i for i in rows if not self.nulls[i]]
+        return np.array(rows, dtype=np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the column buffers in bytes"""
+        size = len(self.data) + self.offsets.nbytes
+        if self.nulls is not None:
+            size += self.nulls.nbytes
+        return size
+
+
+class _StringColumnBuilder:
+    """Appends encoded strings into a growing buffer with preallocated offsets"""
+    def __init__(self, capacity: int):
+        self.data = bytearray()
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.null_rows = []
+        self.size = 0
+
+    @classmethod
+    def from_column(cls, column: StringColumn, rows: np.ndarray, capacity: int) -> "_StringColumnBuilder":
+        """Start from the values of some rows (sorted) of an existing column"""
+        builder = cls(max(capacity, len(rows)))
+        lengths = np.diff(column.offsets)
+        np.cumsum(lengths[rows], out=builder.offsets[1:len(rows) + 1])
+
+        # Select the rows' bytes with one byte mask instead of a slice per row
+        keep = np.zeros(len(column), dtype=bool)
+        keep[rows] = True
+        data = np.frombuffer(column.data, dtype=np.uint8)
+        builder.data = bytearray(data[np.repeat(keep, lengths)].tobytes())
+        if column.nulls is not None:
+            builder.null_rows = np.flatnonzero(column.nulls[rows]).tolist()
+        builder.size = len(rows)
+        return builder
+
+    def reserve(self, capacity: int) -> None:
+        if capacity + 1 > len(self.offsets):
+            offsets = np.zeros(capacity + 1, dtype=np.int64)
+            offsets[:self.size + 1] = self.offsets[:self.size + 1]
+            self.offsets = offsets
+
+    def extend(self, values: Sequence[Optional[str]]) -> None:
+        encoded = []
+        for i, value in enumerate(values):
+            if value is None:
+                self.null_rows.append(self.size + i)
+                encoded.append(b"")
+            else:
+                encoded.append(str(value).encode("utf-8"))
+
+        end = self.size + len(encoded)
+        np.cumsum([len(b) for b in encoded], out=self.offsets[self.size + 1:end + 1])
+        self.offsets[self.size + 1:end + 1] += self.offsets[self.size]
+        self.data += b"".join(encoded)
+        self.size = end
+
+    def finish(self) -> StringColumn:
+        nulls = None
+        if self.null_rows:
+            nulls = np.zeros(self.size, dtype=bool)
+            nulls[self.null_rows] = True
+        return StringColumn(self.data, self.offsets[:self.size + 1], nulls)
+
+
+class CategoricalColumn:
+    """
+    Dictionary-encoded categorical column
+
+    Each row holds an int32 code into `categories`; NULL values use NULL_CODE.
+    """
+    def __init__(self, codes: np.ndarray, categories: List[Any]):
+        self.codes = codes
+        self.categories = categories
+        self._lookup = {value: code for code, value in enumerate(categories)}
+
+    @classmethod
+    def from_values(cls, values: Iterable[Any]) -> "CategoricalColumn":
+        """
+        Build a categorical column from an iterable of values (or None)
+
+        Args:
+            values: Column values in row order
+
+        Returns:
+            CategoricalColumn holding the encoded values
+        """
+        lookup = {}
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(NULL_CODE)
+                continue
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(lookup)
+            codes.append(code)
+
+        return cls(np.array(codes, dtype=np.int32), list(lookup))
+
+    def code_of(self, value: Any) -> Optional[int]:
+        """Return the code for a value, or None if it never occurs"""
+        return self._lookup.get(value)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> Any:
+        code = self.codes[i]
+        if code == NULL_CODE:
+            return None
+        return self.categories[code]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the codes array in bytes"""
+        return self.codes.nbytes
+
+
+class FeatureStore:
+    """
+    Columnar store of learner points
+
+    Holds a float64 (N, 2) coordinate array, one int8 array per boolean flag,
+    dictionary-encoded categorical columns and offsets-based string columns.
+    GeoJSON features are only materialised on demand via `feature()`.
+    """
+    def __init__(self,
+                 coordinates: np.ndarray,
+                 ids: StringColumn,
+                 names: StringColumn,
+                 flags: Dict[str, np.ndarray],
+                 categoricals: Dict[str, CategoricalColumn]):
+        self.coordinates = coordinates
+        self.ids = ids
+        self.names = names
+        self.flags = flags
+        self.categoricals = categoricals
+
+    @classmethod
+    def from_points(cls, points: Sequence[Dict[str, Any]]) -> "FeatureStore":
+        """
+        Build a store from database rows
+
+        Rows without valid coordinates are skipped, matching `convert_to_geojson`.
+
+        Args:
+            points: List of learner points from the database
+
+        Returns:
+            FeatureStore holding the valid rows
+        """
+        rows = [p for p in points if p.get('latitude') and p.get('longitude')]
+        columns = list(rows[0].keys()) if rows else ['latitude', 'longitude']
+
+        builder = FeatureStoreBuilder(columns, capacity=len(rows))
+        builder.append([tuple(row.get(column) for column in columns) for row in rows])
+        return builder.finish()
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def feature(self, i: int) -> Dict[str, Any]:
+        """
+        Build the GeoJSON Feature for a single row
+
+        Args:
+            i: Row index in the store
+
+        Returns:
+            GeoJSON Feature identical to the one produced by `convert_to_geojson`
+        """
+        properties = {
+            "id": self.ids[i],
+            "full_name": self.names[i]
+        }
+
+        for geojson_key, db_key in REVERSE_FIELD_MAPPING.items():
+            if db_key in self.flags:
+                value = self.flags[db_key][i]
+                properties[geojson_key] = None if value == NULL_CODE else int(value)
+            elif db_key in self.categoricals:
+                properties[geojson_key] = self.categoricals[db_key][i]
+
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [float(self.coordinates[i, 0]), float(self.coordinates[i, 1])]
+            },
+            "properties": properties
+        }
+
+    def save(self, directory: str) -> None:
+        """
+        Write the columns to a directory as .npy files plus a JSON manifest
+
+        Args:
+            directory: Existing directory to write into
+        """
+        arrays = {"coordinates": self.coordinates}
+        manifest = {"rows": len(self), "strings": {}, "flags": list(self.flags), "categoricals": {}}
+
+        for name, column in (("ids", self.ids), ("names", self.names)):
+            arrays[f"{name}.data"] = np.frombuffer(column.data, dtype=np.uint8)
+            arrays[f"{name}.offsets"] = column.offsets
+            if column.nulls is not None:
+                arrays[f"{name}.nulls"] = column.nulls
+            manifest["strings"][name] = column.nulls is not None
+
+        for key, column in self.flags.items():
+            arrays[f"flag.{key}"] = column
+
+        for key, column in self.categoricals.items():
+            arrays[f"categorical.{key}"] = column.codes
+            manifest["categoricals"][key] = column.categories
+
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "FeatureStore":
+        """
+        Load a store written by `save()`
+
+        Args:
+            directory: Directory the store was saved to
+            mmap: Map the column files read-only instead of reading them, so
+                processes loading the same files share their pages
+
+        Returns:
+            FeatureStore over the saved columns
+        """
+        mmap_mode = "r" if mmap else None
+
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+
+        strings = {
+            name: StringColumn(array(f"{name}.data"), array(f"{name}.offsets"),
+                               array(f"{name}.nulls") if has_nulls else None)
+            for name, has_nulls in manifest["strings"].items()
+        }
+        flags = {key: array(f"flag.{key}") for key in manifest["flags"]}
+        categoricals = {
+            key: CategoricalColumn(array(f"categorical.{key}"), categories)
+            for key, categories in manifest["categoricals"].items()
+        }
+
+        store = cls(array("coordinates"), strings["ids"], strings["names"], flags, categoricals)
+        if len(store) != manifest["rows"]:
+            raise ValueError(f"Feature store in {directory} is incomplete")
+        return store
+
+    def view(self, rows: Optional[np.ndarray] = None) -> "FeatureView":
+        """Return a view over the given rows (all rows if None)"""
+        return FeatureView(self, rows)
+
+    def apply_changes(self, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> Tuple["FeatureStore", np.ndarray]:
+        """
+        Return a copy of the store with changed database rows applied
+
+        Rows are matched by hashed_email. Existing rows for a changed id are
+        removed and the new versions appended at the end, so a row whose
+        coordinates became NULL is dropped. The store itself is not modified
+        (it may be mapped read-only and still in use by readers).
+
+        Args:
+            columns: Column names, in the order values appear in each row
+            rows: Changed rows as tuples
+
+        Returns:
+            Tuple of (new store, row_map) where row_map[old_row] is the row's
+            index in the new store, or -1 if it was removed
+        """
+        id_position = list(columns).index('hashed_email')
+        removed = self.ids.find(row[id_position] for row in rows)
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[removed] = False
+        kept_rows = np.flatnonzero(keep)
+        row_map = np.full(len(self), -1, dtype=np.int64)
+        row_map[kept_rows] = np.arange(len(kept_rows))
+
+        builder = FeatureStoreBuilder.from_store(self, kept_rows, columns, capacity=len(kept_rows) + len(rows))
+        builder.append(rows)
+        return builder.finish(), row_map
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by all column buffers in bytes"""
+        size = self.coordinates.nbytes + self.ids.nbytes + self.names.nbytes
+        size += sum(column.nbytes for column in self.flags.values())
+        size += sum(column.nbytes for column in self.categoricals.values())
+        return size
+
+
+class FeatureStoreBuilder:
+    """
+    Builds a FeatureStore from row tuples appended in chunks
+
+    Columns are preallocated for the expected number of rows (and grown by
+    doubling if more arrive), so a loader can stream rows from a cursor and
+    drop each chunk once it is written, instead of holding every row.
+    """
+    def __init__(self, columns: Sequence[str], capacity: int = 0):
+        """
+        Args:
+            columns: Column names, in the order values appear in each row;
+                must include latitude and longitude
+            capacity: Expected number of rows
+        """
+        self._positions = {column: i for i, column in enumerate(columns)}
+        self._size = 0
+        self._capacity = max(capacity, 0)
+
+        self._coordinates = np.empty((self._capacity, 2), dtype=np.float64)
+        self._strings = {
+            name: _StringColumnBuilder(self._capacity)
+            for name in ('hashed_email', 'full_name')
+        }
+        self._flags = {
+            key: np.empty(self._capacity, dtype=np.int8)
+            for key in FILTER_TYPES['boolean_filters'] if key in self._positions
+        }
+        self._categoricals = {
+            key: (np.empty(self._capacity, dtype=np.int32), {})
+            for key in FILTER_TYPES['string_filters'] if key in self._positions
+        }
+
+    @classmethod
+    def from_store(cls, store: FeatureStore, rows: np.ndarray, columns: Sequence[str],
+                   capacity: int = 0) -> "FeatureStoreBuilder":
+        """
+        Start a builder from some rows of an existing store
+
+        Categorical codes of the store stay valid; new values get new codes.
+
+        Args:
+            store: Store to copy rows from
+            rows: Sorted row indices to copy
+            columns: Column names of rows appended afterwards
+            capacity: Expected number of rows including the copied ones
+
+        Returns:
+            FeatureStoreBuilder holding the copied rows
+        """
+        builder = cls(columns, 0)
+        size = len(rows)
+        capacity = max(capacity, size)
+
+        builder._coordinates = np.empty((capacity, 2), dtype=np.float64)
+        builder._coordinates[:size] = store.coordinates[rows]
+        builder._strings = {
+            'hashed_email': _StringColumnBuilder.from_column(store.ids, rows, capacity),
+            'full_name': _StringColumnBuilder.from_column(store.names, rows, capacity)
+        }
+        builder._flags = {}
+        for key, column in store.flags.items():
+            builder._flags[key] = np.empty(capacity, dtype=np.int8)
+            builder._flags[key][:size] = column[rows]
+        builder._categoricals = {}
+        for key, column in store.categoricals.items():
+            codes = np.empty(capacity, dtype=np.int32)
+            codes[:size] = column.codes[rows]
+            builder._categoricals[key] = (codes, {value: code for code, value in enumerate(column.categories)})
+
+        builder._size = size
+        builder._capacity = capacity
+        return builder
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= self._capacity:
+            return
+        capacity = max(capacity, 2 * self._capacity)
+        logger.debug(f"Growing feature store builder from {self._capacity} to {capacity} rows")
+
+        def grow(array: np.ndarray) -> np.ndarray:
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            return grown
+
+        self._coordinates = grow(self._coordinates)
+        for builder in self._strings.values():
+            builder.reserve(capacity)
+        self._flags = {key: grow(column) for key, column in self._flags.items()}
+        self._categoricals = {
+            key: (grow(codes), lookup) for key, (codes, lookup) in self._categoricals.items()
+        }
+        self._capacity = capacity
+
+    def append(self, rows: Sequence[Sequence[Any]]) -> None:
+        """
+        Append a chunk of rows
+
+        Rows without valid coordinates are skipped, matching `convert_to_geojson`.
+
+        Args:
+            rows: Row tuples with values in column order
+        """
+        lat = self._positions['latitude']
+        lng = self._positions['longitude']
+        rows = [row for row in rows if row[lat] and row[lng]]
+        if not rows:
+            return
+
+        start = self._size
+        end = start + len(rows)
+        self._reserve(end)
+        values = list(zip(*rows))
+
+        self._coordinates[start:end, 0] = np.array(values[lng], dtype=np.float64)
+        self._coordinates[start:end, 1] = np.array(values[lat], dtype=np.float64)
+
+        for name, builder in self._strings.items():
+            position = self._positions.get(name)
+            builder.extend(values[position] if position is not None else [''] * len(rows))
+
+        for key, column in self._flags.items():
+            column[start:end] = [
+                NULL_CODE if value is None else value for value in values[self._positions[key]]
+            ]
+
+        for key, (codes, lookup) in self._categoricals.items():
+            chunk = codes[start:end]
+            for i, value in enumerate(values[self._positions[key]]):
+                if value is None:
+                    chunk[i] = NULL_CODE
+                    continue
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(lookup)
+                chunk[i] = code
+
+        self._size = end
+
+    def finish(self) -> FeatureStore:
+        """
+        Return the store holding the appended rows
+
+        The builder must not be used afterwards.
+        """
+        size = self._size
+        categoricals = {
+            key: CategoricalColumn(codes[:size], list(lookup))
+            for key, (codes, lookup) in self._categoricals.items()
+        }
+        return FeatureStore(
+            self._coordinates[:size],
+            self._strings['hashed_email'].finish(),
+            self._strings['full_name'].finish(),
+            {key: column[:size] for key, column in self._flags.items()},
+            categoricals)
+
+
+class FeatureView(Sequence):
+    """
+    Read-only sequence of GeoJSON features backed by a FeatureStore
+
+    Filtered views hold an index array into the store instead of copies of
+    the rows. Position i in the view corresponds to point id i in an index
+    built from `coordinates()`.
+    """
+    def __init__(self, store: FeatureStore, rows: Optional[np.ndarray] = None):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.store) if self.rows is None else len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("feature index out of range")
+        return self.store.feature(self.row(i))
+
+    def row(self, i: int) -> int:
+        """Map a position in the view to a row index in the store"""
+        return i if self.rows is None else int(self.rows[i])
+
+    def row_indices(self) -> np.ndarray:
+        """Return the store row indices covered by this view"""
+        if self.rows is None:
+            return np.arange(len(self.store), dtype=np.int64)
+        return self.rows
+
+    def coordinates(self) -> np.ndarray:
+        """Return the (N, 2) [longitude, latitude] array for this view"""
+        if self.rows is None:
+            return self.store.coordinates
+        return self.store.coordinates[self.rows]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by this view: the whole store if unfiltered, else the index array"""
+        return self.store.nbytes if self.rows is None else self.rows.nbytes
@@ -0,0 +1,77 @@
+"""
+Query-time filtering of a SuperCluster index
+
+A FilteredIndexView answers a filter combination from the "all" index
+instead of building an index of the matching points. `SuperCluster.filter`
+counts the matching points of every cluster on every zoom level in one pass
+over the cluster hierarchy (about 0.15 seconds and 8 bytes per index entry
+for 1.4M learners, against seconds to build a filtered index), and queries
+through the view skip clusters without matching points.
+
+Accuracy contract, compared with an index built from the matching points:
+
+- Counts are exact: `point_count` is the number of matching points in the
+  cluster, and every matching point is in exactly one returned feature.
+- A cluster with a single matching point is returned as that point, at its
+  own coordinates and with its own properties.
+- Other clusters keep the position and grouping of the unfiltered index:
+  they sit at the centroid of all their points, so they can be off from the
+  centroid of their matching points by up to the cluster radius, and two
+  filtered clusters can be closer together than a dedicated index would
+  allow.
+- `expansion_zoom` in query results is the zoom at which the unfiltered
+  cluster splits; the filtered cluster may still be a single cluster there.
+  `getClusterExpansionZoom` through the view returns the filtered one.
+- Clusters carry no attribute aggregates (and so no layer counts), since
+  those cover every point of a cluster.
+"""
+import numpy as np
+
+
+class FilteredIndexView:
+    """
+    The query API of a SuperCluster index restricted to the points of a mask
+
+    Point and cluster ids are those of the underlying index, so results
+    resolve against the same features.
+    """
+    def __init__(self, index, mask: np.ndarray):
+        """
+        Args:
+            index: pysupercluster.SuperCluster over all points
+            mask: Boolean array with one entry per point of the index, by point id
+        """
+        self.index = index
+        self.filter = index.filter(mask)
+
+    @property
+    def point_count(self) -> int:
+        """Number of points that pass the filter"""
+        return self.filter.count
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the per-cluster counts in bytes"""
+        return self.filter.nbytes
+
+    def getClusters(self, top_left, bottom_right, zoom):
+        return self.index.getClusters(top_left=top_left, bottom_right=bottom_right, zoom=zoom, filter=self.filter)
+
+    def getClustersArrays(self, top_left, bottom_right, zoom):
+        return self.index.getClustersArrays(top_left=top_left, bottom_right=bottom_right, zoom=zoom,
+                                            filter=self.filter)
+
+    def getClustersBatch(self, queries, threads=1):
+        return self.index.getClustersBatch(queries, threads=threads, filter=self.filter)
+
+    def getTile(self, z, x, y):
+        return self.index.getTile(z, x, y, filter=self.filter)
+
+    def getChildren(self, cluster_id):
+        return self.index.getChildren(cluster_id, filter=self.filter)
+
+    def getLeaves(self, cluster_id, limit=10, offset=0):
+        return self.index.getLeaves(cluster_id, limit=limit, offset=offset, filter=self.filter)
+
+    def getClusterExpansionZoom(self, cluster_id):
+        return self.index.getClusterExpansionZoom(cluster_id, filter=self.filter)
@@ -0,0 +1,182 @@
+"""
+Direct JSON encoding of /api/getClusters responses
+
+Writes the body of a `ClusterResponse` straight from pysupercluster result
+arrays, skipping response model validation and `jsonable_encoder`. The
+output is byte-identical to what FastAPI sends for the model from 0.130
+on (the floor in requirements.txt), where response models are serialized
+by pydantic_core: compact separators, UTF-8 strings and pydantic's float
+formatting, which orjson matches for every value below 1e16 (coordinates
+never get close). Older versions went through `json.dumps` and wrote
+small coordinates such as 1e-05 in exponent form.
+"""
+import logging
+import time
+import weakref
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+import orjson
+
+from feature_store import FeatureStore, FeatureView
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE = "application/json"
+
+# Fragment cache modes
+FRAGMENTS_OFF = "off"
+FRAGMENTS_LAZY = "lazy"
+FRAGMENTS_PRECOMPUTE = "precompute"
+FRAGMENT_MODES = (FRAGMENTS_OFF, FRAGMENTS_LAZY, FRAGMENTS_PRECOMPUTE)
+
+_CLUSTER = (b'{"type":"Feature","geometry":{"type":"Point","coordinates":[%s,%s]},'
+            b'"properties":{"cluster":true,"cluster_id":"%d","point_count":%d,'
+            b'"point_count_abbreviated":%d,"expansion_zoom":%s}}')
+_UNKNOWN_POINT = (b'{"type":"Feature","geometry":{"type":"Point","coordinates":[%s,%s]},'
+                  b'"properties":{"id":"%d"}}')
+
+
+class FeatureFragments:
+    """
+    Cache of the encoded JSON of each feature in a FeatureStore
+
+    Fragments are encoded on first use, or all at once by `precompute()`.
+    A fully populated cache costs roughly 300 bytes per point (about 400 MB
+    for 1.4M learners) and turns serializing a point into a lookup.
+    """
+    def __init__(self, store: FeatureStore, fragments: Optional[np.ndarray] = None):
+        self.store = store
+        self.fragments = fragments if fragments is not None else np.full(len(store), None, dtype=object)
+
+    def __getitem__(self, row: int) -> bytes:
+        fragment = self.fragments[row]
+        if fragment is None:
+            # Concurrent misses encode the same bytes, so the race is harmless
+            fragment = orjson.dumps(self.store.feature(row))
+            self.fragments[row] = fragment
+        return fragment
+
+    def precompute(self) -> None:
+        """Encode every feature that is not cached yet"""
+        start_time = time.time()
+        missing = np.flatnonzero(np.equal(self.fragments, None))
+        for row in missing.tolist():
+            self.fragments[row] = orjson.dumps(self.store.feature(row))
+        logger.info(f"Encoded {len(missing)} GeoJSON fragments in {time.time() - start_time:.2f} seconds")
+
+    def remap(self, store: FeatureStore, row_map: np.ndarray) -> "FeatureFragments":
+        """
+        Carry cached fragments over to a store produced by `FeatureStore.apply_changes`
+
+        Args:
+            store: The new store
+            row_map: row_map returned with it (old row -> new row, -1 if removed)
+
+        Returns:
+            Fragments of the new store; changed rows are encoded on first use
+        """
+        kept = np.flatnonzero(row_map >= 0)
+        fragments = np.full(len(store), None, dtype=object)
+        fragments[row_map[kept]] = self.fragments[kept]
+        return FeatureFragments(store, fragments)
+
+    @property
+    def cached(self) -> int:
+        """Number of features with an encoded fragment"""
+        return len(self.fragments) - int(np.equal(self.fragments, None).sum())
+
+
+# Fragment caches by store; a cache lives as long as its store
+_fragments = weakref.WeakKeyDictionary()
+
+
+def enable_fragments(store: FeatureStore, previous: Optional[FeatureStore] = None,
+                     row_map: Optional[np.ndarray] = None) -> FeatureFragments:
+    """
+    Cache encoded features of a store for `encode_cluster_response`
+
+    Args:
+        store: Store whose features should be cached
+        previous: Store `store` was derived from with `apply_changes`; its
+            cached fragments are carried over
+        row_map: row_map returned by `apply_changes` with `store`
+
+    Returns:
+        The store's FeatureFragments
+    """
+    fragments = _fragments.get(store)
+    if fragments is None:
+        source = _fragments.get(previous) if previous is not None else None
+        if source is not None and row_map is not None:
+            fragments = source.remap(store, row_map)
+        else:
+            fragments = FeatureFragments(store)
+        _fragments[store] = fragments
+    return fragments
+
+
+def get_fragments(store: FeatureStore) -> Optional[FeatureFragments]:
+    """Return the fragment cache of a store, or None if caching is not enabled for it"""
+    return _fragments.get(store)
+
+
+def _float_list(values: np.ndarray) -> Sequence[bytes]:
+    """Encode float64 values exactly as they appear inside a JSON array"""
+    if len(values) == 0:
+        return []
+    return orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1].split(b",")
+
+
+def encode_cluster_response(clusters: Dict[str, np.ndarray], original_features: Sequence[Dict[str, Any]],
+                            layer_names: Sequence[str] = ()) -> bytes:
+    """
+    Encode a `getClustersArrays` result as the JSON of a ClusterResponse
+
+    Produces the same bytes as serializing the features built by
+    `main.cluster_feature` through the response model.
+
+    Args:
+        clusters: Result arrays of `getClustersArrays`
+        original_features: Features of the index, by point id
+        layer_names: Names of the index attributes; when given, clusters get a
+            `layer_counts` property with the attribute sums by name
+
+    Returns:
+        UTF-8 JSON body `{"features":[...]}`
+    """
+    fragments = None
+    if isinstance(original_features, FeatureView):
+        fragments = _fragments.get(original_features.store)
+    feature_count = len(original_features)
+
+    if layer_names and "sum" in clusters:
+        layer_keys = [orjson.dumps(name) + b":" for name in layer_names]
+        layer_sums = clusters["sum"].astype(np.int64).tolist()
+    else:
+        layer_keys = layer_sums = None
+
+    parts = []
+    for i, (longitude, latitude, count, cluster_id, expansion_zoom) in enumerate(zip(
+            _float_list(clusters['longitude']),
+            _float_list(clusters['latitude']),
+            clusters['count'].tolist(),
+            clusters['id'].tolist(),
+            clusters['expansion_zoom'].tolist())):
+        if count > 1:
+            zoom = b"%d" % expansion_zoom if expansion_zoom >= 0 else b"null"
+            cluster = _CLUSTER % (longitude, latitude, cluster_id, count, count, zoom)
+            if layer_sums is not None:
+                counts = b",".join(key + b"%d" % value for key, value in zip(layer_keys, layer_sums[i]))
+                cluster = cluster[:-2] + b',"layer_counts":{' + counts + b"}}}"
+            parts.append(cluster)
+        elif cluster_id < feature_count:
+            if fragments is not None:
+                parts.append(fragments[original_features.row(cluster_id)])
+            else:
+                parts.append(orjson.dumps(original_features[cluster_id]))
+        else:
+            parts.append(_UNKNOWN_POINT % (longitude, latitude, cluster_id))
+
+    return b'{"features":[' + b",".join(parts) + b"]}"
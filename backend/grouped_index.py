@@ -0,0 +1,321 @@
+"""
+Clustering of points grouped by identical coordinates
+
+Learner coordinates are rounded to 5 decimals and many learners geocode to
+the same city centroid, so an index over learners clusters many identical
+points on every zoom level. A GroupedIndex builds the SuperCluster index
+over the distinct locations instead, each weighted by its number of points,
+and keeps the points of every location to answer queries by point.
+
+Compared with an index over the points themselves:
+
+- Counts, positions and the grouping of clusters are the same (up to
+  rounding of the cluster centroids); cluster ids differ.
+- A location with several points is returned as a cluster with a location
+  id and an `expansion_zoom` of max_zoom + 1, also on zoom levels past
+  max_zoom, where an index over the points returns them one by one (all at
+  the same position). `getChildren` and `getLeaves` of a location id list
+  its points.
+- A location with a single point, and every leaf, is returned as that
+  point, by its position in the features the index was built from.
+
+Public ids follow the point index layout: point ids are positions in the
+features (below N, the number of points), and location and cluster ids are
+offset by N. Location ids are N + 32 * location, which no cluster id takes
+since the low 5 bits of a cluster id hold its zoom + 1.
+"""
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Add the pysupercluster directory to the path so we can import it
+sys.path.append(os.path.join(os.path.dirname(__file__), "pysupercluster"))
+import pysupercluster
+
+
+def group_coordinates(coordinates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group points by identical coordinates
+
+    Locations are numbered in the order their first point occurs, so the
+    clustering pass picks cluster seeds in the same order as it would over
+    the points.
+
+    Args:
+        coordinates: (N, 2) float64 array of [longitude, latitude]
+
+    Returns:
+        Tuple of (members, offsets): the points of location l are
+        members[offsets[l]:offsets[l + 1]], in input order
+    """
+    if len(coordinates) == 0:
+        return np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    # One complex value per point sorts by longitude, then latitude
+    keys = np.ascontiguousarray(coordinates, dtype=np.float64).view(np.complex128).ravel()
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    # The stable sort puts each location's first point at its start
+    by_first = np.argsort(order[starts], kind="stable")
+    rank = np.empty(len(starts), dtype=np.int64)
+    rank[by_first] = np.arange(len(starts))
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(counts[by_first], out=offsets[1:])
+    group = np.repeat(np.arange(len(starts)), counts)
+    members = np.empty(len(keys), dtype=np.int64)
+    members[offsets[rank[group]] + np.arange(len(keys)) - starts[group]] = order
+    return members, offsets
+
+
+class GroupFilter:
+    """
+    A point filter over a GroupedIndex, for the filter= argument of its queries
+
+    Holds the per-location matching counts in the SuperCluster filter and,
+    per location, its first matching point.
+    """
+    def __init__(self, grouped: "GroupedIndex", mask: np.ndarray):
+        """
+        Args:
+            grouped: Index the filter applies to
+            mask: Boolean array with one entry per point, by position in the features
+        """
+        self.mask = np.asarray(mask, dtype=bool)
+        if len(self.mask) != len(grouped.members):
+            raise ValueError("mask must have one entry per point.")
+        matching = self.mask[grouped.members]
+        self.filter = grouped.index.filter(np.add.reduceat(matching.astype(np.int64), grouped.offsets[:-1]))
+
+        # First matching point of each location (-1 if none)
+        positions = np.flatnonzero(matching)
+        locations = np.searchsorted(grouped.offsets, positions, side="right") - 1
+        locations, first = np.unique(locations, return_index=True)
+        self.first = np.full(grouped.location_count, -1, dtype=np.int64)
+        self.first[locations] = grouped.members[positions[first]]
+
+    @property
+    def count(self) -> int:
+        """Number of points that pass the filter"""
+        return self.filter.count
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the filter in bytes"""
+        return self.filter.nbytes + self.mask.nbytes + self.first.nbytes
+
+
+class GroupedIndex:
+    """
+    The query API of a SuperCluster index over the points, answered from an
+    index over their distinct locations
+    """
+    def __init__(self, index, members: np.ndarray, offsets: np.ndarray, coordinates: np.ndarray, max_zoom: int):
+        """
+        Args:
+            index: pysupercluster.SuperCluster over the locations, weighted by
+                their number of points
+            members: Points of every location (see `group_coordinates`)
+            offsets: Start of every location in members, plus the end
+            coordinates: (L, 2) array of [longitude, latitude] per location
+            max_zoom: Maximum zoom level the index was built with
+        """
+        self.index = index
+        self.members = members
+        self.offsets = offsets
+        self.coordinates = coordinates
+        self.max_zoom = max_zoom
+
+    @classmethod
+    def build(cls, coordinates: np.ndarray, attributes: Optional[np.ndarray] = None, **options) -> "GroupedIndex":
+        """
+        Group points by identical coordinates and build the index over the locations
+
+        Args:
+            coordinates: (N, 2) array of [longitude, latitude]
+            attributes: Per-point attribute columns; each location gets the
+                sums over its points, so cluster sums are exact (minimums and
+                maximums are those of the location sums)
+            **options: SuperCluster options (min_zoom, max_zoom, radius, ...)
+        """
+        members, offsets = group_coordinates(coordinates)
+        starts = offsets[:-1]
+        locations = np.ascontiguousarray(coordinates[members[starts]], dtype=np.float64)
+        if attributes is not None:
+            options["attributes"] = np.add.reduceat(attributes[members], starts, axis=0)
+        index = pysupercluster.SuperCluster(locations, weights=np.diff(offsets), **options)
+        return cls(index, members, offsets, locations, options.get("max_zoom", 16))
+
+    def save(self, path: str) -> None:
+        """Write the index to path and the groups next to it"""
+        self.index.save(path)
+        for name in _GROUP_ARRAYS:
+            np.save(f"{path}.{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, max_zoom: int) -> "GroupedIndex":
+        """Map an index written by `save`"""
+        index = pysupercluster.SuperCluster.load(path)
+        arrays = [np.load(f"{path}.{name}.npy", mmap_mode="r") for name in _GROUP_ARRAYS]
+        return cls(index, *arrays, max_zoom)
+
+    @staticmethod
+    def saved(path: str) -> bool:
+        """Whether an index file was written by `GroupedIndex.save`"""
+        return os.path.exists(f"{path}.{_GROUP_ARRAYS[0]}.npy")
+
+    @property
+    def point_count(self) -> int:
+        """Number of points"""
+        return len(self.members)
+
+    @property
+    def location_count(self) -> int:
+        """Number of distinct locations, the points of the SuperCluster index"""
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the groups in bytes (the SuperCluster index not included)"""
+        return sum(getattr(self, name).nbytes for name in _GROUP_ARRAYS)
+
+    @property
+    def num_attributes(self) -> int:
+        return self.index.num_attributes
+
+    def filter(self, mask: np.ndarray) -> GroupFilter:
+        """Count the points of every cluster that pass a boolean mask over the points"""
+        return GroupFilter(self, mask)
+
+    def getClusters(self, top_left, bottom_right, zoom, filter=None):
+        clusters = self.index.getClusters(top_left=top_left, bottom_right=bottom_right, zoom=zoom,
+                                          **self._native(filter))
+        return self._public_dicts(clusters, filter)
+
+    def getClustersArrays(self, top_left, bottom_right, zoom, filter=None):
+        arrays = self.index.getClustersArrays(top_left=top_left, bottom_right=bottom_right, zoom=zoom,
+                                              **self._native(filter))
+        return self._public_arrays(arrays, filter)
+
+    def getClustersBatch(self, queries, threads=1, filter=None):
+        return self._public_arrays(self.index.getClustersBatch(queries, threads=threads, **self._native(filter)),
+                                   filter)
+
+    def getTile(self, z, x, y, filter=None):
+        return self._public_arrays(self.index.getTile(z, x, y, **self._native(filter)), filter)
+
+    def getChildren(self, cluster_id, filter=None):
+        kind, native_id = self._resolve(cluster_id)
+        if kind == "location":
+            return [self._point(native_id, position) for position in self._location_points(native_id, filter)]
+        return self._public_dicts(self.index.getChildren(native_id, **self._native(filter)), filter)
+
+    def getLeaves(self, cluster_id, limit=10, offset=0, filter=None):
+        kind, native_id = self._resolve(cluster_id)
+        if kind == "location":
+            points = self._location_points(native_id, filter)[offset:offset + limit]
+            return [self._point(native_id, position) for position in points]
+        leaves = []
+        if limit > 0:
+            self._append_leaves(leaves, native_id, limit, offset, 0, filter)
+        else:
+            self.index.getChildren(native_id, **self._native(filter))
+        return leaves
+
+    def getClusterExpansionZoom(self, cluster_id, filter=None):
+        kind, native_id = self._resolve(cluster_id)
+        if kind == "location":
+            self._location_points(native_id, filter)
+            return self.max_zoom + 1
+        return self.index.getClusterExpansionZoom(native_id, **self._native(filter))
+
+    def _native(self, group_filter: Optional[GroupFilter]) -> Dict[str, Any]:
+        """Keyword arguments passing a filter on to the SuperCluster index"""
+        return {"filter": group_filter.filter} if group_filter is not None else {}
+
+    def _public_arrays(self, arrays: Dict[str, np.ndarray], group_filter: Optional[GroupFilter]) -> Dict[str, np.ndarray]:
+        """Replace the location and cluster ids of a result by public ids, in place"""
+        ids = arrays["id"].astype(np.int64)
+        counts = arrays["count"]
+        locations = ids < self.location_count
+        public = ids - self.location_count + self.point_count
+        groups = locations & (counts > 1)
+        public[groups] = self.point_count + 32 * ids[groups]
+        singles = locations & (counts == 1)
+        firsts = self.members[self.offsets[:-1]] if group_filter is None else group_filter.first
+        public[singles] = firsts[ids[singles]]
+        arrays["id"] = public.astype(arrays["id"].dtype, copy=False)
+        arrays["expansion_zoom"][groups] = self.max_zoom + 1
+        return arrays
+
+    def _public_dicts(self, clusters: List[Dict[str, Any]], group_filter: Optional[GroupFilter]) -> List[Dict[str, Any]]:
+        """Replace the location and cluster ids of a list result by public ids, in place"""
+        if not clusters:
+            return clusters
+        arrays = self._public_arrays({
+            "id": np.array([c["id"] for c in clusters], dtype=np.int64),
+            "count": np.array([c["count"] for c in clusters], dtype=np.int64),
+            "expansion_zoom": np.array([-1 if c["expansion_zoom"] is None else c["expansion_zoom"]
+                                        for c in clusters], dtype=np.int64)
+        }, group_filter)
+        for cluster, cluster_id, expansion_zoom in zip(clusters, arrays["id"].tolist(), arrays["expansion_zoom"].tolist()):
+            cluster["id"] = cluster_id
+            cluster["expansion_zoom"] = None if expansion_zoom < 0 else expansion_zoom
+        return clusters
+
+    def _resolve(self, cluster_id: int) -> Tuple[str, int]:
+        """Map a public cluster id to ("location", location) or ("cluster", SuperCluster cluster id)"""
+        offset = cluster_id - self.point_count
+        if offset < 0:
+            raise ValueError("No cluster with the specified id.")
+        if offset % 32 == 0:
+            if offset // 32 >= self.location_count:
+                raise ValueError("No cluster with the specified id.")
+            return "location", offset // 32
+        return "cluster", offset + self.location_count
+
+    def _location_points(self, location: int, group_filter: Optional[GroupFilter]) -> np.ndarray:
+        """Points of a location that pass the filter, by position in the features"""
+        points = self.members[self.offsets[location]:self.offsets[location + 1]]
+        if group_filter is not None:
+            points = points[group_filter.mask[points]]
+            if len(points) == 0:
+                raise ValueError("No cluster with the specified id.")
+        return points
+
+    def _point(self, location: int, position: int) -> Dict[str, Any]:
+        """Query result of a single point (without attribute aggregates)"""
+        longitude, latitude = self.coordinates[location].tolist()
+        return {"longitude": longitude, "latitude": latitude, "count": 1, "id": int(position), "expansion_zoom": None}
+
+    def _append_leaves(self, leaves: List[Dict[str, Any]], cluster_id: int, limit: int, offset: int, skipped: int,
+                       group_filter: Optional[GroupFilter]) -> int:
+        """
+        Add the points of a SuperCluster cluster to leaves, paginated by point
+
+        Follows the leaf walk of the extension, with offsets in points:
+        whole clusters and locations before the offset are skipped by their
+        counts, and a location straddling it contributes its remaining points.
+
+        Returns:
+            Number of points skipped so far
+        """
+        for child in self.index.getChildren(cluster_id, **self._native(group_filter)):
+            count = child["count"]
+            if skipped + count <= offset:
+                skipped += count
+            elif child["id"] >= self.location_count:
+                skipped = self._append_leaves(leaves, child["id"], limit, offset, skipped, group_filter)
+            else:
+                points = self._location_points(child["id"], group_filter)[max(offset - skipped, 0):]
+                leaves.extend(self._point(child["id"], position) for position in points[:limit - len(leaves)])
+                skipped = offset
+            if len(leaves) == limit:
+                break
+        return skipped
+
+
+# Arrays of a GroupedIndex saved next to its SuperCluster index file
+_GROUP_ARRAYS = ("members", "offsets", "coordinates")
@@ -1,20 +1,34 @@
 import sys
 import os
 import numpy as np
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Sequence
 import time
 import logging
 import gc
 import psutil
 import traceback
+import threading
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import nullcontext
 from pympler import asizeof
 
 # Add the pysupercluster directory to the path so we can import it
 sys.path.append(os.path.join(os.path.dirname(__file__), "pysupercluster"))
 import pysupercluster
 
-from db import load_learner_points, convert_to_geojson, generate_filter_key
-from constants import FIELD_MAPPING, FILTER_TYPES
+from db import (load_learner_store, load_learner_changes, get_learner_watermark, generate_filter_key,
+                get_pool_stats, LoadProgress, LEARNER_COLUMNS)
+from constants import FIELD_MAPPING, LAYER_DEFINITIONS
+from feature_store import FeatureStore, FeatureView
+from filter_engine import BitmapFilterEngine
+from cache_policy import IndexCachePolicy, INDEX_BYTES_PER_POINT
+from singleflight import SingleFlight
+from index_snapshot import save_snapshot, load_snapshot, builder_lock, SHARED_MEMORY_DIR
+from geojson_encoder import enable_fragments, get_fragments, FRAGMENTS_OFF, FRAGMENTS_PRECOMPUTE, FRAGMENT_MODES
+from filtered_index import FilteredIndexView
+from grouped_index import GroupedIndex
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -25,11 +39,49 @@ def get_memory_usage():
     memory_info = process.memory_info()
     return memory_info.rss / 1024 / 1024  # Convert to MB
 
+class IndexGeneration:
+    """
+    One published version of a cached index and the features it was built from
+    
+    Generations are never modified. A rebuild publishes a new generation in
+    place of the old one (copy-on-write), so a request holding a generation
+    reads a consistent index and feature pair even if a newer one is
+    published meanwhile, and the old generation is freed once the last
+    request holding it finishes.
+    """
+    __slots__ = ("key", "id", "index", "features", "created", "etag", "__weakref__")
+    
+    def __init__(self, key: str, generation_id: int, index, features, etag: str, created: Optional[float] = None):
+        self.key = key
+        self.id = generation_id
+        self.index = index
+        self.features = features
+        self.etag = etag
+        self.created = created if created is not None else time.time()
+    
+    @property
+    def version(self) -> str:
+        """Data version in the ETag, used as the `v` parameter of versioned tile URLs"""
+        return self.etag[2:].strip('"') if self.etag.startswith("W/") else self.etag.strip('"')
+    
+    @property
+    def age(self) -> float:
+        """Seconds since the generation was built"""
+        return time.time() - self.created
+    
+    def with_features(self, features) -> "IndexGeneration":
+        """The same generation over renumbered but identical features"""
+        return IndexGeneration(self.key, self.id, self.index, features, self.etag, self.created)
+
 class IndexManager:
     """
     Manager for creating and caching supercluster indexes based on filter combinations
     """
-    def __init__(self, min_zoom=0, max_zoom=16, radius=40, extent=512):
+    def __init__(self, min_zoom=0, max_zoom=16, radius=40, extent=512,
+                 max_cached_indexes=None, max_cache_memory_mb=None, build_threads=1,
+                 node_size=64, snapshot_dir=None, snapshot_max_age=None, shared_memory=False,
+                 watermark_column=None, refresh_interval=None, json_fragments=FRAGMENTS_OFF,
+                 layer_counts=False, filter_views=False, group_points=False):
         """
         Initialize the index manager
         
@@ -38,24 +90,129 @@ class IndexManager:
             max_zoom: Maximum zoom level for clustering
             radius: Cluster radius in pixels
             extent: Tile extent in pixels
+            max_cached_indexes: Maximum number of filtered indexes to keep (None = unbounded)
+            max_cache_memory_mb: Memory budget for filtered indexes in MB (None = unbounded)
+            build_threads: Threads used by pysupercluster to build each index (0 = one per core)
+            node_size: Leaf size of the kd-trees inside each index
+            snapshot_dir: Directory the "all" index is saved to after a database
+                load and mapped from on startup (None = no snapshots)
+            snapshot_max_age: Ignore snapshots older than this many seconds (None = any age)
+            shared_memory: Share the "all" index between the processes of a host: one
+                process builds and publishes it, the others attach to the snapshot.
+                Snapshots default to SHARED_MEMORY_DIR (tmpfs) in this mode.
+            watermark_column: Learner column that increases whenever a row changes
+                (e.g. updated_at); enables incremental refreshes (None = disabled)
+            refresh_interval: Seconds between incremental refreshes run by
+                `start_refresher()` (None = only on demand)
+            json_fragments: Cache the encoded JSON of each point for /api/getClusters:
+                "off", "lazy" (encoded on first use) or "precompute" (encoded
+                when "all" is built)
+            layer_counts: Aggregate the LAYER_DEFINITIONS flags in every index so
+                clusters can report how many of their points are in each layer
+            filter_views: Answer filter combinations from the "all" index with a
+                FilteredIndexView instead of building an index per combination
+                (see filtered_index for the accuracy contract)
+            group_points: Build each index over the distinct point locations,
+                weighted by their number of points, with a GroupedIndex
+                (see grouped_index for how results differ)
         """
+        if json_fragments not in FRAGMENT_MODES:
+            raise ValueError(f"json_fragments must be one of {', '.join(FRAGMENT_MODES)}")
         self.min_zoom = min_zoom
         self.max_zoom = max_zoom
         self.radius = radius
         self.extent = extent
+        self.build_threads = build_threads
+        self.node_size = node_size
+        self.shared_memory = shared_memory
+        self.snapshot_dir = snapshot_dir or (SHARED_MEMORY_DIR if shared_memory else None)
+        self.snapshot_max_age = snapshot_max_age
+        self.watermark_column = watermark_column
+        self.refresh_interval = refresh_interval
+        self.json_fragments = json_fragments
+        self.layer_names = list(LAYER_DEFINITIONS) if layer_counts else []
+        self.filter_views = filter_views
+        self.group_points = group_points
+        
+        # Where the "all" index came from and when its snapshot was written
+        self.snapshot_status = {"source": None, "created": None}
 
         # Cache for indexes based on filter combinations
         self.indexes = {}
         
-        # Cache for GeoJSON data
+        # Cache of feature views per filter key. The "all" entry owns the
+        # columnar FeatureStore; filtered entries are index arrays into it.
         self.geojson_cache = {}
         
+        # Bitmap filter engine over the "all" feature store
+        self.filter_engine = None
+        
         # Track when indexes were last accessed
         self.last_accessed = {}
         
+        # Filters each cached index was built for, to rebuild it after a refresh
+        self.filters_by_key = {}
+        
+        # Cached entry each in-memory filtered index was derived from
+        self.build_sources = {}
+        
+        # Current generation per key; `indexes` and `geojson_cache` mirror it
+        self.generations = {}
+        self._generation_ids = 0
+        
+        # Version of the data behind "all" and the indexes derived from it.
+        # It names the data, not the build: workers attached to the same
+        # snapshot share it, so their ETags and tile URLs agree.
+        self.data_version = None
+        
+        # Replaced generations, tracked weakly to report those still in use
+        self._retired = weakref.WeakSet()
+        
+        # Background rebuilds of cached indexes requested with force_refresh
+        self._refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-refresh")
+        self.pending_refreshes = {}
+        
+        # Position of the "all" index in the learner change stream
+        self.watermark = None
+        self._watermark_ids = set()
+        # Whether the watermark was read at the last full load. It can be
+        # None then (an empty table), and refreshes start from the beginning.
+        self._watermark_loaded = False
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+        self._stop_refresh = threading.Event()
+        self.refresh_stats = {
+            "refreshes": 0,
+            "rows_applied": 0,
+            "rebuilt_indexes": 0,
+            "remapped_indexes": 0,
+            "errors": 0,
+            "last_check": None,
+            "last_rows": 0,
+            "last_seconds": None,
+            "last_error": None
+        }
+        
+        # Eviction policy bounding the filtered index cache ("all" is pinned)
+        self.cache_policy = IndexCachePolicy(
+            max_entries=max_cached_indexes,
+            max_memory_mb=max_cache_memory_mb,
+            pinned=("all",)
+        )
+        
+        # Coordinates concurrent builds so each key is built once at a time
+        self._builds = SingleFlight()
+        
+        # Guards cache mutation and iteration across threads
+        self._lock = threading.RLock()
+        
         # Stats
         self.cache_hits = 0
         self.cache_misses = 0
+        self.coalesced_builds = 0
+        
+        # Progress of the most recent database load per index key
+        self.db_loads = {}
         
         # Memory usage tracking
         self.memory_usage = []
@@ -63,31 +220,198 @@ class IndexManager:
         self.memory_usage.append({"timestamp": time.time(), "memory_mb": initial_memory, "event": "init"})
         logger.info(f"IndexManager initialized. Initial memory usage: {initial_memory:.2f} MB")
     
+    def get_cached_index(self, filters: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, Any]]:
+        """
+        Return the cached index for a filter combination without building it
+        
+        Args:
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            Tuple of (index_key, index) on a cache hit, None on a miss
+        """
+        generation = self.get_cached_generation(filters)
+        if generation is None:
+            return None
+        return generation.key, generation.index
+    
+    def get_cached_generation(self, filters: Optional[Dict[str, Any]] = None) -> Optional[IndexGeneration]:
+        """
+        Return the current generation for a filter combination without building it
+        
+        Args:
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            The current IndexGeneration on a cache hit, None on a miss
+        """
+        return self.get_generation_by_key(generate_filter_key(filters))
+    
+    def get_index_by_key(self, index_key: str) -> Optional[Any]:
+        """
+        Return a cached index by its filter key without building it
+        
+        Args:
+            index_key: The filter key for the index (e.g. "all")
+            
+        Returns:
+            The cached index, or None if it is not cached
+        """
+        generation = self.get_generation_by_key(index_key)
+        return generation.index if generation is not None else None
+    
+    def get_generation_by_key(self, index_key: str) -> Optional[IndexGeneration]:
+        """
+        Return the current generation of a filter key without building it
+        
+        Args:
+            index_key: The filter key for the index (e.g. "all")
+            
+        Returns:
+            The current IndexGeneration, or None if the key is not cached
+        """
+        generation = self.generations.get(index_key)
+        if generation is None:
+            return None
+        self.cache_hits += 1
+        self.last_accessed[index_key] = time.time()
+        return generation
+    
     def get_index(self, filters: Optional[Dict[str, Any]] = None, force_refresh: bool = False):
+        generation = self.get_generation(filters, force_refresh)
+        return generation.key, generation.index
+    
+    def get_generation(self, filters: Optional[Dict[str, Any]] = None, force_refresh: bool = False) -> IndexGeneration:
+        """
+        Return the current generation for a filter combination, building it on a miss
+        
+        Args:
+            filters: Dictionary of filter key-value pairs
+            force_refresh: Rebuild a cached index in the background; the
+                current generation is returned and keeps serving until the
+                new one is published
+            
+        Returns:
+            The current IndexGeneration
+        """
         # Generate key for caching
         index_key = generate_filter_key(filters)
         
         # Check cache first
-        if index_key in self.indexes and not force_refresh:
+        generation = self.get_generation_by_key(index_key)
+        if generation is not None:
+            if force_refresh:
+                self.refresh_index(filters)
+            return generation
+        
+        # Build once per key; concurrent misses for the same key wait for that build
+        generation, shared = self._builds.do(index_key, self._build_index, index_key, filters, force_refresh)
+        if shared:
+            self.coalesced_builds += 1
+        
+        return generation
+    
+    def refresh_index(self, filters: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        Rebuild the index of a filter combination in the background
+        
+        Requests keep being served from the current generation until the
+        rebuilt one replaces it. A refresh requested while one is pending for
+        the same key joins it.
+        
+        Args:
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            Future resolving to the new IndexGeneration
+        """
+        index_key = generate_filter_key(filters)
+        with self._lock:
+            pending = self.pending_refreshes.get(index_key)
+            if pending is not None and not pending.done():
+                return pending
+            future = self._refresh_executor.submit(self._background_refresh, index_key, filters)
+            self.pending_refreshes[index_key] = future
+            return future
+    
+    def _background_refresh(self, index_key: str, filters: Optional[Dict[str, Any]]) -> IndexGeneration:
+        """Rebuild a cached index off the request path; failures keep the current generation"""
+        try:
+            generation, _ = self._builds.do(index_key, self._build_index, index_key, filters, True)
+            logger.info(f"Published generation {generation.id} of {index_key}")
+            return generation
+        except Exception as e:
+            logger.error(f"Background refresh of {index_key} failed, keeping the current generation: {e}")
+            raise
+        finally:
+            with self._lock:
+                self.pending_refreshes.pop(index_key, None)
+    
+    def _build_index(self, index_key: str, filters: Optional[Dict[str, Any]], force_refresh: bool):
+        """
+        Build an index for a filter key and cache it
+        
+        Only called through the single-flight group, so at most one build per
+        key runs at a time. Nothing is cached if the build fails.
+        
+        Args:
+            index_key: The filter key for the index
+            filters: Dictionary of filter key-value pairs
+            force_refresh: Rebuild even if the index is cached
+            
+        Returns:
+            The published IndexGeneration
+        """
+        # Another caller may have completed this build just before we started
+        if index_key in self.generations and not force_refresh:
             self.cache_hits += 1
-            return index_key, self.indexes[index_key]
+            return self.generations[index_key]
         
         # If all data is already loaded and we need a filtered subset
         if self.geojson_cache.get("all") and filters:
-            # Filter the in-memory GeoJSON
-            #logger.debug(f"Filtering in-memory data for {index_key}")
-            filtered_geojson = self._filter_geojson(self.geojson_cache["all"], filters)
+            if self.filter_views:
+                base = self.generations.get("all")
+                start_time = time.time()
+                view = self._filter_view(base, filters) if base is not None else None
+                if view is not None:
+                    return self._cache_index(index_key, view, base.features, time.time() - start_time, filters)
+            
+            # Filter the smallest cached superset of the requested rows
+            source_key, source = self._smallest_superset(filters, self.geojson_cache["all"], exclude=index_key)
+            filtered_features = self._filter_features(source, filters)
             
             # Create new index from filtered data
-            points_array = self._extract_coordinates(filtered_geojson)
-            index = self._create_supercluster_index(points_array)
+            start_time = time.time()
+            points_array = self._extract_coordinates(filtered_features)
+            index = self._create_supercluster_index(points_array, self._layer_attributes(filtered_features))
             
             # Cache results
-            self.indexes[index_key] = index
-            self.geojson_cache[index_key] = filtered_geojson
-            
-            return index_key, index
+            self.build_sources[index_key] = {"key": source_key, "points": len(source)}
+            return self._cache_index(index_key, index, filtered_features, time.time() - start_time, filters)
+        
+        if index_key != "all" or not self.snapshot_dir:
+            return self._build_from_database(index_key, filters)
         
+        # In shared-memory mode one process per host builds "all" and publishes
+        # it; the others wait on the lock and then attach to that snapshot
+        with builder_lock(self.snapshot_dir, index_key) if self.shared_memory else nullcontext():
+            if not force_refresh:
+                generation = self._load_snapshot()
+                if generation is not None:
+                    return generation
+            return self._build_from_database(index_key, filters)
+    
+    def _build_from_database(self, index_key: str, filters: Optional[Dict[str, Any]]):
+        """
+        Load the points for a filter key from the database, build and cache the index
+        
+        Args:
+            index_key: The filter key for the index
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            The published IndexGeneration
+        """
         # Cache miss - need to create a new index
         logger.info(f"Cache miss for index key: {index_key}. Creating new index...")
         self.cache_misses += 1
@@ -98,36 +422,20 @@ class IndexManager:
         logger.debug(f"Memory before loading data: {pre_memory:.2f} MB")
         
         try:
-            # Load filtered data from database
-            start_time = time.time()
-            db_points = load_learner_points(filters=filters)
-            db_time = time.time() - start_time
-           #logger.info(f"Loaded {len(db_points)} points from database in {db_time:.2f} seconds")
+            # Read the watermark first; changes made during the load are applied again by the next refresh
+            watermark_loaded, watermark = self._read_watermark() if index_key == "all" else (False, None)
+            
+            # Stream filtered rows from the database straight into a columnar feature store
+            progress = LoadProgress()
+            with self._lock:
+                self.db_loads[index_key] = progress
+            store = load_learner_store(filters=filters, progress=progress)
+            geojson_features = store.view()
+            logger.info(f"Feature store size: {store.nbytes / (1024 * 1024):.2f} MB")
             
             # Record post-db load memory
             post_db_memory = get_memory_usage()
             self.memory_usage.append({"timestamp": time.time(), "memory_mb": post_db_memory, "event": f"post_db_load_{index_key}"})
-            #logger.debug(f"Memory after DB load: {post_db_memory:.2f} MB (increase: {post_db_memory - pre_memory:.2f} MB)")
-            
-            # Convert to GeoJSON
-            start_time = time.time()
-            geojson_features = convert_to_geojson(db_points)
-            geojson_size_mb = asizeof.asizeof(geojson_features) / (1024 * 1024)
-            db_points_size_mb = asizeof.asizeof(db_points) / (1024 * 1024)
-            logger.info(f"Original data size: {db_points_size_mb:.2f} MB, GeoJSON size: {geojson_size_mb:.2f} MB")
-            
-            self.geojson_cache[index_key] = geojson_features
-            geojson_time = time.time() - start_time
-            #logger.info(f"Converted to {len(geojson_features)} GeoJSON features in {geojson_time:.2f} seconds")
-            
-            # Record post-geojson memory
-            post_geojson_memory = get_memory_usage()
-            self.memory_usage.append({"timestamp": time.time(), "memory_mb": post_geojson_memory, "event": f"post_geojson_{index_key}"})
-            #logger.debug(f"Memory after GeoJSON conversion: {post_geojson_memory:.2f} MB (increase: {post_geojson_memory - post_db_memory:.2f} MB)")
-            
-            # Free up some memory
-            del db_points
-            gc.collect()
             
             # Extract coordinates for supercluster
             start_time = time.time()
@@ -137,20 +445,24 @@ class IndexManager:
             
             # Create supercluster index
             start_time = time.time()
-            index = self._create_supercluster_index(points_array)
+            index = self._create_supercluster_index(points_array, self._layer_attributes(geojson_features))
             index_time = time.time() - start_time
             logger.info(f"Created SuperCluster index in {index_time:.2f} seconds")
             
             # Record post-index memory
             post_index_memory = get_memory_usage()
             self.memory_usage.append({"timestamp": time.time(), "memory_mb": post_index_memory, "event": f"post_index_{index_key}"})
-            #logger.debug(f"Memory after index creation: {post_index_memory:.2f} MB (increase: {post_index_memory - post_geojson_memory:.2f} MB)")
+            #logger.debug(f"Memory after index creation: {post_index_memory:.2f} MB (increase: {post_index_memory - post_db_memory:.2f} MB)")
             
-            # Cache the index
-            self.indexes[index_key] = index
-            self.last_accessed[index_key] = time.time()
-            
-            return index_key, index
+            # Cache the index; every database load is a new version of the data
+            version = _new_data_version()
+            if index_key == "all":
+                self.filter_engine = BitmapFilterEngine(store)
+                self.watermark, self._watermark_ids = watermark, set()
+                self._watermark_loaded = watermark_loaded
+                self.data_version = version
+                self._save_snapshot(index, store)
+            return self._cache_index(index_key, index, geojson_features, index_time, filters, version=version)
             
         except Exception as e:
             error_message = f"Error creating index for key {index_key}: {str(e)}"
@@ -158,34 +470,235 @@ class IndexManager:
             logger.error(traceback.format_exc())
             raise Exception(error_message)
     
-    def _extract_coordinates(self, geojson_features: List[Dict[str, Any]]) -> np.ndarray:
+    def _snapshot_options(self) -> Dict[str, Any]:
+        """Build options a snapshot must match to be loaded"""
+        return {
+            "min_zoom": self.min_zoom,
+            "max_zoom": self.max_zoom,
+            "radius": self.radius,
+            "extent": self.extent,
+            "node_size": self.node_size,
+            "layer_counts": self.layer_names,
+            "group_points": self.group_points
+        }
+    
+    def _load_snapshot(self):
+        """
+        Map the "all" index and its feature store from the snapshot directory
+        
+        Returns:
+            The published IndexGeneration, or None if there is no usable snapshot
+        """
+        start_time = time.time()
+        loaded = load_snapshot(self.snapshot_dir, "all", self._snapshot_options(), self.snapshot_max_age)
+        if loaded is None:
+            return None
+        
+        index, store, pointer = loaded
+        self.filter_engine = BitmapFilterEngine(store)
+        self.data_version = _snapshot_data_version(pointer)
+        generation = self._cache_index("all", index, store.view(), time.time() - start_time, {})
+        self.snapshot_status = {"source": "snapshot", "created": pointer["created"]}
+        self.watermark = pointer.get("watermark")
+        self._watermark_ids = set(pointer.get("watermark_ids", []))
+        self._watermark_loaded = pointer.get("watermark_loaded", self.watermark is not None)
+        logger.info(f"Loaded snapshot of all ({len(store)} points) in {time.time() - start_time:.2f} seconds")
+        return generation
+    
+    def _save_snapshot(self, index, store: FeatureStore, source: str = "database") -> None:
+        """Save the "all" index as the current snapshot; failures are only logged"""
+        self.snapshot_status = {"source": source, "created": None}
+        if not self.snapshot_dir or isinstance(index, DummyClusterIndex):
+            return
+        try:
+            metadata = {"watermark": self.watermark, "watermark_ids": sorted(self._watermark_ids),
+                        "watermark_loaded": self._watermark_loaded,
+                        "data_version": self.data_version}
+            save_snapshot(self.snapshot_dir, "all", index, store, self._snapshot_options(), metadata=metadata)
+            self.snapshot_status["created"] = time.time()
+        except Exception as e:
+            logger.warning(f"Could not save snapshot to {self.snapshot_dir}: {e}")
+    
+    def _cache_index(self, index_key: str, index, features, build_seconds: float,
+                     filters: Optional[Dict[str, Any]] = None, version: Optional[str] = None) -> IndexGeneration:
+        """
+        Store a built index and evict entries if the cache is over its bounds
+        
+        The index and features are published as a new generation that
+        replaces the previous one as a whole.
+        
+        Args:
+            index_key: The filter key for the index
+            index: The SuperCluster index
+            features: Feature view the index was built from
+            build_seconds: Time taken to build the index
+            filters: Filters the index was built for
+            version: Version of the data the index was built from (default:
+                the current version of "all", which filtered indexes derive from)
+            
+        Returns:
+            The published IndexGeneration
+        """
+        if index_key == "all" and self.json_fragments != FRAGMENTS_OFF and isinstance(features, FeatureView):
+            fragments = enable_fragments(features.store)
+            if self.json_fragments == FRAGMENTS_PRECOMPUTE:
+                fragments.precompute()
+        
+        with self._lock:
+            self._generation_ids += 1
+            etag = f'W/"{version or self.data_version or _new_data_version()}"'
+            generation = IndexGeneration(index_key, self._generation_ids, index, features, etag)
+            self._publish(generation)
+            self.filters_by_key[index_key] = dict(filters or {})
+            self.last_accessed[index_key] = time.time()
+            
+            if isinstance(index, FilteredIndexView):
+                # Views share the "all" index and features and only own their counts
+                points, nbytes = index.point_count, index.nbytes
+            elif isinstance(index, GroupedIndex):
+                # The index itself grows with the distinct locations
+                points = len(features)
+                nbytes = _features_nbytes(features) + index.location_count * INDEX_BYTES_PER_POINT + index.nbytes
+            else:
+                points, nbytes = len(features), _features_nbytes(features) + len(features) * INDEX_BYTES_PER_POINT
+            self.cache_policy.record_build(index_key, points, build_seconds, nbytes)
+            self._evict()
+            return generation
+    
+    def _publish(self, generation: IndexGeneration) -> None:
+        """Make a generation current for its key (called with the lock held)"""
+        previous = self.generations.get(generation.key)
+        if previous is not None and previous.id != generation.id:
+            self._retired.add(previous)
+        self.generations[generation.key] = generation
+        self.indexes[generation.key] = generation.index
+        self.geojson_cache[generation.key] = generation.features
+    
+    def _evict(self) -> None:
+        """Evict the least valuable cached indexes until the cache fits its bounds"""
+        with self._lock:
+            for key in self.cache_policy.select_victims(self.last_accessed):
+                self.indexes.pop(key, None)
+                self.geojson_cache.pop(key, None)
+                self.generations.pop(key, None)
+                self.filters_by_key.pop(key, None)
+                self.build_sources.pop(key, None)
+                self.last_accessed.pop(key, None)
+                self.cache_policy.record_eviction(key)
+    
+    def _extract_coordinates(self, geojson_features) -> np.ndarray:
         """
         Extract coordinates from GeoJSON features for supercluster
         
         Args:
-            geojson_features: List of GeoJSON Feature objects
+            geojson_features: FeatureView or list of GeoJSON Feature objects
             
         Returns:
             Numpy array of coordinates in the format expected by pysupercluster
         """
-        start_time = time.time()
-        points = []
-        for feature in geojson_features:
-            coords = feature["geometry"]["coordinates"]
-            points.append((coords[0], coords[1]))  # (longitude, latitude)
+        if isinstance(geojson_features, FeatureView):
+            return geojson_features.coordinates()
         
-        points_array = np.array(points)
+        start_time = time.time()
+        # Fill one flat float64 buffer instead of building a tuple per point
+        points_array = np.fromiter(
+            (value for feature in geojson_features for value in feature["geometry"]["coordinates"][:2]),
+            dtype=np.float64,
+            count=2 * len(geojson_features),
+        ).reshape(-1, 2)  # (longitude, latitude)
         extract_time = time.time() - start_time
-        logger.debug(f"Extracted {len(points)} coordinates into numpy array in {extract_time:.4f} seconds")
+        logger.debug(f"Extracted {len(points_array)} coordinates into numpy array in {extract_time:.4f} seconds")
         
         return points_array
     
-    def _create_supercluster_index(self, points_array: np.ndarray):
+    def _layer_attributes(self, geojson_features) -> Optional[np.ndarray]:
+        """
+        Build the per-point attribute columns aggregated by the index for layer counts
+        
+        Args:
+            geojson_features: FeatureView or list of GeoJSON Feature objects
+            
+        Returns:
+            (N, len(layer_names)) array with 1.0 where the point is in the layer,
+            or None if layer counts are disabled
+        """
+        if not self.layer_names:
+            return None
+        fields = [LAYER_DEFINITIONS[name]['filter_field'] for name in self.layer_names]
+        if isinstance(geojson_features, FeatureView):
+            rows = geojson_features.row_indices()
+            return np.column_stack([geojson_features.store.flags[field][rows] == 1 for field in fields]).astype(np.float64)
+        return np.array([[1.0 if feature["properties"].get(FIELD_MAPPING[field]) == 1 else 0.0 for field in fields]
+                         for feature in geojson_features], dtype=np.float64).reshape(-1, len(fields))
+    
+    def _smallest_superset(self, filters: Dict[str, Any], base: FeatureView,
+                           exclude: Optional[str] = None) -> Tuple[str, FeatureView]:
+        """
+        Find the smallest cached feature view that contains every row matching filters
+        
+        Cached filter keys form a lattice: an entry built for a subset of the
+        requested filter pairs holds all rows the request can match, so
+        filtering it gives the same rows as filtering "all" with less work.
+        Only entries over the same store as "all" qualify.
+        
+        Args:
+            filters: Dictionary of filter key-value pairs
+            base: Current "all" feature view
+            exclude: Filter key to skip (the key being rebuilt)
+            
+        Returns:
+            Tuple of (filter key, feature view) of the source; ("all", base)
+            if no filtered entry qualifies
+        """
+        best_key, best = "all", base
+        with self._lock:
+            for key, features in self.geojson_cache.items():
+                cached_filters = self.filters_by_key.get(key)
+                if (key in ("all", exclude) or not cached_filters or not isinstance(features, FeatureView)
+                        or features.store is not base.store or isinstance(self.indexes.get(key), FilteredIndexView)):
+                    continue
+                if cached_filters.items() <= filters.items() and len(features) < len(best):
+                    best_key, best = key, features
+        if best_key != "all":
+            logger.info(f"Deriving {generate_filter_key(filters)} from cached {best_key} ({len(best)} of {len(base)} points)")
+        return best_key, best
+    
+    def _filter_view(self, base: IndexGeneration, filters: Dict[str, Any]) -> Optional[FilteredIndexView]:
+        """
+        Answer a filter combination from the "all" index without building an index
+        
+        Args:
+            base: Current generation of "all"
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            FilteredIndexView over the "all" index, or None if that index
+            cannot be filtered (e.g. it has no points)
+        """
+        if getattr(base.index, "filter", None) is None or not isinstance(base.features, FeatureView):
+            return None
+        
+        start_time = time.time()
+        features = base.features
+        if self.filter_engine is None or self.filter_engine.store is not features.store:
+            self.filter_engine = BitmapFilterEngine(features.store)
+        mask = self.filter_engine.mask(filters)
+        if features.rows is not None:
+            mask = mask[features.rows]
+        
+        view = FilteredIndexView(base.index, mask)
+        logger.info(f"Filtered the all index to {view.point_count} points in {time.time() - start_time:.4f} seconds "
+                    f"({view.nbytes / (1024 * 1024):.2f} MB of cluster counts)")
+        return view
+    
+    def _create_supercluster_index(self, points_array: np.ndarray, attributes: Optional[np.ndarray] = None):
         """
         Create a supercluster index from a numpy array of points
         
         Args:
-            points_array: Numpy array of points in format [(longitude, latitude), ...]
+            points_array: Numpy array of points in format [(longitude, latitude), ...]; float32/float64
+                arrays and strided views (such as the store's coordinates) are read without a copy
+            attributes: Per-point attribute columns each cluster aggregates (None = none)
             
         Returns:
             SuperCluster index
@@ -196,27 +709,45 @@ class IndexManager:
             return DummyClusterIndex()
             
         start_time = time.time()
-        index = pysupercluster.SuperCluster(
-            points_array,
+        options = dict(
             min_zoom=self.min_zoom,
             max_zoom=self.max_zoom,
             radius=self.radius,
             extent=self.extent,
+            threads=self.build_threads,
+            node_size=self.node_size
+        )
+        if self.group_points:
+            index = GroupedIndex.build(points_array, attributes, **options)
+            index_time = time.time() - start_time
+            logger.info(f"Created SuperCluster index over {index.location_count} locations of {len(points_array)} points "
+                        f"in {index_time:.2f} seconds")
+            return index
+        
+        index = pysupercluster.SuperCluster(
+            points_array,
+            **options,
+            **({"attributes": attributes} if attributes is not None else {})
         )
         index_time = time.time() - start_time
         logger.info(f"Created SuperCluster index with {len(points_array)} points in {index_time:.2f} seconds")
         
         return index
     
-    def get_original_features(self, index_key: str) -> List[Dict[str, Any]]:
+    def get_original_features(self, index_key: str) -> Sequence[Dict[str, Any]]:
         """
         Get the original GeoJSON features for an index key
         
+        Features are built lazily from the columnar store when indexed, so
+        only the points that appear in a response are materialised. Callers
+        that also query the index should use a generation's `features`
+        instead, which always match its `index`.
+        
         Args:
             index_key: The filter key for the index
             
         Returns:
-            List of original GeoJSON features
+            Sequence of original GeoJSON features, indexed by point id
         """
         if index_key in self.geojson_cache:
             logger.debug(f"Returning {len(self.geojson_cache[index_key])} cached GeoJSON features for key: {index_key}")
@@ -228,18 +759,31 @@ class IndexManager:
         """Get cache statistics"""
         current_memory = get_memory_usage()
         
+        # Snapshot the caches so concurrent builds can't mutate them mid-iteration
+        with self._lock:
+            cached_features = dict(self.geojson_cache)
+            cached_indexes = dict(self.indexes)
+            db_loads = dict(self.db_loads)
+            generations = dict(self.generations)
+            build_sources = dict(self.build_sources)
+            all_features = self.geojson_cache.get("all")
+            refreshing = {key for key, future in self.pending_refreshes.items() if not future.done()}
+        views = {key for key, generation in generations.items() if isinstance(generation.index, FilteredIndexView)}
+        fragments = get_fragments(all_features.store) if isinstance(all_features, FeatureView) else None
+        
         # Calculate memory usage by object type
         try:
             object_sizes = {
-                "geojson_cache_size_mb": round(asizeof.asizeof(self.geojson_cache) / (1024 * 1024), 2),
-                "indexes_size_mb": round(asizeof.asizeof(self.indexes) / (1024 * 1024), 2),
+                "feature_store_size_mb": round(sum(_features_nbytes(v) for k, v in cached_features.items() if k not in views) / (1024 * 1024), 2),
+                "indexes_size_mb": round(asizeof.asizeof(cached_indexes) / (1024 * 1024), 2),
+                "filter_bitmaps_size_mb": round(self.filter_engine.nbytes / (1024 * 1024), 2) if self.filter_engine else 0,
                 "geojson_entries": {}
             }
             
-            # Get detailed size for each GeoJSON entry
-            for key, value in self.geojson_cache.items():
+            # Get detailed size for each cached entry (filtered entries only own an index array, views nothing)
+            for key, value in cached_features.items():
                 object_sizes["geojson_entries"][key] = {
-                    "size_mb": round(asizeof.asizeof(value) / (1024 * 1024), 2),
+                    "size_mb": round(_features_nbytes(value) / (1024 * 1024), 2) if key not in views else 0,
                     "feature_count": len(value)
                 }
         except ImportError:
@@ -248,11 +792,42 @@ class IndexManager:
         stats = {
             "cache_hits": self.cache_hits,
             "cache_misses": self.cache_misses,
-            "cached_indexes": len(self.indexes),
+            "coalesced_builds": self.coalesced_builds,
+            "builds_in_flight": self._builds.in_flight(),
+            "cached_indexes": len(cached_indexes),
+            "generations": {
+                key: {
+                    "id": generation.id,
+                    "version": generation.version,
+                    "age_seconds": round(generation.age, 1),
+                    "points": generation.index.point_count if key in views else len(generation.features),
+                    "filter_view": key in views,
+                    "locations": generation.index.location_count if isinstance(generation.index, GroupedIndex) else None,
+                    "source": build_sources.get(key),
+                    "refreshing": key in refreshing
+                }
+                for key, generation in generations.items()
+            },
+            "retired_generations_in_use": len(self._retired),
             "cache_ratio": f"{self.cache_hits/(self.cache_hits + self.cache_misses):.2f}" if (self.cache_hits + self.cache_misses) > 0 else "N/A",
             "current_memory_mb": f"{current_memory:.2f}",
             "memory_history": self.memory_usage,
-            "object_memory": object_sizes
+            "object_memory": object_sizes,
+            "eviction": self.cache_policy.get_stats(),
+            "snapshot": dict(self.snapshot_status, dir=self.snapshot_dir, shared_memory=self.shared_memory),
+            "db_loads": {key: progress.as_dict() for key, progress in db_loads.items()},
+            "db_pool": get_pool_stats(),
+            "json_fragments": {
+                "mode": self.json_fragments,
+                "cached": fragments.cached if fragments is not None else 0
+            },
+            "delta_refresh": dict(
+                self.refresh_stats,
+                column=self.watermark_column,
+                watermark=None if self.watermark is None else str(self.watermark),
+                interval=self.refresh_interval,
+                running=self._refresher is not None and self._refresher.is_alive()
+            )
         }
         logger.debug(f"Current memory usage: {current_memory:.2f} MB")
         return stats
@@ -261,9 +836,15 @@ class IndexManager:
         """Clear all cached indexes"""
         pre_clear_memory = get_memory_usage()
         
-        self.indexes = {}
-        self.geojson_cache = {}
-        self.last_accessed = {}
+        with self._lock:
+            self.indexes = {}
+            self.geojson_cache = {}
+            self.filter_engine = None
+            self.last_accessed = {}
+            self.filters_by_key = {}
+            self.build_sources = {}
+            self.generations = {}
+            self.cache_policy.clear()
         
         # Force garbage collection
         gc.collect()
@@ -280,51 +861,273 @@ class IndexManager:
         
         logger.info(f"Cleared index cache. Memory freed: {memory_freed:.2f} MB")
 
-    def _filter_geojson(self, geojson_features, filters):
-        """Filter GeoJSON features based on filter criteria"""
-        if not filters:
-            return geojson_features
-            
-        filtered = []
-        logger.debug(f"Starting filtering with {len(geojson_features)} features and filters: {filters}")
+    def _read_watermark(self) -> Tuple[bool, Any]:
+        """
+        Read the learner change watermark before a full load
         
-        for feature in geojson_features:
-            properties = feature["properties"]
-            include = True
+        Returns:
+            Tuple of (whether it was read, watermark). It is not read if
+            refreshes are disabled or the query fails; a watermark read from
+            an empty table is None.
+        """
+        if not self.watermark_column:
+            return False, None
+        try:
+            return True, get_learner_watermark(self.watermark_column)
+        except Exception as e:
+            logger.warning(f"Could not read watermark column {self.watermark_column}, incremental refresh disabled until the next full load: {e}")
+            return False, None
+    
+    def refresh_changes(self) -> Dict[str, Any]:
+        """
+        Apply learner rows changed since the watermark to the cached indexes
+        
+        The "all" feature store is copied with the changed rows applied, a new
+        "all" index is built from it and both are swapped in together. Cached
+        filtered indexes that no changed row enters or leaves keep their index
+        and only get their rows renumbered; the others are rebuilt one by one
+        and swapped in as they finish. Until then readers keep using the
+        previous, complete index and features. Nothing is published if "all"
+        was rebuilt or cleared while the refresh ran.
+        
+        Returns:
+            Summary of the refresh
+        """
+        if not self.watermark_column:
+            return {"status": "disabled"}
+        
+        with self._refresh_lock:
+            start_time = time.time()
+            self.refresh_stats["last_check"] = start_time
+            with self._lock:
+                base = self.geojson_cache.get("all")
+            if base is None or not self._watermark_loaded:
+                return {"status": "skipped", "reason": "the all index is not loaded from the database"}
             
-            for key, value in filters.items():
-                # Map the database field name to GeoJSON property name
-                property_name = FIELD_MAPPING.get(key, key)
-                property_value = properties.get(property_name)
-                logger.debug(f"Checking filter {key}={value} against property {property_name}={property_value}")
+            # In shared-memory mode workers take turns; a worker that finds a
+            # snapshot published by another one attaches to it instead
+            with builder_lock(self.snapshot_dir, "all") if self.shared_memory else nullcontext():
+                if self.shared_memory:
+                    adopted = self._adopt_newer_snapshot(base)
+                    if adopted is not None:
+                        return self._finish_refresh(adopted, start_time, rows=0)
                 
-                if key in FILTER_TYPES['string_filters']:
-                    if property_value != value:
-                        include = False
-                        logger.debug(f"Excluding feature due to {property_name} mismatch")
-                        break
-                elif key in FILTER_TYPES['boolean_filters']:
-                    # Convert filter value to int for comparison
-                    filter_value = 1 if value else 0
-                    if property_value != filter_value:
-                        include = False
-                        logger.debug(f"Excluding feature due to {property_name} mismatch")
-                        break
-            
-            if include:
-                filtered.append(feature)
+                rows, watermark, watermark_ids = load_learner_changes(
+                    self.watermark_column, self.watermark, self._watermark_ids)
+                if not rows:
+                    self.watermark, self._watermark_ids = watermark, watermark_ids
+                    self.refresh_stats["last_rows"] = 0
+                    return {"status": "unchanged", "watermark": str(watermark)}
+                
+                store, row_map = base.store.apply_changes(LEARNER_COLUMNS, rows)
+                features = store.view()
+                if self.json_fragments != FRAGMENTS_OFF:
+                    # Unchanged rows keep their encoded JSON
+                    enable_fragments(store, base.store, row_map)
+                engine = BitmapFilterEngine(store)
+                build_start = time.time()
+                index = self._create_supercluster_index(features.coordinates(), self._layer_attributes(features))
+                build_seconds = time.time() - build_start
+                
+                # Filtered indexes whose rows no changed row touches only need renumbering
+                added = np.arange(int((row_map >= 0).sum()), len(store))
+                remapped, stale = {}, []
+                with self._lock:
+                    cached = [(key, self.geojson_cache[key], self.filters_by_key.get(key), self.indexes[key])
+                              for key in self.indexes if key != "all"]
+                for key, view, filters, cached_index in cached:
+                    # Filter views count clusters of the old "all" index and are always redone
+                    if (filters is not None and isinstance(view, FeatureView) and view.store is base.store
+                            and not isinstance(cached_index, FilteredIndexView)
+                            and not (row_map[view.row_indices()] < 0).any()
+                            and len(engine.select(filters, added)) == 0):
+                        remapped[key] = store.view(row_map[view.row_indices()])
+                    else:
+                        stale.append(key)
                 
-        logger.info(f"Filtered {len(geojson_features)} features to {len(filtered)}")
+                with self._lock:
+                    if self.geojson_cache.get("all") is not base:
+                        logger.info("Discarding incremental refresh: the all index was replaced while it ran")
+                        return {"status": "discarded"}
+                    self.filter_engine = engine
+                    self.data_version = _new_data_version()
+                    self._cache_index("all", index, features, build_seconds, {})
+                    for key, view in remapped.items():
+                        if key in self.generations:
+                            self._publish(self.generations[key].with_features(view))
+                    self.watermark, self._watermark_ids = watermark, watermark_ids
+                
+                self._save_snapshot(index, store, source="delta")
+            
+            logger.info(f"Applied {len(rows)} changed rows: {len(store)} points, "
+                        f"{len(remapped)} filtered indexes renumbered, {len(stale)} to rebuild")
+            self.refresh_stats["remapped_indexes"] += len(remapped)
+            return self._finish_refresh(stale, start_time, rows=len(rows))
+    
+    def _adopt_newer_snapshot(self, base: FeatureView) -> Optional[List[str]]:
+        """
+        Swap in an "all" snapshot another worker published after ours
+        
+        Returns:
+            Filtered keys to rebuild, or None if there is no newer snapshot
+        """
+        loaded = load_snapshot(self.snapshot_dir, "all", self._snapshot_options(), self.snapshot_max_age)
+        if loaded is None or loaded[2]["created"] <= (self.snapshot_status["created"] or 0):
+            return None
+        
+        index, store, pointer = loaded
+        with self._lock:
+            if self.geojson_cache.get("all") is not base:
+                return []
+            self.filter_engine = BitmapFilterEngine(store)
+            self.data_version = _snapshot_data_version(pointer)
+            self._cache_index("all", index, store.view(), 0.0, {})
+            self.snapshot_status = {"source": "snapshot", "created": pointer["created"]}
+            self.watermark = pointer.get("watermark")
+            self._watermark_ids = set(pointer.get("watermark_ids", []))
+            self._watermark_loaded = pointer.get("watermark_loaded", self.watermark is not None)
+            stale = [key for key in self.indexes if key != "all"]
+        logger.info(f"Attached to a newer snapshot of all ({len(store)} points)")
+        return stale
+    
+    def _finish_refresh(self, stale: List[str], start_time: float, rows: int) -> Dict[str, Any]:
+        """Rebuild filtered indexes invalidated by a refresh and record its stats"""
+        with self._lock:
+            base = self.geojson_cache.get("all")
+            base_generation = self.generations.get("all")
+        
+        rebuilt = []
+        for key in stale if base is not None else []:
+            with self._lock:
+                filters = self.filters_by_key.get(key)
+                if key not in self.indexes or filters is None:
+                    continue
+                as_view = isinstance(self.indexes[key], FilteredIndexView)
+            build_start = time.time()
+            index = self._filter_view(base_generation, filters) if as_view else None
+            source_key = None
+            if index is not None:
+                features = base_generation.features
+            else:
+                source_key, source = self._smallest_superset(filters, base, exclude=key)
+                features = self._filter_features(source, filters)
+                index = self._create_supercluster_index(features.coordinates(), self._layer_attributes(features))
+            with self._lock:
+                # Stop if "all" moved on (its refresh handles the rest) or the key was evicted
+                if self.geojson_cache.get("all") is not base:
+                    break
+                if key in self.indexes:
+                    if source_key is not None:
+                        self.build_sources[key] = {"key": source_key, "points": len(source)}
+                    self._cache_index(key, index, features, time.time() - build_start, filters)
+                    rebuilt.append(key)
+        
+        elapsed = time.time() - start_time
+        self.refresh_stats["refreshes"] += 1
+        self.refresh_stats["rows_applied"] += rows
+        self.refresh_stats["rebuilt_indexes"] += len(rebuilt)
+        self.refresh_stats["last_rows"] = rows
+        self.refresh_stats["last_seconds"] = round(elapsed, 3)
+        self.memory_usage.append({"timestamp": time.time(), "memory_mb": get_memory_usage(), "event": "delta_refresh"})
+        logger.info(f"Incremental refresh finished in {elapsed:.2f} seconds, rebuilt {len(rebuilt)} filtered indexes")
+        return {"status": "applied", "rows": rows, "points": len(base or []), "rebuilt": rebuilt, "seconds": round(elapsed, 3)}
+    
+    def start_refresher(self, interval: Optional[float] = None) -> None:
+        """
+        Run `refresh_changes` every interval seconds on a daemon thread
+        
+        Args:
+            interval: Seconds between refreshes (defaults to refresh_interval)
+        """
+        interval = interval or self.refresh_interval
+        if not interval or not self.watermark_column or (self._refresher and self._refresher.is_alive()):
+            return
+        self._stop_refresh.clear()
+        
+        def run():
+            while not self._stop_refresh.wait(interval):
+                try:
+                    self.refresh_changes()
+                except Exception as e:
+                    self.refresh_stats["errors"] += 1
+                    self.refresh_stats["last_error"] = str(e)
+                    logger.error(f"Incremental refresh failed: {e}")
+                    logger.error(traceback.format_exc())
+        
+        self._refresher = threading.Thread(target=run, name="index-refresher", daemon=True)
+        self._refresher.start()
+        logger.info(f"Refreshing changed learners every {interval} seconds using {self.watermark_column}")
+    
+    def stop_refresher(self) -> None:
+        """Stop the background refresh thread"""
+        self._stop_refresh.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=5)
+            self._refresher = None
+    
+    def _filter_features(self, features: FeatureView, filters: Dict[str, Any]) -> FeatureView:
+        """
+        Filter a feature view based on filter criteria
+        
+        Args:
+            features: View over the feature store to filter
+            filters: Dictionary of filter key-value pairs
+            
+        Returns:
+            FeatureView holding the row indices of matching features
+        """
+        if not filters:
+            return features
+        
+        start_time = time.time()
+        if self.filter_engine is None or self.filter_engine.store is not features.store:
+            self.filter_engine = BitmapFilterEngine(features.store)
+        
+        rows = self.filter_engine.select(filters, features.rows)
+        filter_time = time.time() - start_time
+        
+        filtered = features.store.view(rows)
+        logger.info(f"Filtered {len(features)} features to {len(filtered)} in {filter_time:.4f} seconds")
         if len(filtered) == 0:
             logger.warning("No features passed the filter criteria")
-            # Log a sample feature for debugging
-            if geojson_features:
-                logger.debug(f"Sample feature that was filtered out: {geojson_features[0]}")
         
         return filtered
 
+def _new_data_version() -> str:
+    """Name a version of the learner data read from the database"""
+    return uuid.uuid4().hex[:12]
+
+def _snapshot_data_version(pointer: Dict[str, Any]) -> str:
+    """Data version of a snapshot (snapshots written before versions existed are named by directory)"""
+    return pointer.get("data_version") or pointer.get("directory")
+
+def _features_nbytes(features) -> int:
+    """Bytes owned by a cached feature entry"""
+    if isinstance(features, FeatureView):
+        return features.nbytes
+    return asizeof.asizeof(features)
+
+def _env_number(name: str, cast=int, default=None):
+    """Read an optional numeric setting from the environment"""
+    value = os.getenv(name)
+    return cast(value) if value not in (None, "") else default
+
 # Global index manager instance
-index_manager = IndexManager() 
+index_manager = IndexManager(
+    max_cached_indexes=_env_number("INDEX_CACHE_MAX_ENTRIES"),
+    max_cache_memory_mb=_env_number("INDEX_CACHE_MAX_MB", float),
+    build_threads=_env_number("INDEX_BUILD_THREADS", default=1),
+    node_size=_env_number("INDEX_NODE_SIZE", default=64),
+    snapshot_dir=os.getenv("INDEX_SNAPSHOT_DIR") or None,
+    snapshot_max_age=_env_number("INDEX_SNAPSHOT_MAX_AGE", float),
+    shared_memory=os.getenv("INDEX_SHARED_MEMORY", "").lower() in ("1", "true", "yes"),
+    watermark_column=os.getenv("INDEX_WATERMARK_COLUMN") or None,
+    refresh_interval=_env_number("INDEX_REFRESH_INTERVAL", float),
+    json_fragments=os.getenv("INDEX_JSON_FRAGMENTS", FRAGMENTS_OFF).lower(),
+    layer_counts=os.getenv("INDEX_LAYER_COUNTS", "").lower() in ("1", "true", "yes"),
+    filter_views=os.getenv("INDEX_FILTER_VIEWS", "").lower() in ("1", "true", "yes"),
+    group_points=os.getenv("INDEX_GROUP_POINTS", "").lower() in ("1", "true", "yes")
+)
 
 def get_object_sizes():
     """Calculate memory usage for key data structures"""
@@ -338,10 +1141,12 @@ def get_object_sizes():
         "index_details": {}
     }
     
-    # Calculate GeoJSON cache sizes
+    # Calculate feature cache sizes (filtered entries only own their index array,
+    # filter views share the "all" entry)
     for key, geojson in index_manager.geojson_cache.items():
-        # Get deep size (includes all referenced objects)
-        size_mb = asizeof.asizeof(geojson) / (1024 * 1024)
+        if isinstance(index_manager.indexes.get(key), FilteredIndexView):
+            continue
+        size_mb = _features_nbytes(geojson) / (1024 * 1024)
         sizes["geojson_details"][key] = {
             "size_mb": round(size_mb, 2),
             "feature_count": len(geojson)
@@ -366,4 +1171,28 @@ def get_object_sizes():
 class DummyClusterIndex:
     """A dummy index that returns empty results for when no points match filters"""
     def getClusters(self, top_left, bottom_right, zoom):
-        return []
\ No newline at end of file
+        return []
+    
+    def getClustersArrays(self, top_left, bottom_right, zoom):
+        return {
+            "longitude": np.empty(0, dtype=np.float64),
+            "latitude": np.empty(0, dtype=np.float64),
+            "count": np.empty(0, dtype=np.int64),
+            "id": np.empty(0, dtype=np.int64),
+            "expansion_zoom": np.empty(0, dtype=np.int32)
+        }
+    
+    def getChildren(self, cluster_id):
+        raise ValueError("No cluster with the specified id.")
+    
+    def getLeaves(self, cluster_id, limit=10, offset=0):
+        raise ValueError("No cluster with the specified id.")
+    
+    def getClusterExpansionZoom(self, cluster_id):
+        raise ValueError("No cluster with the specified id.")
+    
+    def getTile(self, z, x, y):
+        tile = self.getClustersArrays(None, None, z)
+        tile["x"] = np.empty(0, dtype=np.int32)
+        tile["y"] = np.empty(0, dtype=np.int32)
+        return tile
\ No newline at end of file
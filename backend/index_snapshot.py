@@ -0,0 +1,188 @@
+"""
+On-disk snapshots of built indexes
+
+A snapshot is a directory holding a SuperCluster index file and the
+FeatureStore columns the index was built from. Loading maps both read-only,
+so a restarted or newly forked worker can serve without touching the
+database, and workers on one host share the pages through the page cache.
+
+With the snapshot directory on a tmpfs such as /dev/shm, the files are
+named shared-memory segments: one builder process publishes them (under
+`builder_lock`) and every worker maps the same physical pages.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+# Add the pysupercluster directory to the path so we can import it
+sys.path.append(os.path.join(os.path.dirname(__file__), "pysupercluster"))
+import pysupercluster
+
+from feature_store import FeatureStore
+from grouped_index import GroupedIndex
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the snapshot layout changes; older snapshots are ignored
+SNAPSHOT_VERSION = 2
+
+INDEX_FILE = "index.bin"
+
+# Default snapshot directory in shared-memory mode (tmpfs on Linux)
+SHARED_MEMORY_DIR = "/dev/shm/supercluster"
+
+
+def _safe_key(index_key: str) -> str:
+    """Turn a filter key into a file name component"""
+    return re.sub(r"[^\w.=-]", "_", index_key)
+
+
+def _pointer_path(root: str, index_key: str) -> str:
+    """Path of the file naming the current snapshot directory of a key"""
+    return os.path.join(root, f"{_safe_key(index_key)}.json")
+
+
+@contextmanager
+def builder_lock(root: str, index_key: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a key's snapshots across processes
+
+    Processes that start together take turns: the first one builds and
+    publishes a snapshot, and the others find it once they get the lock.
+    The lock is released if the holder dies.
+
+    Args:
+        root: Snapshot root directory (created if missing)
+        index_key: The filter key of the index (e.g. "all")
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, f"{_safe_key(index_key)}.lock"), "a") as f:
+        start_time = time.time()
+        fcntl.flock(f, fcntl.LOCK_EX)
+        waited = time.time() - start_time
+        if waited > 1:
+            logger.info(f"Waited {waited:.2f} seconds for the {index_key} builder lock")
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_snapshot(root: str, index_key: str, index, store: FeatureStore, options: Dict[str, Any],
+                  metadata: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Write an index and its feature store as the current snapshot of a key
+
+    The snapshot is written to a new directory and then published by
+    atomically replacing the key's pointer file, so readers see either the
+    old snapshot or the new one. Files of older snapshots are removed;
+    processes that already mapped them keep working.
+
+    Args:
+        root: Snapshot root directory (created if missing)
+        index_key: The filter key of the index (e.g. "all")
+        index: Built SuperCluster index or GroupedIndex
+        store: Feature store the index was built from
+        options: Build options the snapshot is only valid for
+        metadata: Extra JSON-serializable values stored in the pointer
+            (values such as datetimes are stored as strings)
+
+    Returns:
+        Path of the snapshot directory
+    """
+    os.makedirs(root, exist_ok=True)
+    name = f"{_safe_key(index_key)}-{uuid.uuid4().hex}"
+    directory = os.path.join(root, name)
+    os.makedirs(directory)
+
+    start_time = time.time()
+    try:
+        index.save(os.path.join(directory, INDEX_FILE))
+        store.save(directory)
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    pointer = {
+        **(metadata or {}),
+        "version": SNAPSHOT_VERSION,
+        "directory": name,
+        "created": time.time(),
+        "rows": len(store),
+        "options": options
+    }
+    pointer_path = _pointer_path(root, index_key)
+    tmp_path = f"{pointer_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(pointer, f, default=str)
+    os.replace(tmp_path, pointer_path)
+
+    # Remove snapshots of this key that are no longer current
+    prefix = f"{_safe_key(index_key)}-"
+    for entry in os.listdir(root):
+        if entry.startswith(prefix) and entry != name:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    logger.info(f"Saved snapshot of {index_key} ({len(store)} points) to {directory} in {time.time() - start_time:.2f} seconds")
+    return directory
+
+
+def load_snapshot(root: str, index_key: str, options: Dict[str, Any],
+                  max_age: Optional[float] = None) -> Optional[Tuple[Any, FeatureStore, Dict[str, Any]]]:
+    """
+    Map the current snapshot of a key
+
+    Args:
+        root: Snapshot root directory
+        index_key: The filter key of the index (e.g. "all")
+        options: Build options the snapshot must have been saved with
+        max_age: Ignore snapshots older than this many seconds (None = any age)
+
+    Returns:
+        Tuple of (index, store, pointer metadata), or None if there is no
+        usable snapshot
+    """
+    try:
+        with open(_pointer_path(root, index_key)) as f:
+            pointer = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable snapshot pointer for {index_key}: {e}")
+        return None
+
+    if pointer.get("version") != SNAPSHOT_VERSION or pointer.get("options") != options:
+        logger.info(f"Ignoring snapshot of {index_key}: built with a different version or options")
+        return None
+    age = time.time() - pointer["created"]
+    if max_age is not None and age > max_age:
+        logger.info(f"Ignoring snapshot of {index_key}: {age:.0f} seconds old")
+        return None
+
+    directory = os.path.join(root, pointer["directory"])
+    try:
+        path = os.path.join(directory, INDEX_FILE)
+        if GroupedIndex.saved(path):
+            index = GroupedIndex.load(path, options["max_zoom"])
+        else:
+            index = pysupercluster.SuperCluster.load(path)
+        store = FeatureStore.load(directory)
+    except (OSError, ValueError, KeyError) as e:
+        # e.g. replaced and removed by a concurrent save
+        logger.warning(f"Could not load snapshot of {index_key} from {directory}: {e}")
+        return None
+
+    if len(store) != pointer["rows"]:
+        logger.warning(f"Ignoring snapshot of {index_key}: row count mismatch")
+        return None
+
+    return index, store, pointer
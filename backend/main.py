@@ -1,6 +1,6 @@
 #FastAPI implementation of supercluster
 
-from fastapi import FastAPI, HTTPException, Query, Depends, Header, Security
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Security, Response, Request
 from pydantic import BaseModel, Field
 from typing import List, Tuple, Dict, Optional, Any, Union
 import numpy as np
@@ -9,7 +9,11 @@ import os
 import logging
 import time
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import traceback
+import asyncio
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from fastapi.security.api_key import APIKeyHeader
 from dotenv import load_dotenv
@@ -43,8 +47,22 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "pysupercluster"))
 import pysupercluster
 
 # Use relative imports for local modules
-from index_manager import index_manager
-from db import convert_to_geojson, generate_filter_key
+from index_manager import index_manager, IndexGeneration
+from db import convert_to_geojson, generate_filter_key, close_pool
+from mvt import LayerEncoder, encode_tile, MEDIA_TYPE as MVT_MEDIA_TYPE
+from geojson_encoder import encode_cluster_response, MEDIA_TYPE as JSON_MEDIA_TYPE
+
+# Executor for index builds and cold queries, kept off the event loop.
+# pysupercluster releases the GIL while clustering, so builds can overlap.
+INDEX_BUILD_WORKERS = int(os.getenv("INDEX_BUILD_WORKERS", "2"))
+build_executor = ThreadPoolExecutor(max_workers=INDEX_BUILD_WORKERS, thread_name_prefix="index-build")
+
+# Vector tiles: layer name and Cache-Control max-age (seconds). Tile URLs
+# carry the data version (`v`, see /api/tiles.json), so only a URL naming the
+# current version is cached for max-age; other tile requests revalidate
+# against the ETag, which names the same version.
+TILE_LAYER_NAME = os.getenv("TILE_LAYER_NAME", "clusters")
+TILE_CACHE_MAX_AGE = int(os.getenv("TILE_CACHE_MAX_AGE", "86400"))
 
 # Configure logging
 logging.basicConfig(
@@ -60,18 +78,26 @@ async def lifespan(app: FastAPI):
     logger.info("Starting application, preloading all data...")
     try:
         start_time = time.time()
-        index_key, _ = index_manager.get_index({})
+        loop = asyncio.get_running_loop()
+        index_key, _ = await loop.run_in_executor(build_executor, index_manager.get_index, {})
         elapsed = time.time() - start_time
-        logger.info(f"Preloaded all data with key: {index_key} in {elapsed:.2f} seconds")
+        source = index_manager.snapshot_status["source"] or "database"
+        logger.info(f"Preloaded all data with key: {index_key} from {source} in {elapsed:.2f} seconds")
         memory_stats = index_manager.get_stats()
         logger.info(f"Memory usage after preload: {memory_stats['current_memory_mb']} MB")
     except Exception as e:
         logger.error(f"Error during preloading: {str(e)}")
         logger.error(traceback.format_exc())
     
+    # Poll for changed learners if INDEX_WATERMARK_COLUMN and INDEX_REFRESH_INTERVAL are set
+    index_manager.start_refresher()
+    
     yield  # Server is running
     
-    # Shutdown code here if needed
+    # Shutdown code
+    index_manager.stop_refresher()
+    build_executor.shutdown(wait=False, cancel_futures=True)
+    close_pool()
 
 app = FastAPI(
     title="SuperCluster API",
@@ -108,12 +134,12 @@ class FilterOptions(BaseModel):
 
 class ClusterOptions(BaseModel):
     """Options for creating a supercluster index"""
-    minZoom: int = Field(0, description="Minimum zoom level at which clusters are generated")
-    maxZoom: int = Field(16, description="Maximum zoom level at which clusters are generated")
+    minZoom: int = Field(0, ge=0, le=30, description="Minimum zoom level at which clusters are generated")
+    maxZoom: int = Field(16, ge=0, le=30, description="Maximum zoom level at which clusters are generated")
     minPoints: int = Field(100, description="Minimum number of points to form a cluster")
     radius: int = Field(80, description="Cluster radius, in pixels")
     extent: int = Field(512, description="Tile extent. Radius is calculated relative to this value")
-    nodeSize: int = Field(64, description="Size of the KD-tree leaf node. Affects performance")
+    nodeSize: int = Field(64, ge=1, description="Size of the KD-tree leaf node. Affects performance")
     log: bool = Field(False, description="Whether timing info should be logged")
     generateId: bool = Field(False, description="Whether to generate ids for input features in vector tiles")
 
@@ -134,9 +160,9 @@ class ClusterResponse(BaseModel):
 
 class TileRequest(BaseModel):
     """Request for a tile at specific coordinates"""
-    z: int = Field(..., description="Zoom level")
-    x: int = Field(..., description="X coordinate")
-    y: int = Field(..., description="Y coordinate")
+    z: int = Field(..., ge=0, le=30, description="Zoom level")
+    x: int = Field(..., ge=0, description="X coordinate")
+    y: int = Field(..., ge=0, description="Y coordinate")
 
 class ClusterIdRequest(BaseModel):
     """Request for a specific cluster by ID"""
@@ -198,7 +224,7 @@ async def load_points(index_id: str, features: List[Dict[str, Any]], options: Cl
             max_zoom=options.maxZoom,
             radius=options.radius,
             extent=options.extent,
-            min_points=options.minPoints
+            node_size=options.nodeSize
         )
         
         # Store the index for future use
@@ -211,16 +237,137 @@ async def load_points(index_id: str, features: List[Dict[str, Any]], options: Cl
         }
         
         return {"status": "success", "indexId": index_id, "numPoints": len(features)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid index options: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating index: {str(e)}")
 
-@app.get("/api/getClusters", response_model=ClusterResponse, dependencies=[Depends(get_api_key)])
-async def get_clusters(
-    west: float = Query(..., description="West longitude of bounding box"),
-    south: float = Query(..., description="South latitude of bounding box"),
-    east: float = Query(..., description="East longitude of bounding box"),
-    north: float = Query(..., description="North latitude of bounding box"),
-    zoom: int = Query(..., description="Zoom level"),
+def cluster_properties(cluster_id: int, count: int, expansion_zoom: int,
+                       layer_counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Properties of a cluster feature (shared by GeoJSON and vector tile output)"""
+    properties = {
+        "cluster": True,
+        "cluster_id": str(cluster_id),
+        "point_count": count,
+        "point_count_abbreviated": count,
+        "expansion_zoom": expansion_zoom if expansion_zoom >= 0 else None
+    }
+    if layer_counts is not None:
+        properties["layer_counts"] = layer_counts
+    return properties
+
+def cluster_feature(longitude: float, latitude: float, count: int, cluster_id: int,
+                    expansion_zoom: int, original_features,
+                    layer_counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    Convert one pysupercluster result to a GeoJSON feature
+    
+    Clusters get cluster properties (and layer counts, if given); single points
+    are looked up in the original features (by point id) so their properties
+    are preserved.
+    """
+    if count > 1:
+        # This is a cluster
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [longitude, latitude]
+            },
+            "properties": cluster_properties(cluster_id, count, expansion_zoom, layer_counts)
+        }
+    
+    # This is a single point
+    if cluster_id < len(original_features):
+        # Use the original feature with all its properties
+        return original_features[cluster_id]
+    
+    # Fallback if we can't find the original
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [longitude, latitude]
+        },
+        "properties": {
+            "id": str(cluster_id)
+        }
+    }
+
+def query_cluster_json(generation: IndexGeneration, bbox: List[float], zoom: int,
+                       layer_counts: bool = False) -> bytes:
+    """
+    Query an index for a bounding box and encode the result as a ClusterResponse
+    
+    The JSON is written directly from the result arrays (and cached point
+    fragments, if enabled) instead of going through the response model.
+    
+    Args:
+        generation: Index generation to query (index and matching original features)
+        bbox: Bounding box [westLng, southLat, eastLng, northLat]
+        zoom: Zoom level
+        layer_counts: Add the number of points in each map layer to clusters
+        
+    Returns:
+        UTF-8 JSON body with the GeoJSON features for clusters and single points
+    """
+    # Convert bbox from [westLng, southLat, eastLng, northLat] to format expected by pysupercluster
+    top_left = (bbox[0], bbox[3])  # (west, north)
+    bottom_right = (bbox[2], bbox[1])  # (east, south)
+    
+    # Time the cluster generation
+    cluster_start = time.time()
+    clusters = generation.index.getClustersArrays(top_left=top_left, bottom_right=bottom_right, zoom=zoom)
+    cluster_time = time.time() - cluster_start
+    logger.info(f"Generated {len(clusters['id'])} clusters in {cluster_time:.4f} seconds")
+    
+    layer_names = index_manager.layer_names if layer_counts else ()
+    return encode_cluster_response(clusters, generation.features, layer_names)
+
+def build_and_query_cluster_json(filters: Dict[str, Any], bbox: List[float], zoom: int,
+                                 layer_counts: bool = False) -> bytes:
+    """Get or build the index for a filter combination and query it (runs in the build executor)"""
+    return query_cluster_json(index_manager.get_generation(filters), bbox, zoom, layer_counts)
+
+def query_tile(generation: IndexGeneration, z: int, x: int, y: int) -> bytes:
+    """
+    Query an index for a z/x/y tile and encode the result as a vector tile
+    
+    Args:
+        generation: Index generation to query (index and matching original features)
+        z: Tile zoom
+        x: Tile column
+        y: Tile row
+        
+    Returns:
+        Protobuf-encoded Mapbox Vector Tile with a single point layer
+    """
+    tile = generation.index.getTile(z, x, y)
+    original_features = generation.features
+    layer = LayerEncoder(TILE_LAYER_NAME, extent=index_manager.extent)
+    
+    for tile_x, tile_y, count, cluster_id, expansion_zoom in zip(
+            tile['x'].tolist(),
+            tile['y'].tolist(),
+            tile['count'].tolist(),
+            tile['id'].tolist(),
+            tile['expansion_zoom'].tolist()):
+        if count > 1:
+            layer.add_point(tile_x, tile_y, cluster_properties(cluster_id, count, expansion_zoom),
+                            feature_id=cluster_id)
+        elif cluster_id < len(original_features):
+            layer.add_point(tile_x, tile_y, original_features[cluster_id]["properties"])
+        else:
+            layer.add_point(tile_x, tile_y, {"id": str(cluster_id)})
+    
+    return encode_tile([layer])
+
+def build_and_query_tile(filters: Dict[str, Any], z: int, x: int, y: int) -> Tuple[bytes, IndexGeneration]:
+    """Get or build the index for a filter combination and encode a tile (runs in the build executor)"""
+    generation = index_manager.get_generation(filters)
+    return query_tile(generation, z, x, y), generation
+
+def filter_params(
     gender: Optional[str] = Query(None, description="Filter by gender"),
     country_of_residence: Optional[str] = Query(None, description="Filter by country"),
     is_graduate_learner: Optional[bool] = Query(None, description="Filter by graduate status"),
@@ -228,13 +375,8 @@ async def get_clusters(
     is_running_a_venture: Optional[bool] = Query(None, description="Filter by entrepreneurship status"),
     is_featured: Optional[bool] = Query(None, description="Filter by featured status"),
     is_featured_video: Optional[bool] = Query(None, description="Filter by featured video status")
-):
-    """
-    Get clusters for a specific bounding box and zoom level with optional filters
-    """
-    start_time = time.time()
-    
-    # Build filter dictionary from query parameters
+) -> Dict[str, Any]:
+    """Build the filter dictionary from query parameters"""
     filter_dict = {
         'gender': gender,
         'country_of_residence': country_of_residence,
@@ -245,116 +387,215 @@ async def get_clusters(
         'is_featured_video': is_featured_video
     }
     # Remove None values
-    filter_dict = {k: v for k, v in filter_dict.items() if v is not None}
+    return {k: v for k, v in filter_dict.items() if v is not None}
+
+@app.get("/api/getClusters", response_model=ClusterResponse, dependencies=[Depends(get_api_key)])
+async def get_clusters(
+    west: float = Query(..., description="West longitude of bounding box"),
+    south: float = Query(..., description="South latitude of bounding box"),
+    east: float = Query(..., description="East longitude of bounding box"),
+    north: float = Query(..., description="North latitude of bounding box"),
+    zoom: int = Query(..., description="Zoom level"),
+    include_layer_counts: bool = Query(False, description="Add the number of points in each map layer to clusters"),
+    filter_dict: Dict[str, Any] = Depends(filter_params)
+):
+    """
+    Get clusters for a specific bounding box and zoom level with optional filters
+    """
+    start_time = time.time()
+    
+    if include_layer_counts and not index_manager.layer_names:
+        raise HTTPException(status_code=400, detail="Layer counts are not enabled (set INDEX_LAYER_COUNTS)")
+    
+    # Construct bbox from individual parameters
+    bbox = [west, south, east, north]
     
     try:
-        # Get or create filtered index (now uses in-memory filtering)
-        index_key, index = index_manager.get_index(filter_dict)
-        
-        # Construct bbox from individual parameters
-        bbox = [west, south, east, north]
-        
-        # Convert bbox from [westLng, southLat, eastLng, northLat] to format expected by pysupercluster
-        top_left = (bbox[0], bbox[3])  # (west, north)
-        bottom_right = (bbox[2], bbox[1])  # (east, south)
-        
-        # Time the cluster generation
-        cluster_start = time.time()
-        clusters = index.getClusters(top_left=top_left, bottom_right=bottom_right, zoom=zoom)
-        cluster_time = time.time() - cluster_start
-        logger.info(f"Generated clusters in {cluster_time:.4f} seconds")
-        
-        # Convert to GeoJSON format
-        geojson_features = []
-        original_features = index_manager.get_original_features(index_key)
-        
-        for cluster in clusters:
-            if 'count' in cluster and cluster['count'] > 1:
-                # This is a cluster
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [cluster['longitude'], cluster['latitude']]
-                    },
-                    "properties": {
-                        "cluster": True,
-                        "cluster_id": str(cluster['id']),
-                        "point_count": cluster['count'],
-                        "point_count_abbreviated": cluster['count'],
-                        "expansion_zoom": cluster['expansion_zoom'] if cluster['expansion_zoom'] is not None else None
-                    }
-                }
-                geojson_features.append(feature)
-            else:
-                # This is a single point
-                # Find the original feature to preserve properties
-                original_idx = cluster['id']
-                
-                if original_idx < len(original_features):
-                    # Use the original feature with all its properties
-                    geojson_features.append(original_features[original_idx])
-                else:
-                    # Fallback if we can't find the original
-                    feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "Point",
-                            "coordinates": [cluster['longitude'], cluster['latitude']]
-                        },
-                        "properties": {
-                            "id": str(cluster['id'])
-                        }
-                    }
-                    geojson_features.append(feature)
+        generation = index_manager.get_cached_generation(filter_dict)
+        if generation is not None:
+            # Cached index: querying is cheap, answer inline
+            body = query_cluster_json(generation, bbox, zoom, include_layer_counts)
+        else:
+            # Cold filter: build and query in the executor so the event loop keeps serving
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(
+                build_executor, build_and_query_cluster_json, filter_dict, bbox, zoom, include_layer_counts)
         
         elapsed = time.time() - start_time
         logger.info(f"Total getClusters request time: {elapsed:.4f} seconds")
         
-        return ClusterResponse(features=geojson_features)
+        # Already serialized; response_model only documents the schema
+        return Response(content=body, media_type=JSON_MEDIA_TYPE)
     except Exception as e:
         logger.error(f"Error getting clusters: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error getting clusters: {str(e)}")
 
+@app.get("/api/tiles.json", dependencies=[Depends(get_api_key)])
+async def get_tilejson(request: Request, filter_dict: Dict[str, Any] = Depends(filter_params)):
+    """
+    Get a TileJSON document whose tile URL names the current data version
+    
+    Map clients should take the tile URL from here rather than building it,
+    so they switch to new URLs (and skip cached tiles) after a rebuild or
+    refresh. The document itself is never cached.
+    """
+    try:
+        generation = index_manager.get_cached_generation(filter_dict)
+        if generation is None:
+            loop = asyncio.get_running_loop()
+            generation = await loop.run_in_executor(build_executor, index_manager.get_generation, filter_dict)
+    except Exception as e:
+        logger.error(f"Error getting TileJSON: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error getting TileJSON: {str(e)}")
+    
+    params = {k: str(v).lower() if isinstance(v, bool) else v for k, v in filter_dict.items()}
+    query = urlencode({**params, "v": generation.version})
+    return JSONResponse(
+        {
+            "tilejson": "3.0.0",
+            "tiles": [f"{str(request.base_url).rstrip('/')}/api/tiles/{{z}}/{{x}}/{{y}}.mvt?{query}"],
+            "minzoom": index_manager.min_zoom,
+            "maxzoom": index_manager.max_zoom,
+            "version": generation.version
+        },
+        headers={"Cache-Control": "no-store"}
+    )
+
+@app.get("/api/tiles/{z}/{x}/{y}.mvt", dependencies=[Depends(get_api_key)])
+async def get_tile(
+    tile: TileRequest = Depends(),
+    filter_dict: Dict[str, Any] = Depends(filter_params),
+    v: Optional[str] = Query(None, description="Data version from /api/tiles.json"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get a Mapbox Vector Tile of clusters and points with optional filters
+    
+    Responses carry the ETag of the data version they were encoded from; a
+    request whose If-None-Match still names the current version gets a 304
+    without the tile being encoded again. Only responses to a URL whose `v`
+    names that version may be cached without revalidating.
+    """
+    if tile.x >= 2 ** tile.z or tile.y >= 2 ** tile.z:
+        raise HTTPException(status_code=400, detail=f"Tile {tile.z}/{tile.x}/{tile.y} is out of range")
+    
+    start_time = time.time()
+    
+    try:
+        generation = index_manager.get_cached_generation(filter_dict)
+        if generation is not None:
+            if if_none_match is not None and generation.etag in if_none_match:
+                return Response(status_code=304, headers=tile_headers(generation, v))
+            data = query_tile(generation, tile.z, tile.x, tile.y)
+        else:
+            loop = asyncio.get_running_loop()
+            data, generation = await loop.run_in_executor(
+                build_executor, build_and_query_tile, filter_dict, tile.z, tile.x, tile.y)
+        
+        elapsed = time.time() - start_time
+        logger.info(f"Encoded tile {tile.z}/{tile.x}/{tile.y} ({len(data)} bytes) in {elapsed:.4f} seconds")
+        
+        return Response(
+            content=data,
+            media_type=MVT_MEDIA_TYPE,
+            headers=tile_headers(generation, v)
+        )
+    except Exception as e:
+        logger.error(f"Error getting tile: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error getting tile: {str(e)}")
+
+def tile_headers(generation: IndexGeneration, version: Optional[str]) -> Dict[str, str]:
+    """
+    Caching headers of a tile encoded from a generation
+    
+    A URL naming the generation's version never changes content, so it is
+    cached for max-age; any other URL may be served from a new version at
+    any time and is revalidated. Tiles need an API key, so shared caches
+    must not store them.
+    """
+    if version == generation.version:
+        cache_control = f"private, max-age={TILE_CACHE_MAX_AGE}, immutable"
+    else:
+        cache_control = "private, no-cache"
+    return {"Cache-Control": cache_control, "ETag": generation.etag}
+
+def resolve_index(index_id: str):
+    """
+    Find an index by id: a loaded index, or a cached filter index by its filter key
+    
+    Returns:
+        Tuple of (index, original features)
+    """
+    if index_id in supercluster_indexes:
+        entry = supercluster_indexes[index_id]
+        return entry["index"], entry["features"]
+    
+    generation = index_manager.get_generation_by_key(index_id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail=f"Index with ID {index_id} not found")
+    return generation.index, generation.features
+
+def parse_cluster_id(cluster_id: str) -> int:
+    """Parse a cluster id as returned in cluster_id properties"""
+    try:
+        return int(cluster_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cluster ID: {cluster_id}")
+
+def cluster_list_features(clusters: List[Dict[str, Any]], original_features) -> List[Dict[str, Any]]:
+    """Convert a list of pysupercluster cluster dicts to GeoJSON features"""
+    return [
+        cluster_feature(
+            c['longitude'], c['latitude'], c['count'], c['id'],
+            -1 if c['expansion_zoom'] is None else c['expansion_zoom'],
+            original_features)
+        for c in clusters
+    ]
+
 @app.post("/api/getClusterExpansionZoom/{index_id}", response_model=Dict[str, Any])
 async def get_cluster_expansion_zoom(index_id: str, request: ClusterIdRequest):
     """Get the zoom level at which a cluster expands"""
-    if index_id not in supercluster_indexes:
-        raise HTTPException(status_code=404, detail=f"Index with ID {index_id} not found")
+    index, _ = resolve_index(index_id)
+    cluster_id = parse_cluster_id(request.clusterId)
     
     try:
-        # In pysupercluster, the expansion_zoom is already calculated when getClusters is called
-        # We can find the cluster and return its expansion_zoom
-        cluster_id = int(request.clusterId)
-        
-        # This is a simplified implementation as pysupercluster doesn't have this method directly
-        # We would need to implement logic to find a specific cluster by ID
-        # For now, return a mock response
         return {
-            "expansion_zoom": 10  # Mock value
+            "expansion_zoom": index.getClusterExpansionZoom(cluster_id)
         }
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Cluster {request.clusterId} not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting cluster expansion zoom: {str(e)}")
 
 @app.post("/api/getChildren/{index_id}", response_model=ClusterResponse)
 async def get_children(index_id: str, request: ClusterIdRequest):
     """Get the children of a cluster"""
-    if index_id not in supercluster_indexes:
-        raise HTTPException(status_code=404, detail=f"Index with ID {index_id} not found")
+    index, original_features = resolve_index(index_id)
+    cluster_id = parse_cluster_id(request.clusterId)
     
-    # This would require additional implementation in pysupercluster
-    # For now, return an empty response
-    return ClusterResponse(features=[])
+    try:
+        children = index.getChildren(cluster_id)
+        return ClusterResponse(features=cluster_list_features(children, original_features))
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Cluster {request.clusterId} not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting cluster children: {str(e)}")
 
 @app.post("/api/getLeaves/{index_id}", response_model=ClusterResponse)
 async def get_leaves(index_id: str, request: ClusterLeavesRequest):
     """Get the points of a cluster with pagination"""
-    if index_id not in supercluster_indexes:
-        raise HTTPException(status_code=404, detail=f"Index with ID {index_id} not found")
+    index, original_features = resolve_index(index_id)
+    cluster_id = parse_cluster_id(request.clusterId)
+    if request.limit < 0 or request.offset < 0:
+        raise HTTPException(status_code=400, detail="limit and offset must be >= 0")
     
-    # This would require additional implementation in pysupercluster
-    # For now, return an empty response
-    return ClusterResponse(features=[])
+    try:
+        leaves = index.getLeaves(cluster_id, limit=request.limit, offset=request.offset)
+        return ClusterResponse(features=cluster_list_features(leaves, original_features))
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Cluster {request.clusterId} not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting cluster leaves: {str(e)}")
 
 @app.delete("/api/delete/{index_id}")
 async def delete_index(index_id: str):
@@ -388,6 +629,16 @@ async def clear_cache():
     index_manager.clear_cache()
     return {"status": "success", "message": "Cache cleared successfully"}
 
+@app.post("/api/refresh", dependencies=[Depends(get_api_key)])
+async def refresh_changes():
+    """Apply learner rows changed since the last load or refresh to the cached indexes"""
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(build_executor, index_manager.refresh_changes)
+    except Exception as e:
+        logger.error(f"Error refreshing changes: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error refreshing changes: {str(e)}")
+
 @app.get("/api/availableFilters")
 async def get_available_filters():
     """Get information about available filters"""
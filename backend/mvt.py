@@ -0,0 +1,127 @@
+"""
+Minimal Mapbox Vector Tile (MVT 2.1) encoder for point layers
+"""
+import struct
+from typing import Dict, Any, List, Optional, Tuple
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+
+# Geometry type and command from the vector tile spec
+GEOM_POINT = 1
+CMD_MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+
+MVT_VERSION = 2
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+def _varint(value: int) -> bytes:
+    """Encode an unsigned integer as a protobuf varint"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    """Zigzag-encode a signed integer"""
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, WIRE_LENGTH) + _varint(len(payload)) + payload
+
+
+def _encode_value(value: Any) -> bytes:
+    """Encode a property value as a Tile.Value message"""
+    if isinstance(value, bool):
+        return _key(7, WIRE_VARINT) + _varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _key(5, WIRE_VARINT) + _varint(value)
+        return _key(6, WIRE_VARINT) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, WIRE_FIXED64) + struct.pack("<d", value)
+    return _length_delimited(1, str(value).encode("utf-8"))
+
+
+class LayerEncoder:
+    """
+    Accumulates point features for one vector tile layer
+
+    Keys and values are interned as features are added, so repeated
+    properties (e.g. "cluster": True) are stored once per layer. Properties
+    whose value is None are omitted, since MVT has no null value.
+    """
+    def __init__(self, name: str, extent: int = 4096):
+        self.name = name
+        self.extent = extent
+        self.keys: Dict[str, int] = {}
+        self.values: Dict[Tuple[type, Any], int] = {}
+        self.features: List[bytes] = []
+
+    def _tag(self, key: str, value: Any) -> Tuple[int, int]:
+        key_index = self.keys.setdefault(key, len(self.keys))
+        value_index = self.values.setdefault((type(value), value), len(self.values))
+        return key_index, value_index
+
+    def add_point(self, x: int, y: int, properties: Dict[str, Any], feature_id: Optional[int] = None) -> None:
+        """
+        Add a point feature
+
+        Args:
+            x: Tile-space x coordinate
+            y: Tile-space y coordinate
+            properties: Feature properties
+            feature_id: Optional non-negative feature id
+        """
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.extend(self._tag(key, value))
+
+        feature = b""
+        if feature_id is not None:
+            feature += _key(1, WIRE_VARINT) + _varint(feature_id)
+        if tags:
+            feature += _length_delimited(2, b"".join(_varint(tag) for tag in tags))
+        feature += _key(3, WIRE_VARINT) + _varint(GEOM_POINT)
+        geometry = _varint(CMD_MOVE_TO_ONE) + _varint(_zigzag(x)) + _varint(_zigzag(y))
+        feature += _length_delimited(4, geometry)
+
+        self.features.append(feature)
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def encode(self) -> bytes:
+        """Encode the layer as a Tile.Layer message"""
+        layer = _key(15, WIRE_VARINT) + _varint(MVT_VERSION)
+        layer += _length_delimited(1, self.name.encode("utf-8"))
+        layer += b"".join(_length_delimited(2, feature) for feature in self.features)
+        layer += b"".join(_length_delimited(3, key.encode("utf-8")) for key in self.keys)
+        layer += b"".join(_length_delimited(4, _encode_value(value)) for _, value in self.values)
+        layer += _key(5, WIRE_VARINT) + _varint(self.extent)
+        return layer
+
+
+def encode_tile(layers: List[LayerEncoder]) -> bytes:
+    """
+    Encode layers as a vector tile
+
+    Args:
+        layers: Layers to include (empty layers are skipped)
+
+    Returns:
+        Protobuf-encoded tile bytes
+    """
+    return b"".join(_length_delimited(3, layer.encode()) for layer in layers if len(layer))
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of kd-tree node sizes.
+
+Building an index is dominated by the radius (``within``) searches of each
+zoom level, and viewport queries by ``range`` searches. This script times
+both for a few ``node_size`` values on uniformly random points:
+
+    python benchmark.py [num_points] [repeat]
+"""
+import sys
+import time
+
+import numpy
+
+import pysupercluster
+
+NODE_SIZES = (8, 16, 32, 64, 128, 256)
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    rng = numpy.random.RandomState(0)
+    points = numpy.column_stack([
+        rng.uniform(-20, 50, num_points),
+        rng.uniform(-35, 35, num_points),
+    ])
+
+    # 5 degree viewports over the whole data set at every zoom level
+    queries = numpy.array([
+        (west, south, west + 5, south + 5, zoom)
+        for zoom in range(0, 18)
+        for west in range(-20, 50, 5)
+        for south in range(-35, 35, 5)
+    ], dtype=float)
+
+    print('%d points, %d viewport queries, best of %d' % (num_points, len(queries), repeat))
+    print('%9s %10s %10s' % ('node_size', 'build (s)', 'query (s)'))
+
+    for node_size in NODE_SIZES:
+        def build():
+            return pysupercluster.SuperCluster(
+                points, min_zoom=0, max_zoom=16, radius=40, extent=512, node_size=node_size)
+
+        index = build()
+        build_time = best_of(repeat, build)
+        query_time = best_of(repeat, lambda: index.getClustersBatch(queries))
+        print('%9d %10.3f %10.3f' % (node_size, build_time, query_time))
+
+
+if __name__ == '__main__':
+    main()
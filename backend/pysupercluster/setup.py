@@ -58,7 +58,8 @@ setup(
     ext_modules=[
         Extension(
             "pysupercluster",
-            extra_compile_args=["-std=c++1y"],
+            extra_compile_args=["-std=c++1y", "-pthread"],
+            extra_link_args=["-pthread"],
             language="c++",
             depends=["src/kdbush.hpp", "src/supercluster.hpp",],
             sources=["src/module.cpp", "src/supercluster.cpp",],
@@ -19,7 +19,10 @@
 #include <algorithm>
 #include <cmath>
 #include <cstdint>
+#include <exception>
+#include <thread>
 #include <tuple>
+#include <type_traits>
 #include <vector>
 #include <cassert>
 
@@ -32,151 +35,279 @@ struct nth {
     }
 };
 
+/*
+    Static kd-tree over 2-D points. Coordinates are kept in two flat arrays
+    (x and y) sorted into kd order; searches walk the tree with an explicit
+    stack and scan leaves as a linear pass over contiguous coordinates whose
+    bounds and distance tests have no branches. Visitors are still called
+    in the same order as the original recursive search: node, left subtree,
+    right subtree, and ascending positions within a leaf.
+
+    A tree either owns its sorted coordinates or views arrays sorted by an
+    earlier build (for example a memory-mapped index file).
+*/
 template <typename TPoint, typename TIndex = std::size_t>
 class KDBush {
 
 public:
-    using TNumber = decltype(nth<0, TPoint>::get(std::declval<TPoint>()));
+    using TNumber = typename std::decay<decltype(nth<0, TPoint>::get(std::declval<TPoint>()))>::type;
     static_assert(
-        std::is_same<TNumber, decltype(nth<1, TPoint>::get(std::declval<TPoint>()))>::value,
+        std::is_same<TNumber, typename std::decay<decltype(nth<1, TPoint>::get(std::declval<TPoint>()))>::type>::value,
         "point component types must be identical");
 
-    static const std::uint8_t defaultNodeSize = 64;
+    static const std::uint32_t defaultNodeSize = 64;
 
-    KDBush(const std::uint8_t nodeSize_ = defaultNodeSize) : nodeSize(nodeSize_) {
+    KDBush(const std::uint32_t nodeSize_ = defaultNodeSize) : nodeSize(std::max<std::uint32_t>(nodeSize_, 1)) {
     }
 
-    KDBush(const std::vector<TPoint> &points_, const std::uint8_t nodeSize_ = defaultNodeSize)
-        : KDBush(std::begin(points_), std::end(points_), nodeSize_) {
+    KDBush(const std::vector<TPoint> &points_,
+           const std::uint32_t nodeSize_ = defaultNodeSize,
+           const unsigned threads_ = 1)
+        : KDBush(std::begin(points_), std::end(points_), nodeSize_, threads_) {
     }
 
     template <typename TPointIter>
     KDBush(const TPointIter &points_begin,
            const TPointIter &points_end,
-           const std::uint8_t nodeSize_ = defaultNodeSize)
-        : nodeSize(nodeSize_) {
+           const std::uint32_t nodeSize_ = defaultNodeSize,
+           const unsigned threads_ = 1)
+        : nodeSize(std::max<std::uint32_t>(nodeSize_, 1)), threads(threads_) {
         fill(points_begin, points_end);
     }
 
+    // Views coordinates already in kd order; they must outlive the tree.
+    KDBush(const TNumber *xs_, const TNumber *ys_, const TIndex size_, const std::uint32_t nodeSize_)
+        : coordsX(xs_), coordsY(ys_), numItems(size_), nodeSize(std::max<std::uint32_t>(nodeSize_, 1)) {
+    }
+
+    // Searches read through pointers into the coordinate arrays.
+    KDBush(const KDBush &) = delete;
+    KDBush &operator=(const KDBush &) = delete;
+
     void fill(const std::vector<TPoint> &points_) {
         fill(std::begin(points_), std::end(points_));
     }
 
     template <typename TPointIter>
     void fill(const TPointIter &points_begin, const TPointIter &points_end) {
-        assert(points.empty());
+        assert(xs.empty());
         const TIndex size = static_cast<TIndex>(std::distance(points_begin, points_end));
 
-        points.reserve(size);
+        xs.reserve(size);
+        ys.reserve(size);
         ids.reserve(size);
 
         TIndex i = 0;
         for (auto p = points_begin; p != points_end; p++) {
-            points.emplace_back(nth<0, TPoint>::get(*p), nth<1, TPoint>::get(*p));
+            xs.push_back(nth<0, TPoint>::get(*p));
+            ys.push_back(nth<1, TPoint>::get(*p));
             ids.push_back(i++);
         }
 
-        sortKD(0, size - 1, 0);
-    }
+        if (size > 0)
+            sortKD(0, size - 1, 0, 1);
 
-    template <typename TVisitor>
-    void range(const TNumber minX,
-               const TNumber minY,
-               const TNumber maxX,
-               const TNumber maxY,
-               const TVisitor &visitor) {
-        range(minX, minY, maxX, maxY, visitor, 0, static_cast<TIndex>(ids.size() - 1), 0);
+        coordsX = xs.data();
+        coordsY = ys.data();
+        numItems = size;
     }
 
-    template <typename TVisitor>
-    void within(const TNumber qx, const TNumber qy, const TNumber r, const TVisitor &visitor) {
-        within(qx, qy, r, visitor, 0, static_cast<TIndex>(ids.size() - 1), 0);
-    }
-
-private:
-    std::vector<TIndex> ids;
-    std::vector<std::pair<TNumber, TNumber>> points;
-    std::uint8_t nodeSize;
-
+    // Visitors receive the position of a point in the sorted order; sortedIds()
+    // maps positions back to the order the points were given in.
     template <typename TVisitor>
     void range(const TNumber minX,
                const TNumber minY,
                const TNumber maxX,
                const TNumber maxY,
-               const TVisitor &visitor,
-               const TIndex left,
-               const TIndex right,
-               const std::uint8_t axis) {
-
-        if (right - left <= nodeSize) {
-            for (auto i = left; i <= right; i++) {
-                const TNumber x = std::get<0>(points[i]);
-                const TNumber y = std::get<1>(points[i]);
-                if (x >= minX && x <= maxX && y >= minY && y <= maxY) visitor(ids[i]);
+               const TVisitor &visitor) const {
+        if (numItems == 0) return;
+
+        Node stack[kMaxDepth];
+        std::size_t top = 0;
+        Node node{0, numItems - 1, 0};
+
+        while (true) {
+            const TIndex left = node.left;
+            const TIndex right = node.right;
+
+            if (right - left > nodeSize) {
+                const TIndex m = (left + right) >> 1;
+                const TNumber x = coordsX[m];
+                const TNumber y = coordsY[m];
+
+                if (x >= minX && x <= maxX && y >= minY && y <= maxY) visitor(m);
+
+                const std::uint8_t axis = 1 - node.axis;
+                const bool goLeft = node.axis == 0 ? minX <= x : minY <= y;
+                const bool goRight = node.axis == 0 ? maxX >= x : maxY >= y;
+
+                // descend left first, keeping the right sibling for later
+                if (goLeft) {
+                    if (goRight) stack[top++] = Node{m + 1, right, axis};
+                    node = Node{left, m - 1, axis};
+                    continue;
+                }
+                if (goRight) {
+                    node = Node{m + 1, right, axis};
+                    continue;
+                }
+            } else {
+                scanLeaf(left, right, visitor, [=](const TNumber x, const TNumber y) {
+                    return (x >= minX) & (x <= maxX) & (y >= minY) & (y <= maxY);
+                });
             }
-            return;
+
+            if (top == 0) break;
+            node = stack[--top];
         }
+    }
 
-        const TIndex m = (left + right) >> 1;
-        const TNumber x = std::get<0>(points[m]);
-        const TNumber y = std::get<1>(points[m]);
+    template <typename TVisitor>
+    void within(const TNumber qx, const TNumber qy, const TNumber r, const TVisitor &visitor) const {
+        if (numItems == 0) return;
 
-        if (x >= minX && x <= maxX && y >= minY && y <= maxY) visitor(ids[m]);
+        const TNumber r2 = r * r;
+        Node stack[kMaxDepth];
+        std::size_t top = 0;
+        Node node{0, numItems - 1, 0};
+
+        while (true) {
+            const TIndex left = node.left;
+            const TIndex right = node.right;
+
+            if (right - left > nodeSize) {
+                const TIndex m = (left + right) >> 1;
+                const TNumber x = coordsX[m];
+                const TNumber y = coordsY[m];
+
+                if (sqDist(x, y, qx, qy) <= r2) visitor(m);
+
+                const std::uint8_t axis = 1 - node.axis;
+                const bool goLeft = node.axis == 0 ? qx - r <= x : qy - r <= y;
+                const bool goRight = node.axis == 0 ? qx + r >= x : qy + r >= y;
+
+                // descend left first, keeping the right sibling for later
+                if (goLeft) {
+                    if (goRight) stack[top++] = Node{m + 1, right, axis};
+                    node = Node{left, m - 1, axis};
+                    continue;
+                }
+                if (goRight) {
+                    node = Node{m + 1, right, axis};
+                    continue;
+                }
+            } else {
+                scanLeaf(left, right, visitor, [=](const TNumber x, const TNumber y) {
+                    return sqDist(x, y, qx, qy) <= r2;
+                });
+            }
 
-        if (axis == 0 ? minX <= x : minY <= y)
-            range(minX, minY, maxX, maxY, visitor, left, m - 1, (axis + 1) % 2);
+            if (top == 0) break;
+            node = stack[--top];
+        }
+    }
 
-        if (axis == 0 ? maxX >= x : maxY >= y)
-            range(minX, minY, maxX, maxY, visitor, m + 1, right, (axis + 1) % 2);
+    const std::vector<TIndex> &sortedIds() const {
+        return ids;
     }
 
-    template <typename TVisitor>
-    void within(const TNumber qx,
-                const TNumber qy,
-                const TNumber r,
-                const TVisitor &visitor,
-                const TIndex left,
-                const TIndex right,
-                const std::uint8_t axis) {
+    // Frees the position-to-id mapping once the caller has stored its data
+    // in sorted order.
+    void releaseIds() {
+        std::vector<TIndex>().swap(ids);
+    }
 
-        const TNumber r2 = r * r;
+    std::pair<TNumber, TNumber> point(const TIndex i) const {
+        return std::make_pair(coordsX[i], coordsY[i]);
+    }
 
-        if (right - left <= nodeSize) {
-            for (auto i = left; i <= right; i++) {
-                const TNumber x = std::get<0>(points[i]);
-                const TNumber y = std::get<1>(points[i]);
-                if (sqDist(x, y, qx, qy) <= r2) visitor(ids[i]);
-            }
-            return;
-        }
+    // Coordinates in kd order
+    const TNumber *xCoords() const {
+        return coordsX;
+    }
 
-        const TIndex m = (left + right) >> 1;
-        const TNumber x = std::get<0>(points[m]);
-        const TNumber y = std::get<1>(points[m]);
+    const TNumber *yCoords() const {
+        return coordsY;
+    }
 
-        if (sqDist(x, y, qx, qy) <= r2) visitor(ids[m]);
+    TIndex size() const {
+        return numItems;
+    }
 
-        if (axis == 0 ? qx - r <= x : qy - r <= y)
-            within(qx, qy, r, visitor, left, m - 1, (axis + 1) % 2);
+    std::uint32_t getNodeSize() const {
+        return nodeSize;
+    }
 
-        if (axis == 0 ? qx + r >= x : qy + r >= y)
-            within(qx, qy, r, visitor, m + 1, right, (axis + 1) % 2);
+private:
+    struct Node {
+        TIndex left;
+        TIndex right;
+        std::uint8_t axis;
+    };
+
+    // The tree is balanced, so its depth is at most log2(size) + 1 and the
+    // stack holds at most one pending sibling per level.
+    static const std::size_t kMaxDepth = 8 * sizeof(TIndex) + 2;
+
+    // Build storage; searches go through coordsX and coordsY, which point
+    // either here or at arrays owned by the caller.
+    std::vector<TIndex> ids;
+    std::vector<TNumber> xs;
+    std::vector<TNumber> ys;
+    const TNumber *coordsX = nullptr;
+    const TNumber *coordsY = nullptr;
+    TIndex numItems = 0;
+    std::uint32_t nodeSize;
+    unsigned threads = 1;
+
+    // Subtrees smaller than this are always sorted on the calling thread
+    static const TIndex minParallelSort = 65536;
+
+    template <typename TVisitor, typename TTest>
+    void scanLeaf(const TIndex left, const TIndex right, const TVisitor &visitor, const TTest &test) const {
+        const TNumber *x = coordsX;
+        const TNumber *y = coordsY;
+        for (TIndex i = left; i <= right; i++)
+            if (test(x[i], y[i])) visitor(i);
     }
 
-    void sortKD(const TIndex left, const TIndex right, const std::uint8_t axis) {
+    void sortKD(const TIndex left, const TIndex right, const std::uint8_t axis, const unsigned width) {
         if (right - left <= nodeSize) return;
         const TIndex m = (left + right) >> 1;
         if (axis == 0) {
-            select<0>(m, left, right);
+            select(xs, m, left, right);
+        } else {
+            select(ys, m, left, right);
+        }
+
+        // The two halves touch disjoint ranges, so they can be sorted in
+        // parallel without changing the result.
+        // A failure on either side (e.g. a nested thread that cannot start)
+        // is rethrown only after the worker is joined.
+        if (width < threads && right - left >= minParallelSort) {
+            std::exception_ptr error;
+            std::thread worker([this, left, m, axis, width, &error]() {
+                try {
+                    sortKD(left, m - 1, 1 - axis, width * 2);
+                } catch (...) {
+                    error = std::current_exception();
+                }
+            });
+            try {
+                sortKD(m + 1, right, 1 - axis, width * 2);
+            } catch (...) {
+                worker.join();
+                throw;
+            }
+            worker.join();
+            if (error) std::rethrow_exception(error);
         } else {
-            select<1>(m, left, right);
+            sortKD(left, m - 1, 1 - axis, width);
+            sortKD(m + 1, right, 1 - axis, width);
         }
-        sortKD(left, m - 1, (axis + 1) % 2);
-        sortKD(m + 1, right, (axis + 1) % 2);
     }
 
-    template <std::uint8_t I>
-    void select(const TIndex k, TIndex left, TIndex right) {
+    void select(const std::vector<TNumber> &coords, const TIndex k, TIndex left, TIndex right) {
 
         while (right > left) {
             if (right - left > 600) {
@@ -186,23 +317,23 @@ private:
                 const double s = 0.5 * std::exp(2 * z / 3);
                 const double r =
                     k - m * s / n + 0.5 * std::sqrt(z * s * (1 - s / n)) * (2 * m < n ? -1 : 1);
-                select<I>(k, std::max(left, TIndex(r)), std::min(right, TIndex(r + s)));
+                select(coords, k, std::max(left, TIndex(r)), std::min(right, TIndex(r + s)));
             }
 
-            const TNumber t = std::get<I>(points[k]);
+            const TNumber t = coords[k];
             TIndex i = left;
             TIndex j = right;
 
             swapItem(left, k);
-            if (std::get<I>(points[right]) > t) swapItem(left, right);
+            if (coords[right] > t) swapItem(left, right);
 
             while (i < j) {
                 swapItem(i++, j--);
-                while (std::get<I>(points[i]) < t) i++;
-                while (std::get<I>(points[j]) > t) j--;
+                while (coords[i] < t) i++;
+                while (coords[j] > t) j--;
             }
 
-            if (std::get<I>(points[left]) == t)
+            if (coords[left] == t)
                 swapItem(left, j);
             else {
                 swapItem(++j, right);
@@ -214,12 +345,15 @@ private:
     }
 
     void swapItem(const TIndex i, const TIndex j) {
-        std::iter_swap(ids.begin() + i, ids.begin() + j);
-        std::iter_swap(points.begin() + i, points.begin() + j);
+        std::swap(ids[i], ids[j]);
+        std::swap(xs[i], xs[j]);
+        std::swap(ys[i], ys[j]);
     }
 
-    TNumber sqDist(const TNumber ax, const TNumber ay, const TNumber bx, const TNumber by) {
-        return std::pow(ax - bx, 2) + std::pow(ay - by, 2);
+    static TNumber sqDist(const TNumber ax, const TNumber ay, const TNumber bx, const TNumber by) {
+        const TNumber dx = ax - bx;
+        const TNumber dy = ay - by;
+        return dx * dx + dy * dy;
     }
 };
 
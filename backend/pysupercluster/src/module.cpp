@@ -20,7 +20,17 @@
 #include <Python.h>
 #include <numpy/arrayobject.h>
 
+#include <algorithm>
+#include <cerrno>
+#include <climits>
 #include <cmath>
+#include <exception>
+#include <functional>
+#include <new>
+#include <stdexcept>
+#include <string>
+#include <system_error>
+#include <thread>
 #include "supercluster.hpp"
 
 
@@ -41,6 +51,160 @@ static double latY(double lat) {
 }
 
 
+/*
+    Longitudes and latitudes of the input points, read in place from one (N, 2)
+    array or two (N,) arrays of float32 or float64 through their byte strides.
+*/
+struct Coordinates {
+    PyArrayObject *arrays[2] = {NULL, NULL};
+    const char *lng = NULL;
+    const char *lat = NULL;
+    npy_intp lngStride = 0;
+    npy_intp latStride = 0;
+    npy_intp count = 0;
+    int type = NPY_DOUBLE;
+
+    ~Coordinates() {
+        Py_XDECREF(arrays[0]);
+        Py_XDECREF(arrays[1]);
+    }
+};
+
+
+/*
+    Returns an aligned, native byte order float32 or float64 view of `arg`
+    with `ndim` dimensions, converting only other inputs (to float64).
+*/
+static PyArrayObject *
+floatArray(PyObject *arg, int ndim, bool forceDouble)
+{
+    if (!forceDouble) {
+        PyArrayObject *array = (PyArrayObject*)PyArray_FromAny(arg, NULL, ndim, ndim, NPY_ARRAY_ALIGNED, NULL);
+        if (array == NULL)
+            return NULL;
+        const int type = PyArray_TYPE(array);
+        if ((type == NPY_DOUBLE || type == NPY_FLOAT) && PyArray_ISNOTSWAPPED(array))
+            return array;
+        Py_DECREF(array);
+    }
+    return (PyArrayObject*)PyArray_FROMANY(arg, NPY_DOUBLE, ndim, ndim, NPY_ARRAY_ALIGNED);
+}
+
+
+static bool
+parseCoordinates(PyObject *pointsArg, PyObject *lngArg, PyObject *latArg, Coordinates &coordinates)
+{
+    const bool columns = lngArg != Py_None || latArg != Py_None;
+    if ((pointsArg != Py_None) == columns || (columns && (lngArg == Py_None || latArg == Py_None))) {
+        PyErr_SetString(PyExc_ValueError, "Pass either points or both longitudes and latitudes.");
+        return false;
+    }
+
+    if (!columns) {
+        PyArrayObject *points = floatArray(pointsArg, 2, false);
+        if (points == NULL)
+            return false;
+        coordinates.arrays[0] = points;
+        if (PyArray_DIMS(points)[1] != 2 || PyArray_DIMS(points)[0] == 0) {
+            PyErr_SetString(PyExc_ValueError, "points must be a 2 dimensional (N, 2) array with a length >= 1.");
+            return false;
+        }
+        coordinates.type = PyArray_TYPE(points);
+        coordinates.count = PyArray_DIMS(points)[0];
+        coordinates.lng = PyArray_BYTES(points);
+        coordinates.lat = PyArray_BYTES(points) + PyArray_STRIDES(points)[1];
+        coordinates.lngStride = coordinates.latStride = PyArray_STRIDES(points)[0];
+        return true;
+    }
+
+    // Both columns must share a type: convert the pair to float64 otherwise
+    for (int attempt = 0; attempt < 2; ++attempt) {
+        Py_CLEAR(coordinates.arrays[0]);
+        Py_CLEAR(coordinates.arrays[1]);
+        coordinates.arrays[0] = floatArray(lngArg, 1, attempt == 1);
+        if (coordinates.arrays[0] == NULL)
+            return false;
+        coordinates.arrays[1] = floatArray(latArg, 1, attempt == 1);
+        if (coordinates.arrays[1] == NULL)
+            return false;
+        if (PyArray_TYPE(coordinates.arrays[0]) == PyArray_TYPE(coordinates.arrays[1]))
+            break;
+    }
+
+    PyArrayObject *lng = coordinates.arrays[0];
+    PyArrayObject *lat = coordinates.arrays[1];
+    if (PyArray_DIMS(lng)[0] != PyArray_DIMS(lat)[0] || PyArray_DIMS(lng)[0] == 0) {
+        PyErr_SetString(PyExc_ValueError, "longitudes and latitudes must have the same length >= 1.");
+        return false;
+    }
+    coordinates.type = PyArray_TYPE(lng);
+    coordinates.count = PyArray_DIMS(lng)[0];
+    coordinates.lng = PyArray_BYTES(lng);
+    coordinates.lat = PyArray_BYTES(lat);
+    coordinates.lngStride = PyArray_STRIDES(lng)[0];
+    coordinates.latStride = PyArray_STRIDES(lat)[0];
+    return true;
+}
+
+
+/*
+    Projects points [begin, end) to Web Mercator. Longitudes and latitudes
+    are separate passes: the longitude pass is a plain multiply-add the
+    compiler vectorizes, and the latitude pass runs without the longitude
+    loads in between.
+*/
+template <typename T>
+static void
+projectRange(const Coordinates &coordinates, npy_intp begin, npy_intp end, Point *items)
+{
+    const char *lng = coordinates.lng + begin * coordinates.lngStride;
+    for (npy_intp i = begin; i < end; ++i, lng += coordinates.lngStride)
+        items[i].first = lngX(*(const T*)lng);
+
+    const char *lat = coordinates.lat + begin * coordinates.latStride;
+    for (npy_intp i = begin; i < end; ++i, lat += coordinates.latStride)
+        items[i].second = latY(*(const T*)lat);
+}
+
+
+// Points per projection thread: below this, starting a thread costs more
+// than it saves.
+static const npy_intp projectChunk = 1 << 16;
+
+
+static void
+project(const Coordinates &coordinates, int threads, std::vector<Point> &items)
+{
+    void (*projectPart)(const Coordinates &, npy_intp, npy_intp, Point *) =
+        coordinates.type == NPY_FLOAT ? projectRange<float> : projectRange<double>;
+
+    const npy_intp count = coordinates.count;
+    const npy_intp parts = std::max<npy_intp>(1, std::min<npy_intp>(threads, count / projectChunk));
+    if (parts == 1) {
+        projectPart(coordinates, 0, count, items.data());
+        return;
+    }
+
+    // A thread that fails to start is reported only after the started ones
+    // are joined (destroying a joinable thread terminates the process).
+    std::vector<std::thread> workers;
+    workers.reserve(parts - 1);
+    const npy_intp step = (count + parts - 1) / parts;
+    try {
+        for (npy_intp begin = step; begin < count; begin += step)
+            workers.emplace_back(projectPart, std::cref(coordinates), begin, std::min(count, begin + step),
+                                 items.data());
+    } catch (...) {
+        for (auto &worker : workers)
+            worker.join();
+        throw;
+    }
+    projectPart(coordinates, 0, std::min(count, step), items.data());
+    for (auto &worker : workers)
+        worker.join();
+}
+
+
 static double xLng(double x) {
     return (x - 0.5) * 360;
 }
@@ -58,34 +222,246 @@ typedef struct {
 } SuperClusterObject;
 
 
+// Matching point counts of an index for one mask, created by SuperCluster.filter()
+typedef struct {
+    PyObject_HEAD
+    SuperClusterObject *index;
+    ClusterFilter *filter;
+} FilterObject;
+
+
+static void
+Filter_dealloc(FilterObject *self)
+{
+    delete self->filter;
+    Py_XDECREF(self->index);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+
+static PyObject *
+Filter_getCount(FilterObject *self, void *closure)
+{
+    return PyLong_FromSize_t(self->filter->matching);
+}
+
+
+static PyObject *
+Filter_getNbytes(FilterObject *self, void *closure)
+{
+    return PyLong_FromSize_t(self->filter->bytes());
+}
+
+
+static PyGetSetDef Filter_getset[] = {
+    {"count", (getter)Filter_getCount, NULL, "Number of points that pass the filter.", NULL},
+    {"nbytes", (getter)Filter_getNbytes, NULL, "Memory used by the per-cluster counts in bytes.", NULL},
+    {NULL}
+};
+
+
+static PyTypeObject FilterType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "pysupercluster.Filter",            /* tp_name */
+    sizeof(FilterObject),               /* tp_basicsize */
+    0,                                  /* tp_itemsize */
+    (destructor)Filter_dealloc,         /* tp_dealloc */
+    0,                                  /* tp_print */
+    0,                                  /* tp_getattr */
+    0,                                  /* tp_setattr */
+    0,                                  /* tp_reserved */
+    0,                                  /* tp_repr */
+    0,                                  /* tp_as_number */
+    0,                                  /* tp_as_sequence */
+    0,                                  /* tp_as_mapping */
+    0,                                  /* tp_hash  */
+    0,                                  /* tp_call */
+    0,                                  /* tp_str */
+    0,                                  /* tp_getattro */
+    0,                                  /* tp_setattro */
+    0,                                  /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                 /* tp_flags */
+    "Matching point counts of a SuperCluster for one mask, created by SuperCluster.filter()",  /* tp_doc */
+    0,                                  /* tp_traverse */
+    0,                                  /* tp_clear */
+    0,                                  /* tp_richcompare */
+    0,                                  /* tp_weaklistoffset */
+    0,                                  /* tp_iter */
+    0,                                  /* tp_iternext */
+    0,                                  /* tp_methods */
+    0,                                  /* tp_members */
+    Filter_getset,                      /* tp_getset */
+};
+
+
+/*
+    Resolves the optional filter argument of a query: None, or a Filter
+    created by this index.
+*/
+static bool
+parseFilter(SuperClusterObject *self, PyObject *arg, const ClusterFilter **filter)
+{
+    *filter = NULL;
+    if (arg == NULL || arg == Py_None)
+        return true;
+    if (!PyObject_TypeCheck(arg, &FilterType)) {
+        PyErr_SetString(PyExc_TypeError, "filter must be a Filter returned by SuperCluster.filter().");
+        return false;
+    }
+    if (((FilterObject *)arg)->index != self) {
+        PyErr_SetString(PyExc_ValueError, "filter was created by another index.");
+        return false;
+    }
+    *filter = ((FilterObject *)arg)->filter;
+    return true;
+}
+
+
+/*
+    Number of attribute columns in query results: filtered results have
+    none, since aggregates cover every point of a cluster.
+*/
+static size_t
+resultAttributes(SuperClusterObject *self, const ClusterFilter *filter)
+{
+    return filter == NULL ? self->sc->attributeCount() : 0;
+}
+
+
 static int
 SuperCluster_init(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
 {
-    const char *kwlist[] = {"points", "min_zoom", "max_zoom", "radius", "extent", NULL};
+    const char *kwlist[] = {"points", "min_zoom", "max_zoom", "radius", "extent", "threads", "node_size",
+                            "attributes", "longitudes", "latitudes", "weights", NULL};
 
-    PyArrayObject *points;
+    PyObject *pointsArg = Py_None;
     int min_zoom = 0;
     int max_zoom = 16;
     double radius = 40;
     double extent = 512;
+    int threads = 1;
+    int node_size = kdbush::KDBush<Point>::defaultNodeSize;
+    PyObject *attributesArg = Py_None;
+    PyObject *longitudesArg = Py_None;
+    PyObject *latitudesArg = Py_None;
+    PyObject *weightsArg = Py_None;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!|iidd", const_cast<char **>(kwlist), &PyArray_Type, &points,
-                                     &min_zoom, &max_zoom, &radius, &extent))
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OiiddiiOOOO", const_cast<char **>(kwlist), &pointsArg,
+                                     &min_zoom, &max_zoom, &radius, &extent, &threads, &node_size,
+                                     &attributesArg, &longitudesArg, &latitudesArg, &weightsArg))
         return -1;
 
-    if (PyArray_DESCR(points)->type_num != NPY_DOUBLE || PyArray_NDIM(points) != 2 || PyArray_DIMS(points)[1] != 2 || PyArray_DIMS(points)[0] == 0){
-        PyErr_SetString(PyExc_ValueError, "Array must be of type double and 2 dimensional and must have a length >= 1.");
+    if (node_size < 1) {
+        PyErr_SetString(PyExc_ValueError, "node_size must be >= 1.");
         return -1;
     }
 
-    npy_intp count = PyArray_DIMS(points)[0];
-    std::vector<Point> items(count);
-    for (npy_intp i = 0; i < count; ++i) {
-        items[i] = std::make_pair(
-            lngX(*(double*)PyArray_GETPTR2(points, i, 0)),
-            latY(*(double*)PyArray_GETPTR2(points, i, 1)));
+    if (threads < 0) {
+        PyErr_SetString(PyExc_ValueError, "threads must be >= 0.");
+        return -1;
+    }
+    if (threads == 0)
+        threads = std::max(1u, std::thread::hardware_concurrency());
+
+    if (max_zoom > SuperCluster::maxSupportedZoom) {
+        PyErr_SetString(PyExc_ValueError, "max_zoom must be <= 30.");
+        return -1;
+    }
+    if (min_zoom < 0 || min_zoom > max_zoom) {
+        PyErr_SetString(PyExc_ValueError, "min_zoom must be >= 0 and <= max_zoom.");
+        return -1;
     }
-    self->sc = new SuperCluster(items, min_zoom, max_zoom, radius, extent);
+
+    Coordinates coordinates;
+    if (!parseCoordinates(pointsArg, longitudesArg, latitudesArg, coordinates))
+        return -1;
+
+    npy_intp count = coordinates.count;
+
+    // Per-point attributes: an (N, K) array, or (N,) for a single attribute
+    PyArrayObject *attributes = NULL;
+    size_t numAttributes = 0;
+    if (attributesArg != Py_None) {
+        attributes = (PyArrayObject*)PyArray_FROMANY(attributesArg, NPY_DOUBLE, 1, 2, NPY_ARRAY_IN_ARRAY);
+        if (attributes == NULL)
+            return -1;
+        numAttributes = PyArray_NDIM(attributes) == 2 ? PyArray_DIMS(attributes)[1] : 1;
+        if (PyArray_DIMS(attributes)[0] != count || numAttributes > SuperCluster::maxAttributes) {
+            Py_DECREF(attributes);
+            PyErr_SetString(PyExc_ValueError, "attributes must have one row per point and at most 256 columns.");
+            return -1;
+        }
+    }
+
+    // Per-point weights: the number of points each one stands for
+    std::vector<std::uint32_t> weights;
+    if (weightsArg != Py_None) {
+        PyArrayObject *weightArray = (PyArrayObject*)PyArray_FROMANY(weightsArg, NPY_INT64, 1, 1, NPY_ARRAY_IN_ARRAY);
+        if (weightArray == NULL) {
+            Py_XDECREF(attributes);
+            return -1;
+        }
+        const std::int64_t *values = (const std::int64_t*)PyArray_DATA(weightArray);
+        std::int64_t total = 0;
+        bool valid = PyArray_DIMS(weightArray)[0] == count;
+        for (npy_intp i = 0; valid && i < count; ++i) {
+            valid = values[i] >= 1 && values[i] <= UINT32_MAX;
+            total += valid ? values[i] : 0;
+        }
+        if (valid && total <= UINT32_MAX)
+            weights.assign(values, values + count);
+        Py_DECREF(weightArray);
+        if (!valid || total > UINT32_MAX) {
+            Py_XDECREF(attributes);
+            PyErr_SetString(PyExc_ValueError,
+                            "weights must have one integer >= 1 per point and add up to less than 2**32.");
+            return -1;
+        }
+    }
+
+    SuperCluster *sc = NULL;
+    bool noMemory = false;
+    bool noThreads = false;
+    bool tooLarge = false;
+
+    // Projection and clustering only touch C++ data: let other threads run.
+    // The coordinate arrays stay alive because `coordinates` holds them.
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        std::vector<Point> items(count);
+        project(coordinates, threads, items);
+        std::vector<double> values;
+        if (attributes != NULL) {
+            const double *data = (const double*)PyArray_DATA(attributes);
+            values.assign(data, data + count * numAttributes);
+        }
+        sc = new SuperCluster(items, min_zoom, max_zoom, radius, extent, threads, node_size, values, numAttributes,
+                              weights);
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    } catch (const std::system_error &) {
+        noThreads = true;
+    } catch (const std::length_error &) {
+        tooLarge = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_XDECREF(attributes);
+    if (noMemory) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    if (tooLarge) {
+        PyErr_SetString(PyExc_ValueError, "Too many points.");
+        return -1;
+    }
+    if (noThreads) {
+        PyErr_SetString(PyExc_RuntimeError, "Could not start clustering threads.");
+        return -1;
+    }
+
+    delete self->sc;
+    self->sc = sc;
 
     return 0;
 }
@@ -99,72 +475,783 @@ SuperCluster_dealloc(SuperClusterObject *self)
 }
 
 
-static PyObject *
-SuperCluster_getClusters(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+static bool
+SuperCluster_query(SuperClusterObject *self, PyObject *args, PyObject *kwargs, std::vector<Cluster> &clusters,
+                   size_t &numAttributes)
 {
-    const char *kwlist[] = {"top_left", "bottom_right", "zoom", NULL};
+    const char *kwlist[] = {"top_left", "bottom_right", "zoom", "filter", NULL};
     double minLng, minLat, maxLng, maxLat;
     int zoom;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "(dd)(dd)i|O", const_cast<char **>(kwlist), &minLng, &minLat, &maxLng, &maxLat, &zoom, &filterArg))
+        return false;
+
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return false;
+    }
+    if (!parseFilter(self, filterArg, &filter))
+        return false;
+
+    // The range search is read-only, so concurrent queries can overlap.
+    bool noMemory = false;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        clusters = self->sc->getClusters(
+            std::make_pair(lngX(minLng), latY(minLat)),
+            std::make_pair(lngX(maxLng), latY(maxLat)),
+            zoom, filter);
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (noMemory) {
+        PyErr_NoMemory();
+        return false;
+    }
+
+    numAttributes = resultAttributes(self, filter);
+    return true;
+}
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "(dd)(dd)i", const_cast<char **>(kwlist), &minLng, &minLat, &maxLng, &maxLat, &zoom))
+
+/*
+    Builds a list of the aggregate values of one kind (0 = sum, 1 = min,
+    2 = max) of a cluster.
+*/
+static PyObject *
+aggregatesToList(const Cluster &cluster, size_t numAttributes, size_t kind)
+{
+    PyObject *list = PyList_New(numAttributes);
+    if (list == NULL)
         return NULL;
+    for (size_t a = 0; a < numAttributes; ++a) {
+        PyObject *value = PyFloat_FromDouble(cluster.aggregates[kind * numAttributes + a]);
+        if (value == NULL) {
+            Py_DECREF(list);
+            return NULL;
+        }
+        PyList_SET_ITEM(list, a, value);
+    }
+    return list;
+}
 
-    std::vector<Cluster*> clusters = self->sc->getClusters(
-        std::make_pair(lngX(minLng), latY(minLat)),
-        std::make_pair(lngX(maxLng), latY(maxLat)),
-        zoom);
 
-    PyObject *countKey = PyUnicode_FromString("count");
-    PyObject *expansionZoomKey = PyUnicode_FromString("expansion_zoom");
-    PyObject *idKey = PyUnicode_FromString("id");
-    PyObject *latitudeKey = PyUnicode_FromString("latitude");
-    PyObject *longitudeKey = PyUnicode_FromString("longitude");
+/*
+    Builds a list with one dict (count, expansion_zoom, id, latitude,
+    longitude) per cluster. Points have an expansion_zoom of None. With
+    attributes, each dict also has sum, min and max lists.
+*/
+static PyObject *
+clustersToList(const std::vector<Cluster> &clusters, size_t numAttributes)
+{
+    static const char *aggregateNames[] = {"sum", "min", "max"};
 
-    PyObject *o = NULL;
     PyObject *list = PyList_New(clusters.size());
+    if (list == NULL)
+        return NULL;
+
     for (size_t i = 0; i < clusters.size(); ++i) {
+        const Cluster &cluster = clusters[i];
         PyObject *dict = PyDict_New();
-        Cluster *cluster = clusters[i];
+        if (dict == NULL) {
+            Py_DECREF(list);
+            return NULL;
+        }
+        // The list owns the dict from here, so a failure below frees both.
+        PyList_SET_ITEM(list, i, dict);
 
-        o = PyLong_FromSize_t(cluster->numPoints);
-        PyDict_SetItem(dict, countKey, o);
-        Py_DECREF(o);
+        PyObject *expansionZoom = Py_None;
+        if (cluster.expansionZoom >= 0)
+            expansionZoom = PyLong_FromSize_t(cluster.expansionZoom);
+        else
+            Py_INCREF(Py_None);
+        const struct {
+            const char *key;
+            PyObject *value;
+        } items[] = {
+            {"count", PyLong_FromSize_t(cluster.numPoints)},
+            {"expansion_zoom", expansionZoom},
+            {"id", PyLong_FromSize_t(cluster.id)},
+            {"latitude", PyFloat_FromDouble(yLat(cluster.point.second))},
+            {"longitude", PyFloat_FromDouble(xLng(cluster.point.first))},
+        };
+        bool failed = false;
+        for (const auto &item : items) {
+            if (!failed && (item.value == NULL || PyDict_SetItemString(dict, item.key, item.value) < 0))
+                failed = true;
+            Py_XDECREF(item.value);
+        }
 
-        if (cluster->expansionZoom >= 0) {
-            o = PyLong_FromSize_t(cluster->expansionZoom);
-            PyDict_SetItem(dict, expansionZoomKey, o);
-            Py_DECREF(o);
-        } else {
-            PyDict_SetItem(dict, expansionZoomKey, Py_None);
+        for (size_t kind = 0; kind < 3 && numAttributes > 0 && !failed; ++kind) {
+            PyObject *o = aggregatesToList(cluster, numAttributes, kind);
+            if (o == NULL || PyDict_SetItemString(dict, aggregateNames[kind], o) < 0)
+                failed = true;
+            Py_XDECREF(o);
         }
 
-        o = PyLong_FromSize_t(cluster->id);
-        PyDict_SetItem(dict, idKey, o);
-        Py_DECREF(o);
+        if (failed) {
+            Py_DECREF(list);
+            return NULL;
+        }
+    }
 
-        o = PyFloat_FromDouble(yLat(cluster->point.second));
-        PyDict_SetItem(dict, latitudeKey, o);
-        Py_DECREF(o);
+    return list;
+}
 
-        o = PyFloat_FromDouble(xLng(cluster->point.first));
-        PyDict_SetItem(dict, longitudeKey, o);
-        Py_DECREF(o);
 
-        PyList_SET_ITEM(list, i, dict);
+static PyObject *
+SuperCluster_getClusters(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    std::vector<Cluster> clusters;
+    size_t numAttributes;
+    if (!SuperCluster_query(self, args, kwargs, clusters, numAttributes))
+        return NULL;
+
+    return clustersToList(clusters, numAttributes);
+}
+
+
+/*
+    Builds a dict of parallel 1-D arrays (longitude, latitude, count, id,
+    expansion_zoom) filled directly from the clusters, without creating a
+    Python object per cluster. Points have an expansion_zoom of -1. With
+    attributes, the dict also has (N, K) sum, min and max arrays.
+*/
+static PyObject *
+clustersToArrays(const std::vector<Cluster> &clusters, size_t numAttributes)
+{
+    npy_intp size = clusters.size();
+    PyObject *longitude = PyArray_SimpleNew(1, &size, NPY_DOUBLE);
+    PyObject *latitude = PyArray_SimpleNew(1, &size, NPY_DOUBLE);
+    PyObject *count = PyArray_SimpleNew(1, &size, NPY_INT64);
+    PyObject *id = PyArray_SimpleNew(1, &size, NPY_INT64);
+    PyObject *expansionZoom = PyArray_SimpleNew(1, &size, NPY_INT32);
+    PyObject *dict = PyDict_New();
+
+    if (longitude == NULL || latitude == NULL || count == NULL || id == NULL || expansionZoom == NULL || dict == NULL) {
+        Py_XDECREF(longitude);
+        Py_XDECREF(latitude);
+        Py_XDECREF(count);
+        Py_XDECREF(id);
+        Py_XDECREF(expansionZoom);
+        Py_XDECREF(dict);
+        return NULL;
     }
 
-    Py_DECREF(countKey);
-    Py_DECREF(expansionZoomKey);
-    Py_DECREF(idKey);
-    Py_DECREF(latitudeKey);
-    Py_DECREF(longitudeKey);
+    double *lngData = (double*)PyArray_DATA((PyArrayObject*)longitude);
+    double *latData = (double*)PyArray_DATA((PyArrayObject*)latitude);
+    npy_int64 *countData = (npy_int64*)PyArray_DATA((PyArrayObject*)count);
+    npy_int64 *idData = (npy_int64*)PyArray_DATA((PyArrayObject*)id);
+    npy_int32 *zoomData = (npy_int32*)PyArray_DATA((PyArrayObject*)expansionZoom);
 
-    return list;
+    Py_BEGIN_ALLOW_THREADS
+    for (npy_intp i = 0; i < size; ++i) {
+        const Cluster &cluster = clusters[i];
+        lngData[i] = xLng(cluster.point.first);
+        latData[i] = yLat(cluster.point.second);
+        countData[i] = cluster.numPoints;
+        idData[i] = cluster.id;
+        zoomData[i] = cluster.expansionZoom;
+    }
+    Py_END_ALLOW_THREADS
+
+    PyDict_SetItemString(dict, "longitude", longitude);
+    PyDict_SetItemString(dict, "latitude", latitude);
+    PyDict_SetItemString(dict, "count", count);
+    PyDict_SetItemString(dict, "id", id);
+    PyDict_SetItemString(dict, "expansion_zoom", expansionZoom);
+    Py_DECREF(longitude);
+    Py_DECREF(latitude);
+    Py_DECREF(count);
+    Py_DECREF(id);
+    Py_DECREF(expansionZoom);
+
+    if (numAttributes > 0) {
+        static const char *aggregateNames[] = {"sum", "min", "max"};
+        npy_intp dims[2] = {size, (npy_intp)numAttributes};
+        for (size_t kind = 0; kind < 3; ++kind) {
+            PyObject *values = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+            if (values == NULL) {
+                Py_DECREF(dict);
+                return NULL;
+            }
+            double *data = (double*)PyArray_DATA((PyArrayObject*)values);
+            for (npy_intp i = 0; i < size; ++i)
+                std::copy_n(clusters[i].aggregates + kind * numAttributes, numAttributes, data + i * numAttributes);
+            PyDict_SetItemString(dict, aggregateNames[kind], values);
+            Py_DECREF(values);
+        }
+    }
+
+    return dict;
+}
+
+
+static PyObject *
+SuperCluster_getClustersArrays(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    std::vector<Cluster> clusters;
+    size_t numAttributes;
+    if (!SuperCluster_query(self, args, kwargs, clusters, numAttributes))
+        return NULL;
+
+    return clustersToArrays(clusters, numAttributes);
+}
+
+
+static PyObject *
+SuperCluster_getClustersBatch(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"queries", "threads", "filter", NULL};
+    PyObject *queriesArg;
+    int threads = 1;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|iO", const_cast<char **>(kwlist), &queriesArg, &threads, &filterArg))
+        return NULL;
+
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return NULL;
+    }
+    if (!parseFilter(self, filterArg, &filter))
+        return NULL;
+
+    PyArrayObject *queries = (PyArrayObject*)PyArray_FROMANY(queriesArg, NPY_DOUBLE, 2, 2, NPY_ARRAY_IN_ARRAY);
+    if (queries == NULL)
+        return NULL;
+    if (PyArray_DIMS(queries)[1] != 5) {
+        Py_DECREF(queries);
+        PyErr_SetString(PyExc_ValueError, "queries must be an (N, 5) array of [west, south, east, north, zoom].");
+        return NULL;
+    }
+    if (threads < 0) {
+        Py_DECREF(queries);
+        PyErr_SetString(PyExc_ValueError, "threads must be >= 0.");
+        return NULL;
+    }
+    if (threads == 0)
+        threads = std::max(1u, std::thread::hardware_concurrency());
+
+    const npy_intp count = PyArray_DIMS(queries)[0];
+    const double *q = (const double*)PyArray_DATA(queries);
+    for (npy_intp i = 0; i < count; ++i) {
+        const double zoom = q[5 * i + 4];
+        if (!(zoom >= INT_MIN && zoom <= INT_MAX)) {
+            Py_DECREF(queries);
+            PyErr_SetString(PyExc_ValueError, "queries must have finite zooms within the int range.");
+            return NULL;
+        }
+    }
+    const SuperCluster *sc = self->sc;
+    std::vector<std::vector<Cluster>> results(count);
+    std::vector<Cluster> clusters;
+    bool noMemory = false;
+    bool noThreads = false;
+
+    Py_BEGIN_ALLOW_THREADS
+    // Exceptions must not escape a thread: each worker keeps its own and
+    // they are rethrown once every started worker is joined.
+    std::vector<std::exception_ptr> errors(std::max(1, std::min<int>(threads, count)));
+    auto run = [&results, &errors, q, sc, count, threads, filter](int t) {
+        try {
+            for (npy_intp i = t; i < count; i += threads) {
+                const double *row = q + 5 * i;
+                results[i] = sc->getClusters(
+                    std::make_pair(lngX(row[0]), latY(row[3])),
+                    std::make_pair(lngX(row[2]), latY(row[1])),
+                    (int)row[4], filter);
+            }
+        } catch (...) {
+            errors[t] = std::current_exception();
+        }
+    };
+
+    try {
+        std::vector<std::thread> workers;
+        workers.reserve(errors.size() - 1);
+        try {
+            for (size_t t = 1; t < errors.size(); ++t)
+                workers.emplace_back(run, t);
+        } catch (...) {
+            for (size_t t = 0; t < workers.size(); ++t)
+                workers[t].join();
+            throw;
+        }
+        run(0);
+        for (size_t t = 0; t < workers.size(); ++t)
+            workers[t].join();
+        for (size_t t = 0; t < errors.size(); ++t)
+            if (errors[t])
+                std::rethrow_exception(errors[t]);
+
+        size_t total = 0;
+        for (npy_intp i = 0; i < count; ++i)
+            total += results[i].size();
+        clusters.reserve(total);
+        for (npy_intp i = 0; i < count; ++i)
+            clusters.insert(clusters.end(), results[i].begin(), results[i].end());
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    } catch (const std::system_error &) {
+        noThreads = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(queries);
+    if (noMemory)
+        return PyErr_NoMemory();
+    if (noThreads) {
+        PyErr_SetString(PyExc_RuntimeError, "Could not start query threads.");
+        return NULL;
+    }
+
+    PyObject *dict = clustersToArrays(clusters, resultAttributes(self, filter));
+    if (dict == NULL)
+        return NULL;
+
+    npy_intp offsetsSize = count + 1;
+    PyObject *offsets = PyArray_SimpleNew(1, &offsetsSize, NPY_INT64);
+    if (offsets == NULL) {
+        Py_DECREF(dict);
+        return NULL;
+    }
+    npy_int64 *offsetsData = (npy_int64*)PyArray_DATA((PyArrayObject*)offsets);
+    offsetsData[0] = 0;
+    for (npy_intp i = 0; i < count; ++i)
+        offsetsData[i + 1] = offsetsData[i] + results[i].size();
+
+    PyDict_SetItemString(dict, "offsets", offsets);
+    Py_DECREF(offsets);
+
+    return dict;
+}
+
+
+static PyObject *
+SuperCluster_getTile(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"z", "x", "y", "filter", NULL};
+    int z, x, y;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "iii|O", const_cast<char **>(kwlist), &z, &x, &y, &filterArg))
+        return NULL;
+
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return NULL;
+    }
+    if (!parseFilter(self, filterArg, &filter))
+        return NULL;
+
+    if (z < 0 || z > 30 || x < 0 || y < 0 || x >= (1 << z) || y >= (1 << z)) {
+        PyErr_SetString(PyExc_ValueError, "Invalid tile coordinates.");
+        return NULL;
+    }
+
+    std::vector<TileFeature> features;
+    std::vector<Cluster> clusters;
+    bool noMemory = false;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        features = self->sc->getTile(z, x, y, filter);
+        clusters.reserve(features.size());
+        for (size_t i = 0; i < features.size(); ++i)
+            clusters.push_back(features[i].cluster);
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (noMemory)
+        return PyErr_NoMemory();
+
+    PyObject *dict = clustersToArrays(clusters, resultAttributes(self, filter));
+    if (dict == NULL)
+        return NULL;
+
+    npy_intp size = features.size();
+    PyObject *tileX = PyArray_SimpleNew(1, &size, NPY_INT32);
+    PyObject *tileY = PyArray_SimpleNew(1, &size, NPY_INT32);
+    if (tileX == NULL || tileY == NULL) {
+        Py_XDECREF(tileX);
+        Py_XDECREF(tileY);
+        Py_DECREF(dict);
+        return NULL;
+    }
+
+    npy_int32 *xData = (npy_int32*)PyArray_DATA((PyArrayObject*)tileX);
+    npy_int32 *yData = (npy_int32*)PyArray_DATA((PyArrayObject*)tileY);
+    for (npy_intp i = 0; i < size; ++i) {
+        xData[i] = features[i].x;
+        yData[i] = features[i].y;
+    }
+
+    PyDict_SetItemString(dict, "x", tileX);
+    PyDict_SetItemString(dict, "y", tileY);
+    Py_DECREF(tileX);
+    Py_DECREF(tileY);
+
+    return dict;
+}
+
+
+/*
+    Reads a cluster id: any integer, including NumPy integers such as the ids
+    of getClustersArrays. Negative ids and ids beyond 64 bits match no
+    cluster.
+*/
+static bool
+parseClusterId(PyObject *arg, unsigned long long *clusterId)
+{
+    PyObject *index = PyNumber_Index(arg);
+    if (index == NULL)
+        return false;
+    *clusterId = PyLong_AsUnsignedLongLong(index);
+    Py_DECREF(index);
+    if (*clusterId == (unsigned long long)-1 && PyErr_Occurred()) {
+        if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+            return false;
+        PyErr_SetString(PyExc_ValueError, "No cluster with the specified id.");
+        return false;
+    }
+    return true;
+}
+
+
+/*
+    Runs a drill-down call on a cluster id with the GIL released and maps an
+    unknown id to ValueError and allocation failures to MemoryError.
+*/
+template <typename Result, typename Call>
+static bool
+SuperCluster_drillDown(SuperClusterObject *self, Call call, Result &result)
+{
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return false;
+    }
+
+    bool notFound = false;
+    bool noMemory = false;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        result = call(self->sc);
+    } catch (const std::invalid_argument &) {
+        notFound = true;
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (noMemory) {
+        PyErr_NoMemory();
+        return false;
+    }
+    if (notFound) {
+        PyErr_SetString(PyExc_ValueError, "No cluster with the specified id.");
+        return false;
+    }
+    return true;
+}
+
+
+static PyObject *
+SuperCluster_getChildren(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"cluster_id", "filter", NULL};
+    PyObject *clusterIdArg;
+    unsigned long long clusterId;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|O", const_cast<char **>(kwlist), &clusterIdArg, &filterArg))
+        return NULL;
+    if (!parseClusterId(clusterIdArg, &clusterId) || !parseFilter(self, filterArg, &filter))
+        return NULL;
+
+    std::vector<Cluster> children;
+    if (!SuperCluster_drillDown(self, [clusterId, filter](const SuperCluster *sc) {
+            return sc->getChildren(clusterId, filter);
+        }, children))
+        return NULL;
+
+    return clustersToList(children, resultAttributes(self, filter));
+}
+
+
+static PyObject *
+SuperCluster_getLeaves(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"cluster_id", "limit", "offset", "filter", NULL};
+    PyObject *clusterIdArg;
+    unsigned long long clusterId;
+    Py_ssize_t limit = 10;
+    Py_ssize_t offset = 0;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|nnO", const_cast<char **>(kwlist), &clusterIdArg, &limit, &offset, &filterArg))
+        return NULL;
+    if (!parseClusterId(clusterIdArg, &clusterId) || !parseFilter(self, filterArg, &filter))
+        return NULL;
+
+    if (limit < 0 || offset < 0) {
+        PyErr_SetString(PyExc_ValueError, "limit and offset must be >= 0.");
+        return NULL;
+    }
+
+    std::vector<Cluster> leaves;
+    if (!SuperCluster_drillDown(self, [clusterId, limit, offset, filter](const SuperCluster *sc) {
+            return sc->getLeaves(clusterId, limit, offset, filter);
+        }, leaves))
+        return NULL;
+
+    return clustersToList(leaves, resultAttributes(self, filter));
+}
+
+
+static PyObject *
+SuperCluster_getClusterExpansionZoom(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"cluster_id", "filter", NULL};
+    PyObject *clusterIdArg;
+    unsigned long long clusterId;
+    PyObject *filterArg = NULL;
+    const ClusterFilter *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|O", const_cast<char **>(kwlist), &clusterIdArg, &filterArg))
+        return NULL;
+    if (!parseClusterId(clusterIdArg, &clusterId) || !parseFilter(self, filterArg, &filter))
+        return NULL;
+
+    int expansionZoom;
+    if (!SuperCluster_drillDown(self, [clusterId, filter](const SuperCluster *sc) {
+            return sc->getClusterExpansionZoom(clusterId, filter);
+        }, expansionZoom))
+        return NULL;
+
+    return PyLong_FromLong(expansionZoom);
+}
+
+
+static PyObject *
+SuperCluster_filter(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    const char *kwlist[] = {"mask", NULL};
+    PyObject *maskArg;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O", const_cast<char **>(kwlist), &maskArg))
+        return NULL;
+
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return NULL;
+    }
+
+    // A boolean mask matches whole (weighted) points; integer counts match
+    // part of the weight of each point
+    PyArrayObject *input = (PyArrayObject*)PyArray_FromAny(maskArg, NULL, 1, 1, 0, NULL);
+    if (input == NULL)
+        return NULL;
+    const bool counted = PyArray_ISINTEGER(input);
+    Py_DECREF(input);
+
+    PyArrayObject *mask = (PyArrayObject*)PyArray_FROMANY(maskArg, counted ? NPY_INT64 : NPY_BOOL, 1, 1,
+                                                          NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (mask == NULL)
+        return NULL;
+    const npy_intp size = PyArray_DIMS(mask)[0];
+    if ((size_t)size != self->sc->pointCount()) {
+        Py_DECREF(mask);
+        PyErr_SetString(PyExc_ValueError, "mask must have one entry per point.");
+        return NULL;
+    }
+
+    std::vector<std::uint32_t> counts;
+    if (counted) {
+        const std::int64_t *values = (const std::int64_t*)PyArray_DATA(mask);
+        counts.resize(size);
+        for (npy_intp i = 0; i < size; ++i) {
+            if (values[i] < 0 || values[i] > UINT32_MAX) {
+                Py_DECREF(mask);
+                PyErr_SetString(PyExc_ValueError, "Counts must not exceed the weight of their point.");
+                return NULL;
+            }
+            counts[i] = static_cast<std::uint32_t>(values[i]);
+        }
+    }
+
+    ClusterFilter *filter = NULL;
+    bool noMemory = false;
+    std::string invalid;
+
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        if (counted)
+            filter = self->sc->filter(counts.data());
+        else
+            filter = self->sc->filter((const std::uint8_t*)PyArray_DATA(mask));
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    } catch (const std::runtime_error &e) {
+        invalid = e.what();
+    } catch (const std::invalid_argument &e) {
+        invalid = e.what();
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(mask);
+    if (noMemory)
+        return PyErr_NoMemory();
+    if (filter == NULL) {
+        PyErr_SetString(PyExc_ValueError, invalid.c_str());
+        return NULL;
+    }
+
+    FilterObject *result = PyObject_New(FilterObject, &FilterType);
+    if (result == NULL) {
+        delete filter;
+        return NULL;
+    }
+    Py_INCREF(self);
+    result->index = self;
+    result->filter = filter;
+
+    return (PyObject *)result;
+}
+
+
+/*
+    Parses a single path argument (str, bytes or os.PathLike).
+*/
+static bool
+parsePath(PyObject *args, PyObject *kwargs, std::string &path)
+{
+    const char *kwlist[] = {"path", NULL};
+    PyObject *bytes = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&", const_cast<char **>(kwlist), PyUnicode_FSConverter, &bytes))
+        return false;
+
+    path.assign(PyBytes_AS_STRING(bytes), PyBytes_GET_SIZE(bytes));
+    Py_DECREF(bytes);
+    return true;
+}
+
+
+static PyObject *
+SuperCluster_save(SuperClusterObject *self, PyObject *args, PyObject *kwargs)
+{
+    std::string path;
+    if (!parsePath(args, kwargs, path))
+        return NULL;
+
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return NULL;
+    }
+
+    int error = 0;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        self->sc->save(path);
+    } catch (const std::system_error &e) {
+        error = e.code().value();
+    }
+    Py_END_ALLOW_THREADS
+
+    if (error) {
+        errno = error;
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path.c_str());
+    }
+
+    Py_RETURN_NONE;
+}
+
+
+static PyObject *
+SuperCluster_load(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    std::string path;
+    if (!parsePath(args, kwargs, path))
+        return NULL;
+
+    SuperCluster *sc = NULL;
+    int error = 0;
+    bool noMemory = false;
+    std::string invalid;
+
+    // Mapping and validating the file does not touch Python objects.
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        sc = SuperCluster::load(path);
+    } catch (const std::system_error &e) {
+        error = e.code().value();
+    } catch (const std::bad_alloc &) {
+        noMemory = true;
+    } catch (const std::runtime_error &e) {
+        invalid = e.what();
+    }
+    Py_END_ALLOW_THREADS
+
+    if (error) {
+        errno = error;
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path.c_str());
+    }
+    if (noMemory)
+        return PyErr_NoMemory();
+    if (sc == NULL) {
+        PyErr_SetString(PyExc_ValueError, invalid.c_str());
+        return NULL;
+    }
+
+    SuperClusterObject *self = (SuperClusterObject *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        delete sc;
+        return NULL;
+    }
+    self->sc = sc;
+
+    return (PyObject *)self;
 }
 
 
 static PyMethodDef SuperCluster_methods[] = {
     {"getClusters", (PyCFunction)SuperCluster_getClusters, METH_VARARGS | METH_KEYWORDS, "Returns the clusters within the given bounding box at the given zoom level."},
+    {"getClustersArrays", (PyCFunction)SuperCluster_getClustersArrays, METH_VARARGS | METH_KEYWORDS, "Returns the clusters within the given bounding box at the given zoom level as a dict of NumPy arrays."},
+    {"getTile", (PyCFunction)SuperCluster_getTile, METH_VARARGS | METH_KEYWORDS, "Returns the clusters of a z/x/y tile with tile-space coordinates as a dict of NumPy arrays."},
+    {"getChildren", (PyCFunction)SuperCluster_getChildren, METH_VARARGS | METH_KEYWORDS, "Returns the children of a cluster on the next zoom level."},
+    {"getLeaves", (PyCFunction)SuperCluster_getLeaves, METH_VARARGS | METH_KEYWORDS, "Returns the points of a cluster, with pagination."},
+    {"getClusterExpansionZoom", (PyCFunction)SuperCluster_getClusterExpansionZoom, METH_VARARGS | METH_KEYWORDS, "Returns the zoom on which a cluster expands into several children."},
+    {"getClustersBatch", (PyCFunction)SuperCluster_getClustersBatch, METH_VARARGS | METH_KEYWORDS, "Runs many bounding box queries at once and returns the clusters as NumPy arrays in CSR layout."},
+    {"filter", (PyCFunction)SuperCluster_filter, METH_VARARGS | METH_KEYWORDS, "Counts the points of every cluster that pass a boolean mask (or integer counts per weighted point), for the filter= argument of queries."},
+    {"save", (PyCFunction)SuperCluster_save, METH_VARARGS | METH_KEYWORDS, "Writes the index to a file that load() can map."},
+    {"load", (PyCFunction)SuperCluster_load, METH_VARARGS | METH_KEYWORDS | METH_CLASS, "Maps an index file written by save() and returns the index."},
+    {NULL}
+};
+
+
+static PyObject *
+SuperCluster_getNumAttributes(SuperClusterObject *self, void *closure)
+{
+    if (self->sc == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "SuperCluster is not initialized.");
+        return NULL;
+    }
+    return PyLong_FromSize_t(self->sc->attributeCount());
+}
+
+
+static PyGetSetDef SuperCluster_getset[] = {
+    {"num_attributes", (getter)SuperCluster_getNumAttributes, NULL, "Number of attribute columns aggregated per cluster.", NULL},
     {NULL}
 };
 
@@ -199,7 +1286,7 @@ static PyTypeObject SuperClusterType = {
     0,                                  /* tp_iternext */
     SuperCluster_methods,               /* tp_methods */
     0,                                  /* tp_members */
-    0,                                  /* tp_getset */
+    SuperCluster_getset,                /* tp_getset */
     0,                                  /* tp_base */
     0,                                  /* tp_dict */
     0,                                  /* tp_descr_get */
@@ -241,5 +1328,11 @@ PyInit_pysupercluster(void)
     Py_INCREF(&SuperClusterType);
     PyModule_AddObject(m, "SuperCluster", (PyObject *)&SuperClusterType);
 
+    if (PyType_Ready(&FilterType) < 0)
+        return NULL;
+
+    Py_INCREF(&FilterType);
+    PyModule_AddObject(m, "Filter", (PyObject *)&FilterType);
+
     return m;
 }
@@ -15,59 +15,178 @@
 */
 
 #include <algorithm>
+#include <cerrno>
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <exception>
+#include <limits>
+#include <numeric>
+#include <stdexcept>
+#include <system_error>
+#include <thread>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
 
 #include "supercluster.hpp"
 
 
-Cluster::Cluster(const Point &_point, size_t _numPoints, size_t _id, int _expansionZoom)
-    : point(_point)
-    , numPoints(_numPoints)
-    , id(_id)
-    , zoom(999)
-    , expansionZoom(_expansionZoom)
+// Points are clustered in blocks; with threads > 1 the neighbor searches of
+// a block run in parallel before the block is merged serially.
+static const size_t kBlockSize = 16384;
+
+// Neighbor lists longer than this are not cached (dense duplicates); the
+// serial merge pass searches again for those points instead.
+static const size_t kMaxCachedNeighbors = 1024;
+
+static const size_t kOverflow = std::numeric_limits<size_t>::max();
+
+const std::uint32_t ClusterTree::noParent;
+const std::uint32_t ClusterFilter::noLeaf;
+
+
+struct SuperCluster::NeighborBlock {
+    size_t chunkSize;
+    std::vector<std::vector<std::uint32_t>> ids;  // per thread, concatenated neighbor lists
+    std::vector<size_t> offset;                   // per point, start of its list in its thread's ids
+    std::vector<size_t> count;                    // per point, list length or kOverflow
+};
+
+
+ClusterTree::ClusterTree(const std::vector<Point> &points, const std::vector<std::uint32_t> &_count,
+                         const std::vector<std::uint32_t> &_id, const std::vector<double> &_aggregates,
+                         size_t _stride, std::uint32_t nodeSize, unsigned threads)
+    : kdbush(points, nodeSize, threads)
+    , stride(_stride)
 {
+    // Store the columns in kd-tree order so a search result indexes them
+    // directly, and remember where each entry went for the clustering pass.
+    const std::vector<size_t> &ids = kdbush.sortedIds();
+    const size_t n = ids.size();
+    countStorage.resize(n);
+    idStorage.resize(n);
+    aggregateStorage.resize(n * stride);
+    order.resize(n);
+    for (size_t i = 0; i < n; ++i) {
+        countStorage[i] = _count[ids[i]];
+        idStorage[i] = _id[ids[i]];
+        order[ids[i]] = static_cast<std::uint32_t>(i);
+        if (stride)
+            std::copy_n(&_aggregates[ids[i] * stride], stride, &aggregateStorage[i * stride]);
+    }
+    parentStorage.assign(n, noParent);
+    kdbush.releaseIds();
+
+    count = countStorage.data();
+    id = idStorage.data();
+    parent = parentStorage.data();
+    aggregates = aggregateStorage.data();
 }
 
 
-ClusterTree::ClusterTree(const std::vector<Cluster*> &_clusters)
-    : clusters(_clusters)
+ClusterTree::ClusterTree(const double *xs, const double *ys, const std::uint32_t *_count,
+                         const std::uint32_t *_id, const std::uint32_t *_parent, const double *_aggregates,
+                         size_t _stride, size_t size, std::uint32_t nodeSize)
+    : kdbush(xs, ys, size, nodeSize)
+    , count(_count)
+    , id(_id)
+    , parent(_parent)
+    , aggregates(_aggregates)
+    , stride(_stride)
 {
-    std::vector<Point> points;
-    points.reserve(clusters.size());
-    for (size_t i = 0; i < clusters.size(); ++i)
-        points.push_back(clusters[i]->point);
-    kdbush = new kdbush::KDBush<Point>(points);
 }
 
 
-ClusterTree::~ClusterTree()
+/*
+    Adds the aggregates of an absorbed entry to a cluster's: sums add up,
+    minimums and maximums combine (fmin and fmax skip NaN, so a missing
+    value never hides a present one).
+*/
+static void mergeAggregates(double *into, const double *from, size_t numAttributes)
 {
-    delete kdbush;
+    for (size_t a = 0; a < numAttributes; ++a) {
+        into[a] += from[a];
+        into[numAttributes + a] = std::fmin(into[numAttributes + a], from[numAttributes + a]);
+        into[2 * numAttributes + a] = std::fmax(into[2 * numAttributes + a], from[2 * numAttributes + a]);
+    }
 }
 
 
-SuperCluster::SuperCluster(const std::vector<Point> &points, int _minZoom, int _maxZoom, double _radius, double _extent)
+SuperCluster::SuperCluster(const std::vector<Point> &points, int _minZoom, int _maxZoom, double _radius, double _extent,
+                           int _threads, std::uint32_t _nodeSize, const std::vector<double> &attributes,
+                           size_t _numAttributes, const std::vector<std::uint32_t> &weights)
     : minZoom(_minZoom)
     , maxZoom(_maxZoom)
     , radius(_radius)
     , extent(_extent)
+    , threads(std::max(_threads, 1))
+    , nodeSize(_nodeSize)
+    , numInputPoints(points.size())
+    , numAttributes(_numAttributes)
 {
+    if (points.size() > maxPoints || numAttributes > maxAttributes)
+        throw std::length_error("Too many points.");
+    if (attributes.size() != points.size() * numAttributes)
+        throw std::invalid_argument("Attributes must have one row per point.");
+    if (!weights.empty()) {
+        // Every cluster count, up to the sum of all weights, is 32-bit
+        if (weights.size() != points.size())
+            throw std::invalid_argument("Weights must have one value per point.");
+        std::uint64_t total = 0;
+        for (const std::uint32_t weight : weights) {
+            if (weight == 0)
+                throw std::invalid_argument("Weights must be >= 1.");
+            total += weight;
+        }
+        if (total > UINT32_MAX)
+            throw std::length_error("Too many points.");
+    }
+
     trees.resize(maxZoom + 2);
 
     // prepare initial clusters
-    std::vector<Cluster*> clusters;
-    clusters.reserve(points.size());
-    for (size_t i = 0; i < points.size(); ++i)
-        clusters.push_back(new Cluster(points[i], 1, i, -1));
-    all_clusters = clusters;
+    std::vector<Point> level = points;
+    std::vector<std::uint32_t> count = weights;
+    if (count.empty())
+        count.assign(points.size(), 1);
+    std::vector<std::uint32_t> id(points.size());
+    std::iota(id.begin(), id.end(), 0);
+
+    // A point's aggregates are its own values (a missing value adds nothing)
+    const size_t stride = 3 * numAttributes;
+    std::vector<double> aggregates(points.size() * stride);
+    for (size_t i = 0; i < points.size(); ++i) {
+        for (size_t a = 0; a < numAttributes; ++a) {
+            const double value = attributes[i * numAttributes + a];
+            double *row = &aggregates[i * stride];
+            row[a] = std::isnan(value) ? 0.0 : value;
+            row[numAttributes + a] = value;
+            row[2 * numAttributes + a] = value;
+        }
+    }
+
+    std::vector<Point> nextLevel;
+    std::vector<std::uint32_t> nextCount;
+    std::vector<std::uint32_t> nextId;
+    std::vector<double> nextAggregates;
 
     for (int z = maxZoom; z >= minZoom; --z) {
-        trees[z + 1] = new ClusterTree(clusters);
-        clusters = cluster(clusters, z);
+        ClusterTree *tree = new ClusterTree(level, count, id, aggregates, stride, nodeSize, threads);
+        trees[z + 1] = tree;
+        cluster(*tree, z, level, count, nextLevel, nextCount, nextId, nextAggregates);
+        std::vector<std::uint32_t>().swap(tree->order);
+        level.swap(nextLevel);
+        count.swap(nextCount);
+        id.swap(nextId);
+        aggregates.swap(nextAggregates);
     }
 
     // index top-level clusters
-    trees[minZoom] = new ClusterTree(clusters);
+    trees[minZoom] = new ClusterTree(level, count, id, aggregates, stride, nodeSize, threads);
+    std::vector<std::uint32_t>().swap(trees[minZoom]->order);
 }
 
 
@@ -75,61 +194,689 @@ SuperCluster::~SuperCluster()
 {
     for (size_t i = 0; i < trees.size(); ++i)
         delete trees[i];
-    for (size_t i = 0; i < all_clusters.size(); ++i)
-        delete all_clusters[i];
 }
 
 
-std::vector<Cluster*> SuperCluster::cluster(const std::vector<Cluster*> &points, int zoom)
+/*
+    Index file layout, in native byte order: a FileHeader, one LevelHeader
+    per zoom level from minZoom to maxZoom + 1, then the columns of each
+    level (x, y and the aggregate rows as doubles, count, id and parent as
+    uint32), starting at 8-byte aligned offsets.
+*/
+static const char kFileMagic[8] = {'P', 'Y', 'S', 'C', 'I', 'D', 'X', '\0'};
+static const std::uint32_t kByteOrderMark = 0x01020304;
+
+struct FileHeader {
+    char magic[8];
+    std::uint32_t version;
+    std::uint32_t byteOrderMark;
+    std::int32_t minZoom;
+    std::int32_t maxZoom;
+    double radius;
+    double extent;
+    std::uint32_t nodeSize;
+    std::uint32_t numLevels;
+    std::uint64_t numInputPoints;
+    std::uint32_t numAttributes;
+    std::uint32_t reserved;
+};
+
+struct LevelHeader {
+    std::uint64_t size;
+    std::uint64_t offset;
+};
+
+static const size_t kLevelBytesPerEntry = 2 * sizeof(double) + 3 * sizeof(std::uint32_t);
+
+
+static size_t levelBytesPerEntry(size_t numAttributes)
 {
-    std::vector<Cluster*> clusters;
-    double radius = this->radius / (this->extent * (1 << zoom));
-    ClusterTree *tree = trees[zoom + 1];
+    return kLevelBytesPerEntry + 3 * numAttributes * sizeof(double);
+}
 
-    for (size_t i = 0; i < points.size(); ++i) {
-        Cluster *p = points[i];
-        if (p->zoom <= zoom)
-            continue;
-        p->zoom = zoom;
-
-        bool foundNeighbors = false;
-        size_t numPoints = p->numPoints;
-        double wx = p->point.first * numPoints;
-        double wy = p->point.second * numPoints;
-
-        tree->kdbush->within(p->point.first, p->point.second, radius, [&foundNeighbors, &numPoints, tree, &wx, &wy, zoom](const std::vector<Cluster*>::size_type id) {
-            Cluster *b = tree->clusters[id];
-            if (zoom < b->zoom) {
-                foundNeighbors = true;
-                b->zoom = zoom;
-                wx += b->point.first * b->numPoints;
-                wy += b->point.second * b->numPoints;
-                numPoints += b->numPoints;
+
+static size_t alignOffset(size_t offset)
+{
+    return (offset + 7) & ~size_t(7);
+}
+
+
+class SuperCluster::MappedFile {
+public:
+    explicit MappedFile(const std::string &path)
+    {
+        const int fd = ::open(path.c_str(), O_RDONLY | O_CLOEXEC);
+        if (fd < 0)
+            throw std::system_error(errno, std::generic_category(), path);
+
+        struct stat st;
+        if (::fstat(fd, &st) != 0) {
+            const int error = errno;
+            ::close(fd);
+            throw std::system_error(error, std::generic_category(), path);
+        }
+        length = static_cast<size_t>(st.st_size);
+        if (length < sizeof(FileHeader)) {
+            ::close(fd);
+            throw std::runtime_error("Not a SuperCluster index file.");
+        }
+
+        addr = ::mmap(nullptr, length, PROT_READ, MAP_SHARED, fd, 0);
+        const int error = errno;
+        ::close(fd);
+        if (addr == MAP_FAILED)
+            throw std::system_error(error, std::generic_category(), path);
+    }
+
+    ~MappedFile()
+    {
+        ::munmap(addr, length);
+    }
+
+    MappedFile(const MappedFile &) = delete;
+    MappedFile &operator=(const MappedFile &) = delete;
+
+    const char *data() const { return static_cast<const char *>(addr); }
+    size_t size() const { return length; }
+
+private:
+    void *addr;
+    size_t length;
+};
+
+
+SuperCluster::SuperCluster(int _minZoom, int _maxZoom, double _radius, double _extent, std::uint32_t _nodeSize,
+                           size_t _numInputPoints, size_t _numAttributes, std::unique_ptr<MappedFile> _file)
+    : minZoom(_minZoom)
+    , maxZoom(_maxZoom)
+    , radius(_radius)
+    , extent(_extent)
+    , threads(1)
+    , nodeSize(_nodeSize)
+    , numInputPoints(_numInputPoints)
+    , numAttributes(_numAttributes)
+    , file(std::move(_file))
+{
+    trees.resize(maxZoom + 2);
+
+    const size_t stride = 3 * numAttributes;
+    const char *data = file->data();
+    const LevelHeader *levels = reinterpret_cast<const LevelHeader *>(data + sizeof(FileHeader));
+    for (int z = minZoom; z <= maxZoom + 1; ++z) {
+        const LevelHeader &level = levels[z - minZoom];
+        const size_t n = level.size;
+        const char *columns = data + level.offset;
+        const char *counts = columns + (2 + stride) * n * sizeof(double);
+        trees[z] = new ClusterTree(
+            reinterpret_cast<const double *>(columns),
+            reinterpret_cast<const double *>(columns + n * sizeof(double)),
+            reinterpret_cast<const std::uint32_t *>(counts),
+            reinterpret_cast<const std::uint32_t *>(counts + n * sizeof(std::uint32_t)),
+            reinterpret_cast<const std::uint32_t *>(counts + 2 * n * sizeof(std::uint32_t)),
+            reinterpret_cast<const double *>(columns + 2 * n * sizeof(double)),
+            stride, n, nodeSize);
+    }
+}
+
+
+struct FileCloser {
+    void operator()(std::FILE *f) const { std::fclose(f); }
+};
+
+
+static void writeBytes(std::FILE *f, const void *data, size_t size, const std::string &path)
+{
+    if (size > 0 && std::fwrite(data, 1, size, f) != size)
+        throw std::system_error(errno, std::generic_category(), path);
+}
+
+
+void SuperCluster::save(const std::string &path) const
+{
+    std::unique_ptr<std::FILE, FileCloser> f(std::fopen(path.c_str(), "wb"));
+    if (!f)
+        throw std::system_error(errno, std::generic_category(), path);
+
+    FileHeader header;
+    std::memset(&header, 0, sizeof(header));
+    std::memcpy(header.magic, kFileMagic, sizeof(kFileMagic));
+    header.version = fileVersion;
+    header.byteOrderMark = kByteOrderMark;
+    header.minZoom = minZoom;
+    header.maxZoom = maxZoom;
+    header.radius = radius;
+    header.extent = extent;
+    header.nodeSize = nodeSize;
+    header.numLevels = maxZoom + 2 - minZoom;
+    header.numInputPoints = numInputPoints;
+    header.numAttributes = numAttributes;
+    writeBytes(f.get(), &header, sizeof(header), path);
+
+    const size_t bytesPerEntry = levelBytesPerEntry(numAttributes);
+    std::vector<LevelHeader> levels(header.numLevels);
+    size_t offset = alignOffset(sizeof(FileHeader) + levels.size() * sizeof(LevelHeader));
+    for (int z = minZoom; z <= maxZoom + 1; ++z) {
+        LevelHeader &level = levels[z - minZoom];
+        level.size = trees[z]->size();
+        level.offset = offset;
+        offset = alignOffset(offset + level.size * bytesPerEntry);
+    }
+    writeBytes(f.get(), levels.data(), levels.size() * sizeof(LevelHeader), path);
+
+    static const char padding[8] = {0};
+    size_t written = sizeof(FileHeader) + levels.size() * sizeof(LevelHeader);
+    for (int z = minZoom; z <= maxZoom + 1; ++z) {
+        const ClusterTree *tree = trees[z];
+        const size_t n = tree->size();
+        writeBytes(f.get(), padding, levels[z - minZoom].offset - written, path);
+        writeBytes(f.get(), tree->kdbush.xCoords(), n * sizeof(double), path);
+        writeBytes(f.get(), tree->kdbush.yCoords(), n * sizeof(double), path);
+        writeBytes(f.get(), tree->aggregates, n * tree->stride * sizeof(double), path);
+        writeBytes(f.get(), tree->count, n * sizeof(std::uint32_t), path);
+        writeBytes(f.get(), tree->id, n * sizeof(std::uint32_t), path);
+        writeBytes(f.get(), tree->parent, n * sizeof(std::uint32_t), path);
+        written = levels[z - minZoom].offset + n * bytesPerEntry;
+    }
+
+    if (std::fclose(f.release()) != 0)
+        throw std::system_error(errno, std::generic_category(), path);
+}
+
+
+SuperCluster *SuperCluster::load(const std::string &path)
+{
+    std::unique_ptr<MappedFile> file(new MappedFile(path));
+    const char *data = file->data();
+    const size_t size = file->size();
+
+    FileHeader header;
+    std::memcpy(&header, data, sizeof(header));
+    if (std::memcmp(header.magic, kFileMagic, sizeof(kFileMagic)) != 0)
+        throw std::runtime_error("Not a SuperCluster index file.");
+    if (header.version != fileVersion || header.byteOrderMark != kByteOrderMark)
+        throw std::runtime_error("Unsupported SuperCluster index file version or byte order.");
+
+    const int minZoom = header.minZoom;
+    const int maxZoom = header.maxZoom;
+    const bool validOptions = minZoom >= 0 && minZoom <= maxZoom && maxZoom <= maxSupportedZoom &&
+        header.nodeSize >= 1 && header.numInputPoints <= maxPoints && header.numAttributes <= maxAttributes &&
+        header.numLevels == static_cast<std::uint32_t>(maxZoom + 2 - minZoom);
+    if (!validOptions || size < sizeof(FileHeader) + header.numLevels * sizeof(LevelHeader))
+        throw std::runtime_error("Corrupt SuperCluster index file.");
+
+    // Every level must lie within the file at an aligned offset, and the
+    // finest level holds the input points.
+    const size_t bytesPerEntry = levelBytesPerEntry(header.numAttributes);
+    const LevelHeader *levels = reinterpret_cast<const LevelHeader *>(data + sizeof(FileHeader));
+    for (std::uint32_t i = 0; i < header.numLevels; ++i) {
+        const LevelHeader &level = levels[i];
+        const bool valid = level.offset % 8 == 0 && level.offset <= size &&
+            level.size <= (size - level.offset) / bytesPerEntry &&
+            (i + 1 < header.numLevels || level.size == header.numInputPoints);
+        if (!valid)
+            throw std::runtime_error("Corrupt SuperCluster index file.");
+    }
+
+    return new SuperCluster(minZoom, maxZoom, header.radius, header.extent, header.nodeSize,
+                            header.numInputPoints, header.numAttributes, std::move(file));
+}
+
+
+void SuperCluster::findNeighbors(const ClusterTree &tree, const std::vector<Point> &levelPoints,
+                                 const std::vector<std::uint8_t> &processed,
+                                 size_t begin, size_t end, double radius, NeighborBlock &block) const
+{
+    const size_t n = end - begin;
+    block.chunkSize = (n + threads - 1) / threads;
+    block.ids.assign(threads, std::vector<std::uint32_t>());
+    block.offset.assign(n, 0);
+    block.count.assign(n, 0);
+
+    // Each thread searches a contiguous chunk of the block. The tree and the
+    // processed flags are only read here; all writes happen in the serial
+    // merge pass.
+    auto search = [&](int t) {
+        std::vector<std::uint32_t> &ids = block.ids[t];
+        const size_t chunkEnd = std::min(n, (t + 1) * block.chunkSize);
+        for (size_t k = t * block.chunkSize; k < chunkEnd; ++k) {
+            const size_t i = tree.order[begin + k];
+            if (processed[i])
+                continue;
+
+            const size_t start = ids.size();
+            size_t found = 0;
+            const Point &p = levelPoints[begin + k];
+            tree.kdbush.within(p.first, p.second, radius, [&ids, &found](const size_t id) {
+                if (++found <= kMaxCachedNeighbors)
+                    ids.push_back(static_cast<std::uint32_t>(id));
+            });
+
+            block.offset[k] = start;
+            if (found > kMaxCachedNeighbors) {
+                ids.resize(start);
+                block.count[k] = kOverflow;
+            } else {
+                block.count[k] = found;
             }
-        });
+        }
+    };
 
-        if (foundNeighbors) {
-            Cluster *cluster = new Cluster(Point(wx / numPoints, wy / numPoints), numPoints, all_clusters.size(), zoom + 1);
-            clusters.push_back(cluster);
-            all_clusters.push_back(cluster);
-        } else {
-            clusters.push_back(p);
+    // Exceptions (bad_alloc from a search) must not escape a thread: they
+    // are kept per thread and rethrown once every started thread is joined.
+    std::vector<std::exception_ptr> errors(threads);
+    auto run = [&search, &errors](int t) {
+        try {
+            search(t);
+        } catch (...) {
+            errors[t] = std::current_exception();
         }
+    };
+
+    std::vector<std::thread> workers;
+    workers.reserve(threads - 1);
+    try {
+        for (int t = 1; t < threads; ++t)
+            workers.emplace_back(run, t);
+    } catch (...) {
+        for (size_t t = 0; t < workers.size(); ++t)
+            workers[t].join();
+        throw;
     }
+    run(0);
+    for (size_t t = 0; t < workers.size(); ++t)
+        workers[t].join();
+    for (size_t t = 0; t < errors.size(); ++t)
+        if (errors[t])
+            std::rethrow_exception(errors[t]);
+}
 
-    return clusters;
+
+/*
+    Clusters one zoom level. Entries are visited in the order they were
+    added (levelPoints and levelCount hold them in that order, so the pass
+    reads them sequentially), each unprocessed entry absorbing its
+    unprocessed neighbors and their aggregates. The next (coarser) level is
+    written to points, count, id and aggregates.
+*/
+void SuperCluster::cluster(ClusterTree &tree, int zoom,
+                           const std::vector<Point> &levelPoints, const std::vector<std::uint32_t> &levelCount,
+                           std::vector<Point> &points, std::vector<std::uint32_t> &count, std::vector<std::uint32_t> &id,
+                           std::vector<double> &aggregates)
+{
+    const double radius = this->radius / (this->extent * (1 << zoom));
+    const size_t n = tree.size();
+    const size_t stride = tree.stride;
+    const size_t numAttributes = this->numAttributes;
+
+    std::vector<std::uint8_t> processed(n, 0);
+    points.clear();
+    count.clear();
+    id.clear();
+    aggregates.clear();
+
+    const bool parallel = threads > 1 && n >= 2 * kBlockSize;
+    NeighborBlock block;
+
+    for (size_t begin = 0; begin < n; begin += kBlockSize) {
+        const size_t end = std::min(n, begin + kBlockSize);
+        if (parallel)
+            findNeighbors(tree, levelPoints, processed, begin, end, radius, block);
+
+        for (size_t k = begin; k < end; ++k) {
+            const size_t i = tree.order[k];
+            if (processed[i])
+                continue;
+            processed[i] = 1;
+
+            const Point &p = levelPoints[k];
+            bool foundNeighbors = false;
+            size_t numPoints = levelCount[k];
+            double wx = p.first * numPoints;
+            double wy = p.second * numPoints;
+            const std::uint32_t clusterId = static_cast<std::uint32_t>((i << 5) + (zoom + 1) + numInputPoints);
+
+            // The entry's own aggregates, merged with those of every neighbor it absorbs
+            const size_t row = aggregates.size();
+            if (stride)
+                aggregates.insert(aggregates.end(), tree.aggregate(i), tree.aggregate(i) + stride);
+
+            auto visit = [&foundNeighbors, &numPoints, &tree, &processed, &wx, &wy, &aggregates,
+                          clusterId, row, stride, numAttributes](const size_t b) {
+                if (!processed[b]) {
+                    foundNeighbors = true;
+                    processed[b] = 1;
+                    tree.parentStorage[b] = clusterId;
+                    const Point q = tree.point(b);
+                    wx += q.first * tree.count[b];
+                    wy += q.second * tree.count[b];
+                    numPoints += tree.count[b];
+                    if (stride)
+                        mergeAggregates(&aggregates[row], tree.aggregate(b), numAttributes);
+                }
+            };
+
+            // Replaying a cached neighbor list visits ids in the same order as
+            // the search itself, so the result is identical to a serial build.
+            const size_t j = k - begin;
+            if (parallel && block.count[j] != kOverflow) {
+                const std::uint32_t *ids = block.ids[j / block.chunkSize].data() + block.offset[j];
+                for (size_t m = 0; m < block.count[j]; ++m)
+                    visit(ids[m]);
+            } else {
+                tree.kdbush.within(p.first, p.second, radius, visit);
+            }
+
+            if (foundNeighbors) {
+                tree.parentStorage[i] = clusterId;
+                points.push_back(Point(wx / numPoints, wy / numPoints));
+                count.push_back(static_cast<std::uint32_t>(numPoints));
+                id.push_back(clusterId);
+            } else {
+                points.push_back(p);
+                count.push_back(levelCount[k]);
+                id.push_back(tree.id[i]);
+            }
+        }
+    }
+}
+
+
+Cluster SuperCluster::makeCluster(const ClusterTree &tree, size_t i) const
+{
+    const size_t id = tree.id[i];
+    const int expansionZoom = id < numInputPoints ? -1 : static_cast<int>((id - numInputPoints) % 32);
+    return Cluster{tree.point(i), tree.count[i], id, expansionZoom, tree.aggregate(i)};
+}
+
+
+/*
+    Maps every entry to the position of its parent on the next coarser
+    level. An entry's parent there has the entry's parent id if it was
+    absorbed into a cluster, and the entry's own id otherwise. Ids are
+    resolved through a dense table: point ids index it directly, and cluster
+    ids by their origin zoom and seed position.
+*/
+void SuperCluster::computeParentPositions() const
+{
+    std::vector<size_t> keyOffset(maxZoom + 2, 0);
+    size_t numKeys = numInputPoints;
+    for (int z = minZoom + 1; z <= maxZoom + 1; ++z) {
+        keyOffset[z] = numKeys;
+        numKeys += trees[z]->size();
+    }
+
+    auto key = [this, &keyOffset](std::uint32_t id) -> size_t {
+        if (id < numInputPoints)
+            return id;
+        const int originZoom = static_cast<int>((id - numInputPoints) % 32);
+        const size_t seed = (id - numInputPoints) >> 5;
+        if (originZoom <= minZoom || originZoom > maxZoom + 1 || seed >= trees[originZoom]->size())
+            throw std::runtime_error("Corrupt SuperCluster index file.");
+        return keyOffset[originZoom] + seed;
+    };
+
+    std::vector<std::uint32_t> positions(numKeys);
+    std::vector<std::vector<std::uint32_t>> parents(maxZoom + 2);
+    for (int z = minZoom; z <= maxZoom; ++z) {
+        const ClusterTree *coarse = trees[z];
+        const ClusterTree *fine = trees[z + 1];
+        for (size_t p = 0; p < coarse->size(); ++p)
+            positions[key(coarse->id[p])] = static_cast<std::uint32_t>(p);
+
+        std::vector<std::uint32_t> &up = parents[z + 1];
+        up.resize(fine->size());
+        for (size_t b = 0; b < fine->size(); ++b) {
+            const std::uint32_t target = fine->parent[b] != ClusterTree::noParent ? fine->parent[b] : fine->id[b];
+            up[b] = positions[key(target)];
+            if (up[b] >= coarse->size() || coarse->id[up[b]] != target)
+                throw std::runtime_error("Corrupt SuperCluster index file.");
+        }
+    }
+    parentPositions.swap(parents);
+}
+
+
+ClusterFilter *SuperCluster::filter(const std::uint8_t *mask) const
+{
+    const ClusterTree *points = trees[maxZoom + 1];
+    std::vector<std::uint32_t> pointCount(points->size());
+    for (size_t i = 0; i < points->size(); ++i)
+        pointCount[i] = mask[points->id[i]] ? points->count[i] : 0;
+    return filterPoints(pointCount);
+}
+
+
+ClusterFilter *SuperCluster::filter(const std::uint32_t *counts) const
+{
+    const ClusterTree *points = trees[maxZoom + 1];
+    std::vector<std::uint32_t> pointCount(points->size());
+    for (size_t i = 0; i < points->size(); ++i) {
+        pointCount[i] = counts[points->id[i]];
+        if (pointCount[i] > points->count[i])
+            throw std::invalid_argument("Counts must not exceed the weight of their point.");
+    }
+    return filterPoints(pointCount);
+}
+
+
+/*
+    Counts matching points bottom-up: the finest level holds the matching
+    count of each point (in kd-tree order), and each coarser entry sums the
+    counts of the entries it absorbed, keeping the first matching leaf it
+    sees.
+*/
+ClusterFilter *SuperCluster::filterPoints(std::vector<std::uint32_t> &pointCount) const
+{
+    std::call_once(parentPositionsOnce, [this] { computeParentPositions(); });
+
+    std::unique_ptr<ClusterFilter> result(new ClusterFilter);
+    result->count.resize(maxZoom + 2);
+    result->leaf.resize(maxZoom + 2);
+
+    std::vector<std::uint32_t> &pointLeaf = result->leaf[maxZoom + 1];
+    pointLeaf.resize(pointCount.size());
+    for (size_t i = 0; i < pointCount.size(); ++i) {
+        pointLeaf[i] = pointCount[i] ? static_cast<std::uint32_t>(i) : ClusterFilter::noLeaf;
+        result->matching += pointCount[i];
+    }
+    result->count[maxZoom + 1].swap(pointCount);
+
+    for (int z = maxZoom; z >= minZoom; --z) {
+        const std::vector<std::uint32_t> &fineCount = result->count[z + 1];
+        const std::vector<std::uint32_t> &fineLeaf = result->leaf[z + 1];
+        const std::vector<std::uint32_t> &up = parentPositions[z + 1];
+        std::vector<std::uint32_t> &count = result->count[z];
+        std::vector<std::uint32_t> &leaf = result->leaf[z];
+        count.assign(trees[z]->size(), 0);
+        leaf.assign(trees[z]->size(), ClusterFilter::noLeaf);
+        for (size_t b = 0; b < fineCount.size(); ++b) {
+            if (fineCount[b] == 0)
+                continue;
+            const std::uint32_t p = up[b];
+            count[p] += fineCount[b];
+            if (leaf[p] == ClusterFilter::noLeaf)
+                leaf[p] = fineLeaf[b];
+        }
+    }
+
+    return result.release();
+}
+
+
+/*
+    Makes the cluster for entry i of level z as seen through a filter (or
+    unfiltered without one). Returns false if none of its points match.
+*/
+bool SuperCluster::filterCluster(int z, size_t i, const ClusterFilter *filter, Cluster &cluster) const
+{
+    if (filter == nullptr) {
+        cluster = makeCluster(*trees[z], i);
+        return true;
+    }
+
+    const std::uint32_t matching = filter->count[z][i];
+    if (matching == 0)
+        return false;
+    // A single matching point may be a weighted one, of which it is a part
+    if (matching == 1)
+        cluster = makeCluster(*trees[maxZoom + 1], filter->leaf[z][i]);
+    else
+        cluster = makeCluster(*trees[z], i);
+    cluster.numPoints = matching;
+    // Aggregates cover every point of a cluster, not only the matching ones
+    cluster.aggregates = nullptr;
+    return true;
 }
 
 
-std::vector<Cluster*> SuperCluster::getClusters(const Point &min_p, const Point &max_p, int zoom) const
+std::vector<Cluster> SuperCluster::getClusters(const Point &min_p, const Point &max_p, int zoom,
+                                               const ClusterFilter *filter) const
 {
     const int z = std::max(minZoom, std::min(zoom, maxZoom + 1));
-    std::vector<Cluster*> clusters;
+    std::vector<Cluster> clusters;
 
-    ClusterTree *tree = trees[z];
-    tree->kdbush->range(min_p.first, min_p.second, max_p.first, max_p.second, [&clusters, &tree](const std::vector<Cluster*>::size_type id) {
-        clusters.push_back(tree->clusters[id]);
+    const ClusterTree *tree = trees[z];
+    tree->kdbush.range(min_p.first, min_p.second, max_p.first, max_p.second, [this, &clusters, z, filter](const size_t i) {
+        Cluster cluster;
+        if (filterCluster(z, i, filter, cluster))
+            clusters.push_back(cluster);
     });
 
     return clusters;
 }
+
+
+void SuperCluster::addTileFeatures(int zoom, double minX, double minY, double maxX, double maxY,
+                                   double x, double y, double z2, const ClusterFilter *filter,
+                                   std::vector<TileFeature> &features) const
+{
+    trees[zoom]->kdbush.range(minX, minY, maxX, maxY, [this, zoom, x, y, z2, filter, &features](const size_t i) {
+        Cluster cluster;
+        if (!filterCluster(zoom, i, filter, cluster))
+            return;
+        const Point &p = cluster.point;
+        features.push_back(TileFeature{
+            cluster,
+            static_cast<int>(std::floor(extent * (p.first * z2 - x) + 0.5)),
+            static_cast<int>(std::floor(extent * (p.second * z2 - y) + 0.5))
+        });
+    });
+}
+std::vector<TileFeature> SuperCluster::getTile(int z, int x, int y, const ClusterFilter *filter) const
+{
+    const int zoom = std::max(minZoom, std::min(z, maxZoom + 1));
+    const double z2 = std::pow(2.0, z);
+    const double p = radius / extent;
+    const double top = (y - p) / z2;
+    const double bottom = (y + 1 + p) / z2;
+    std::vector<TileFeature> features;
+
+    // Include clusters within a radius-sized buffer around the tile, and wrap
+    // around the antimeridian for the first and last column of tiles.
+    addTileFeatures(zoom, (x - p) / z2, top, (x + 1 + p) / z2, bottom, x, y, z2, filter, features);
+    if (x == 0)
+        addTileFeatures(zoom, 1 - p / z2, top, 1, bottom, z2, y, z2, filter, features);
+    if (x == z2 - 1)
+        addTileFeatures(zoom, 0, top, p / z2, bottom, -1, y, z2, filter, features);
+
+    return features;
+}
+
+
+int SuperCluster::getOriginZoom(size_t clusterId) const
+{
+    if (clusterId < numInputPoints)
+        throw std::invalid_argument("No cluster with the specified id.");
+
+    const int originZoom = static_cast<int>((clusterId - numInputPoints) % 32);
+    if (originZoom <= minZoom || originZoom > maxZoom + 1)
+        throw std::invalid_argument("No cluster with the specified id.");
+
+    return originZoom;
+}
+
+
+std::vector<Cluster> SuperCluster::getChildren(size_t clusterId, const ClusterFilter *filter) const
+{
+    const int originZoom = getOriginZoom(clusterId);
+    const size_t originId = (clusterId - numInputPoints) >> 5;
+    const ClusterTree *tree = trees[originZoom];
+    if (originId >= tree->size())
+        throw std::invalid_argument("No cluster with the specified id.");
+
+    // The children are the neighbors merged around the seed point, found
+    // again with the radius used when the cluster was created.
+    const Point origin = tree->point(originId);
+    const double r = radius / (extent * (1 << (originZoom - 1)));
+    std::vector<Cluster> children;
+    tree->kdbush.within(origin.first, origin.second, r,
+                        [this, tree, originZoom, clusterId, filter, &children](const size_t i) {
+        Cluster child;
+        if (tree->parent[i] == clusterId && filterCluster(originZoom, i, filter, child))
+            children.push_back(child);
+    });
+
+    if (children.empty())
+        throw std::invalid_argument("No cluster with the specified id.");
+
+    return children;
+}
+
+
+size_t SuperCluster::appendLeaves(std::vector<Cluster> &result, size_t clusterId, size_t limit,
+                                  size_t offset, size_t skipped, const ClusterFilter *filter) const
+{
+    const std::vector<Cluster> children = getChildren(clusterId, filter);
+
+    for (size_t i = 0; i < children.size(); ++i) {
+        const Cluster &child = children[i];
+        if (skipped + child.numPoints <= offset) {
+            // skip the whole cluster or point
+            skipped += child.numPoints;
+        } else if (child.id >= numInputPoints) {
+            // enter the cluster
+            skipped = appendLeaves(result, child.id, limit, offset, skipped, filter);
+        } else {
+            // add a point (a weighted one may straddle the offset)
+            result.push_back(child);
+            skipped = offset;
+        }
+        if (result.size() == limit)
+            break;
+    }
+
+    return skipped;
+}
+
+
+std::vector<Cluster> SuperCluster::getLeaves(size_t clusterId, size_t limit, size_t offset,
+                                             const ClusterFilter *filter) const
+{
+    std::vector<Cluster> leaves;
+    if (limit > 0)
+        appendLeaves(leaves, clusterId, limit, offset, 0, filter);
+    else
+        getChildren(clusterId, filter);
+    return leaves;
+}
+
+
+int SuperCluster::getClusterExpansionZoom(size_t clusterId, const ClusterFilter *filter) const
+{
+    int expansionZoom = getOriginZoom(clusterId) - 1;
+    while (expansionZoom <= maxZoom) {
+        const std::vector<Cluster> children = getChildren(clusterId, filter);
+        ++expansionZoom;
+        if (children.size() != 1)
+            break;
+        if (children[0].id < numInputPoints) {
+            // Points at one position only separate past the last zoom level
+            // when they are input one by one instead of as a weighted point
+            if (children[0].numPoints > 1)
+                expansionZoom = maxZoom + 1;
+            break;
+        }
+        clusterId = children[0].id;
+    }
+    return expansionZoom;
+}
@@ -14,46 +14,206 @@
     OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 */
 
+#include <cstdint>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
 #include "kdbush.hpp"
 
 using Point = std::pair<double, double>;
 
-class Cluster {
-public:
-    Cluster(const Point &_point, size_t _numPoints, size_t _id, int _expansionZoom);
+// A cluster or point as returned by queries (a value, not stored).
+// aggregates points into the index (null without attributes) and is only
+// valid while the index lives.
+struct Cluster {
     Point point;
     size_t numPoints;
     size_t id;
-    int zoom;
     int expansionZoom;
+    const double *aggregates;
 };
 
 
+/*
+    One zoom level, stored as columns in kd-tree order: the kd-tree holds the
+    coordinates, and count, id and parent are parallel arrays indexed by the
+    same position. Ids and parents are 32-bit, which bounds the number of
+    input points (see SuperCluster::maxPoints).
+
+    With attributes, each entry also has `stride` aggregate values: the sums
+    of every attribute, then their minimums, then their maximums.
+
+    A built tree owns its columns; a loaded tree views columns in a mapped
+    index file. Either way queries read them through the pointers.
+*/
 class ClusterTree {
 public:
-    ClusterTree(const std::vector<Cluster*> &clusters);
-    ~ClusterTree();
+    static const std::uint32_t noParent = UINT32_MAX;
+
+    ClusterTree(const std::vector<Point> &points, const std::vector<std::uint32_t> &count,
+                const std::vector<std::uint32_t> &id, const std::vector<double> &aggregates, size_t stride,
+                std::uint32_t nodeSize, unsigned threads = 1);
+    ClusterTree(const double *xs, const double *ys, const std::uint32_t *count, const std::uint32_t *id,
+                const std::uint32_t *parent, const double *aggregates, size_t stride, size_t size,
+                std::uint32_t nodeSize);
+
+    size_t size() const { return kdbush.size(); }
+    Point point(size_t i) const { return kdbush.point(i); }
+    const double *aggregate(size_t i) const { return stride ? aggregates + i * stride : nullptr; }
+
+    kdbush::KDBush<Point> kdbush;
+    const std::uint32_t *count;
+    const std::uint32_t *id;
+    const std::uint32_t *parent;
+    const double *aggregates;
+    size_t stride;
+
+    // Columns of a built tree (empty for a loaded one); the clustering pass
+    // writes parents through parentStorage.
+    std::vector<std::uint32_t> countStorage;
+    std::vector<std::uint32_t> idStorage;
+    std::vector<std::uint32_t> parentStorage;
+    std::vector<double> aggregateStorage;
+
+    // Position of each entry in the order it was added (build only)
+    std::vector<std::uint32_t> order;
+};
+
+
+/*
+    Matching point counts of every entry on every zoom level for one point
+    filter (see SuperCluster::filter), indexed like the level's columns.
+    leaf holds, for entries with matching points, the position of one of
+    them in the finest level.
+*/
+struct ClusterFilter {
+    static const std::uint32_t noLeaf = UINT32_MAX;
 
-    kdbush::KDBush<Point> *kdbush;
-    std::vector<Cluster*> clusters;
+    std::vector<std::vector<std::uint32_t>> count;
+    std::vector<std::vector<std::uint32_t>> leaf;
+    size_t matching = 0;
+
+    size_t bytes() const {
+        size_t total = 0;
+        for (size_t z = 0; z < count.size(); ++z)
+            total += (count[z].size() + leaf[z].size()) * sizeof(std::uint32_t);
+        return total;
+    }
+};
+
+
+struct TileFeature {
+    Cluster cluster;
+    int x;
+    int y;
 };
 
 
 class SuperCluster {
 public:
-    SuperCluster(const std::vector<Point> &points, int minZoom, int maxZoom, double radius, double extent);
+    // attributes holds numAttributes values per point, row by row. Clusters
+    // aggregate them (sum, min and max); NaN values count as missing.
+    // weights holds the number of points each input point stands for (empty
+    // for one each), e.g. the points at one position: cluster counts and
+    // filters add up weights, and a weighted point's attribute values are
+    // added to sums once, so pass the sums over the points it stands for.
+    SuperCluster(const std::vector<Point> &points, int minZoom, int maxZoom, double radius, double extent,
+                 int threads = 1, std::uint32_t nodeSize = kdbush::KDBush<Point>::defaultNodeSize,
+                 const std::vector<double> &attributes = std::vector<double>(), size_t numAttributes = 0,
+                 const std::vector<std::uint32_t> &weights = std::vector<std::uint32_t>());
     ~SuperCluster();
 
-    std::vector<Cluster*> getClusters(const Point &min_p, const Point &max_p, int zoom) const;
+    size_t attributeCount() const { return numAttributes; }
+    size_t pointCount() const { return numInputPoints; }
+
+    // Index files hold the options and every zoom level's columns. load()
+    // maps the file read-only and queries read it in place, so processes
+    // loading the same file share its pages. Both throw std::system_error
+    // on I/O errors and std::runtime_error for files that are not valid
+    // index files.
+    void save(const std::string &path) const;
+    static SuperCluster *load(const std::string &path);
+
+    // Counts the matching points of every cluster for mask (one flag per
+    // input point, by id); the caller owns the result. Queries given the
+    // filter skip entries without matching points, report matching counts
+    // and return an entry with a single matching point as that point.
+    // Clusters keep the position and grouping of the unfiltered index.
+    // A weighted point matches with its whole weight, or with the number of
+    // its points given by counts (at most its weight, else
+    // std::invalid_argument).
+    ClusterFilter *filter(const std::uint8_t *mask) const;
+    ClusterFilter *filter(const std::uint32_t *counts) const;
+
+    std::vector<Cluster> getClusters(const Point &min_p, const Point &max_p, int zoom,
+                                     const ClusterFilter *filter = nullptr) const;
+    std::vector<TileFeature> getTile(int z, int x, int y, const ClusterFilter *filter = nullptr) const;
+
+    // Drill-down by cluster id; throw std::invalid_argument for unknown ids
+    // (and, with a filter, for clusters without matching points). Leaf
+    // offsets count weights: a weighted point is skipped only if its whole
+    // weight fits in the offset, and limit counts the points returned.
+    std::vector<Cluster> getChildren(size_t clusterId, const ClusterFilter *filter = nullptr) const;
+    std::vector<Cluster> getLeaves(size_t clusterId, size_t limit, size_t offset,
+                                   const ClusterFilter *filter = nullptr) const;
+    int getClusterExpansionZoom(size_t clusterId, const ClusterFilter *filter = nullptr) const;
+
+    // Cluster ids encode the position of the cluster's seed point within its
+    // zoom level and that zoom, offset by the number of input points so they
+    // never collide with point ids (as in the JavaScript Supercluster).
+    static const int maxSupportedZoom = 30;
+
+    // Largest input for which every encoded id fits in 32 bits.
+    static const size_t maxPoints = (UINT32_MAX - 32) / 33;
+
+    static const size_t maxAttributes = 256;
+
+    // Bumped whenever the index file layout changes.
+    static const std::uint32_t fileVersion = 2;
 
 private:
-    std::vector<Cluster*> cluster(const std::vector<Cluster*> &points, int zoom);
+    struct NeighborBlock;
+    class MappedFile;
+
+    SuperCluster(int minZoom, int maxZoom, double radius, double extent, std::uint32_t nodeSize,
+                 size_t numInputPoints, size_t numAttributes, std::unique_ptr<MappedFile> file);
+
+    void cluster(ClusterTree &tree, int zoom,
+                 const std::vector<Point> &levelPoints, const std::vector<std::uint32_t> &levelCount,
+                 std::vector<Point> &points, std::vector<std::uint32_t> &count, std::vector<std::uint32_t> &id,
+                 std::vector<double> &aggregates);
+    Cluster makeCluster(const ClusterTree &tree, size_t i) const;
+    ClusterFilter *filterPoints(std::vector<std::uint32_t> &pointCount) const;
+    bool filterCluster(int z, size_t i, const ClusterFilter *filter, Cluster &cluster) const;
+    void computeParentPositions() const;
+    int getOriginZoom(size_t clusterId) const;
+    size_t appendLeaves(std::vector<Cluster> &result, size_t clusterId, size_t limit,
+                        size_t offset, size_t skipped, const ClusterFilter *filter) const;
+    void addTileFeatures(int zoom, double minX, double minY, double maxX, double maxY,
+                         double x, double y, double z2, const ClusterFilter *filter,
+                         std::vector<TileFeature> &features) const;
+    void findNeighbors(const ClusterTree &tree, const std::vector<Point> &levelPoints,
+                       const std::vector<std::uint8_t> &processed, size_t begin, size_t end,
+                       double radius, NeighborBlock &block) const;
 
     const int minZoom;
     const int maxZoom;
     const double radius;
     const double extent;
+    const int threads;
+    const std::uint32_t nodeSize;
+    const size_t numInputPoints;
+    const size_t numAttributes;
 
-    std::vector<Cluster*> all_clusters;
     std::vector<ClusterTree*> trees;
+
+    // Position of each entry's parent on the next coarser level, per level;
+    // computed on the first filter() call.
+    mutable std::once_flag parentPositionsOnce;
+    mutable std::vector<std::vector<std::uint32_t>> parentPositions;
+
+    // Backs the trees of a loaded index (null for a built one)
+    std::unique_ptr<MappedFile> file;
 };
@@ -1,3 +1,6 @@
+import os
+import tempfile
+import threading
 import unittest
 
 import numpy
@@ -37,10 +40,197 @@ class SuperClusterTest(unittest.TestCase):
         # cluster
         self.assertEqual(clusters[1]['count'], 2)
         self.assertEqual(clusters[1]['expansion_zoom'], 8)
-        self.assertEqual(clusters[1]['id'], 3)
+        self.assertEqual(clusters[1]['id'], 43)
         self.assertAlmostEqual(clusters[1]['latitude'], 51.4950017)
         self.assertAlmostEqual(clusters[1]['longitude'], -0.0677500)
 
+    def test_arrays(self):
+        points = numpy.array([
+            (2.3522, 48.8566),   # paris
+            (-0.1278, 51.5074),  # london
+            (-0.0077, 51.4826),  # greenwhich
+        ])
+
+        index = pysupercluster.SuperCluster(
+            points,
+            min_zoom=0,
+            max_zoom=16,
+            radius=40,
+            extent=512)
+
+        for zoom in (0, 4, 8, 17):
+            clusters = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+
+            self.assertEqual(arrays['count'].dtype, numpy.int64)
+            self.assertEqual(arrays['expansion_zoom'].dtype, numpy.int32)
+            self.assertEqual(arrays['longitude'].tolist(), [c['longitude'] for c in clusters])
+            self.assertEqual(arrays['latitude'].tolist(), [c['latitude'] for c in clusters])
+            self.assertEqual(arrays['count'].tolist(), [c['count'] for c in clusters])
+            self.assertEqual(arrays['id'].tolist(), [c['id'] for c in clusters])
+            self.assertEqual(
+                arrays['expansion_zoom'].tolist(),
+                [-1 if c['expansion_zoom'] is None else c['expansion_zoom'] for c in clusters])
+
+        empty = index.getClustersArrays(top_left=(10, 10), bottom_right=(11, 9), zoom=4)
+        self.assertEqual(len(empty['id']), 0)
+
+    def test_batch(self):
+        rng = numpy.random.RandomState(2)
+        points = numpy.column_stack([
+            rng.uniform(-180, 180, 5000),
+            rng.uniform(-85, 85, 5000),
+        ])
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+
+        queries = numpy.array([
+            # west, south, east, north, zoom
+            (-180, -85, 180, 85, 0),
+            (-10, 30, 40, 60, 4),
+            (10, 10, 11, 11, 12),
+            (-180, -85, 180, 85, 17),
+        ])
+
+        for threads in (1, 3):
+            batch = index.getClustersBatch(queries, threads=threads)
+
+            self.assertEqual(batch['offsets'].tolist()[0], 0)
+            self.assertEqual(len(batch['offsets']), len(queries) + 1)
+            for i, (west, south, east, north, zoom) in enumerate(queries):
+                expected = index.getClustersArrays(
+                    top_left=(west, north), bottom_right=(east, south), zoom=int(zoom))
+                start, end = batch['offsets'][i], batch['offsets'][i + 1]
+                for key in ('longitude', 'latitude', 'count', 'id', 'expansion_zoom'):
+                    self.assertEqual(batch[key][start:end].tolist(), expected[key].tolist())
+
+    def test_batch_invalid_shape(self):
+        index = pysupercluster.SuperCluster(numpy.ones((1, 2)))
+
+        with self.assertRaises(ValueError):
+            index.getClustersBatch(numpy.zeros((2, 4)))
+
+    def test_batch_invalid_zoom(self):
+        index = pysupercluster.SuperCluster(numpy.ones((1, 2)), max_zoom=16)
+
+        for zoom in (numpy.nan, numpy.inf, -numpy.inf, 1e30, -1e30):
+            with self.assertRaises(ValueError):
+                index.getClustersBatch([[-180, -90, 180, 90, 0], [-180, -90, 180, 90, zoom]])
+
+        # Zooms past max_zoom are clamped like in getClustersArrays
+        batch = index.getClustersBatch([[-180, -90, 180, 90, 40]])
+        self.assertEqual(batch['id'].tolist(), [0])
+
+    def test_tile(self):
+        points = numpy.array([
+            (0.0, 0.0),
+            (2.3522, 48.8566),   # paris
+            (179.5, 10.0),       # next to the antimeridian
+        ])
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+
+        # at zoom 0 the single tile wraps on both sides, so the point next to
+        # the antimeridian is also repeated in the left buffer
+        tile = index.getTile(0, 0, 0)
+        self.assertEqual(tile['x'].dtype, numpy.int32)
+        self.assertEqual(sorted(tile['id'].tolist()), [0, 1, 2, 2])
+        center = tile['id'].tolist().index(0)
+        self.assertEqual((tile['x'][center], tile['y'][center]), (256, 256))
+
+        tile = index.getTile(4, 8, 5)
+        self.assertEqual(tile['id'].tolist(), [1])
+        self.assertAlmostEqual(tile['longitude'][0], 2.3522)
+        x = (2.3522 / 360 + 0.5) * 16 - 8
+        self.assertEqual(tile['x'].tolist(), [int(numpy.floor(512 * x + 0.5))])
+
+        # the point next to the antimeridian shows up in the buffer of the
+        # first column of tiles, left of the tile edge
+        tile = index.getTile(4, 0, 7)
+        self.assertEqual(tile['id'].tolist(), [2])
+        self.assertEqual(tile['x'].tolist(), [-11])
+
+        tile = index.getTile(4, 12, 3)
+        self.assertEqual(len(tile['id']), 0)
+
+    def test_drill_down(self):
+        points = numpy.array([
+            (2.3522, 48.8566),   # paris
+            (-0.1278, 51.5074),  # london
+            (-0.0077, 51.4826),  # greenwhich
+        ])
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+
+        children = index.getChildren(43)
+        self.assertEqual(sorted(c['id'] for c in children), [1, 2])
+        self.assertEqual(sorted(c['id'] for c in index.getLeaves(43)), [1, 2])
+        self.assertEqual(index.getClusterExpansionZoom(43), 8)
+
+        # ids from the array API can be passed back as NumPy integers
+        self.assertEqual(index.getChildren(numpy.int64(43)), children)
+        self.assertEqual(index.getLeaves(numpy.uint32(43), limit=numpy.int64(10)), index.getLeaves(43))
+        self.assertEqual(index.getClusterExpansionZoom(numpy.uint64(43)), 8)
+        with self.assertRaises(TypeError):
+            index.getChildren(43.0)
+
+        for cluster_id in (0, 2, 3, 44, 43 + 32 * 10, 2 ** 40, -1, 43 - 2 ** 64, 43 + 2 ** 64):
+            with self.assertRaises(ValueError):
+                index.getChildren(cluster_id)
+            with self.assertRaises(ValueError):
+                index.getLeaves(cluster_id)
+            with self.assertRaises(ValueError):
+                index.getClusterExpansionZoom(cluster_id)
+
+    def test_drill_down_consistency(self):
+        rng = numpy.random.RandomState(3)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 3000),
+            rng.uniform(-35, 35, 3000),
+        ])
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+
+        for zoom in (0, 3, 6):
+            clusters = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            leaf_ids = []
+            for cluster in clusters:
+                if cluster['count'] == 1:
+                    leaf_ids.append(cluster['id'])
+                    continue
+
+                children = index.getChildren(cluster['id'])
+                self.assertEqual(sum(c['count'] for c in children), cluster['count'])
+
+                # children are the clusters shown at the expansion zoom
+                expansion_zoom = index.getClusterExpansionZoom(cluster['id'])
+                self.assertEqual(expansion_zoom, cluster['expansion_zoom'])
+                visible = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=expansion_zoom)
+                self.assertTrue({c['id'] for c in children} <= {c['id'] for c in visible})
+
+                leaves = index.getLeaves(cluster['id'], limit=cluster['count'] + 1)
+                self.assertEqual(len(leaves), cluster['count'])
+                leaf_ids.extend(c['id'] for c in leaves)
+
+                # pages of leaves cover all leaves exactly once
+                pages = []
+                for offset in range(0, cluster['count'], 7):
+                    pages.extend(c['id'] for c in index.getLeaves(cluster['id'], limit=7, offset=offset))
+                self.assertEqual(pages, [c['id'] for c in leaves])
+
+            self.assertEqual(sorted(leaf_ids), list(range(len(points))))
+
+    def test_max_zoom_limit(self):
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(numpy.ones((1, 2)), max_zoom=31)
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(numpy.ones((1, 2)), min_zoom=-1)
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(numpy.ones((1, 2)), min_zoom=5, max_zoom=3)
+
+    def test_tile_invalid(self):
+        index = pysupercluster.SuperCluster(numpy.ones((1, 2)))
+
+        for z, x, y in ((-1, 0, 0), (0, 1, 0), (2, 0, 4), (31, 0, 0)):
+            with self.assertRaises(ValueError):
+                index.getTile(z, x, y)
+
     def test_empty_input(self):
         points = numpy.ones((0, 2))
 
@@ -52,6 +242,392 @@ class SuperClusterTest(unittest.TestCase):
                 radius=40,
                 extent=512)
 
+    def test_input_arrays(self):
+        rng = numpy.random.RandomState(5)
+        table = numpy.column_stack([
+            rng.uniform(0, 1, 20000),
+            rng.uniform(-20, 50, 20000),
+            rng.uniform(-35, 35, 20000),
+        ])
+        points = numpy.ascontiguousarray(table[:, 1:])
+
+        def clusters(index):
+            return [index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=z) for z in (0, 5, 10, 17)]
+
+        expected = clusters(pysupercluster.SuperCluster(points))
+
+        # strided views and separate columns are read in place
+        self.assertEqual(clusters(pysupercluster.SuperCluster(table[:, 1:])), expected)
+        self.assertEqual(clusters(pysupercluster.SuperCluster(
+            longitudes=table[:, 1], latitudes=table[:, 2])), expected)
+        self.assertEqual(clusters(pysupercluster.SuperCluster(points.tolist())), expected)
+
+        # float32 matches float64 built from the same rounded values
+        single = points.astype(numpy.float32)
+        self.assertEqual(
+            clusters(pysupercluster.SuperCluster(single)),
+            clusters(pysupercluster.SuperCluster(single.astype(numpy.float64))))
+        self.assertEqual(
+            clusters(pysupercluster.SuperCluster(longitudes=single[:, 0], latitudes=single[:, 1])),
+            clusters(pysupercluster.SuperCluster(single.astype(numpy.float64))))
+        # mixed column types and non-native byte order are converted
+        self.assertEqual(clusters(pysupercluster.SuperCluster(
+            longitudes=single[:, 0], latitudes=points[:, 1].astype('>f8'))),
+            clusters(pysupercluster.SuperCluster(numpy.column_stack([single[:, 0], points[:, 1]]))))
+
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster()
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, longitudes=points[:, 0], latitudes=points[:, 1])
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(longitudes=points[:, 0])
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(longitudes=points[:, 0], latitudes=points[:-1, 1])
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(numpy.ones((4, 3)))
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(longitudes=numpy.ones(0), latitudes=numpy.ones(0))
+
+    def test_concurrent_threads(self):
+        rng = numpy.random.RandomState(0)
+        points = numpy.column_stack([
+            rng.uniform(-180, 180, 20000),
+            rng.uniform(-85, 85, 20000),
+        ])
+
+        def build_and_query():
+            index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+            return [index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=z) for z in (0, 4, 8)]
+
+        expected = build_and_query()
+        results = [None] * 4
+
+        def worker(i):
+            results[i] = build_and_query()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            self.assertEqual(result, expected)
+
+    def test_parallel_build_matches_serial(self):
+        rng = numpy.random.RandomState(1)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 50000),
+            rng.uniform(-35, 35, 50000),
+        ])
+        # dense duplicates overflow the cached neighbor lists
+        points = numpy.vstack([points, numpy.repeat(points[:5], 2000, axis=0)])
+
+        serial = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+        parallel = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512, threads=4)
+
+        for zoom in range(0, 18):
+            self.assertEqual(
+                parallel.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom),
+                serial.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom))
+
+    def test_node_size(self):
+        rng = numpy.random.RandomState(2)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 20000),
+            rng.uniform(-35, 35, 20000),
+        ])
+
+        def summary(index, zoom):
+            arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            # ids follow kd-tree order and centroids are summed in visit
+            # order, so compare counts and rounded positions only
+            return sorted(zip(
+                arrays['count'].tolist(),
+                numpy.round(arrays['longitude'], 6).tolist(),
+                numpy.round(arrays['latitude'], 6).tolist(),
+                arrays['expansion_zoom'].tolist()))
+
+        default = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512)
+        for node_size in (1, 7, 256, 100000):
+            index = pysupercluster.SuperCluster(
+                points, min_zoom=0, max_zoom=16, radius=40, extent=512, node_size=node_size)
+            for zoom in range(0, 18):
+                self.assertEqual(summary(index, zoom), summary(default, zoom))
+
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, node_size=0)
+
+    def test_save_load(self):
+        rng = numpy.random.RandomState(3)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 20000),
+            rng.uniform(-35, 35, 20000),
+        ])
+        index = pysupercluster.SuperCluster(points, min_zoom=2, max_zoom=14, radius=60, extent=256, node_size=16)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            index.save(path)
+            loaded = pysupercluster.SuperCluster.load(path)
+
+        # the mapping outlives the deleted file
+        for zoom in range(0, 17):
+            clusters = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            self.assertEqual(
+                loaded.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom), clusters)
+        self.assertEqual(loaded.getTile(4, 8, 7)['id'].tolist(), index.getTile(4, 8, 7)['id'].tolist())
+
+        clusters = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=6)
+        cluster_id = max(clusters, key=lambda c: c['count'])['id']
+        self.assertEqual(loaded.getChildren(cluster_id), index.getChildren(cluster_id))
+        self.assertEqual(loaded.getLeaves(cluster_id, limit=50), index.getLeaves(cluster_id, limit=50))
+        self.assertEqual(loaded.getClusterExpansionZoom(cluster_id), index.getClusterExpansionZoom(cluster_id))
+
+    def test_attributes(self):
+        rng = numpy.random.RandomState(4)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 5000),
+            rng.uniform(-35, 35, 5000),
+        ])
+        attributes = numpy.column_stack([
+            rng.randint(0, 2, 5000),
+            rng.uniform(-10, 10, 5000),
+        ]).astype(numpy.float64)
+        attributes[::7, 1] = numpy.nan  # missing values
+
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512,
+                                            attributes=attributes)
+        self.assertEqual(index.num_attributes, 2)
+
+        for zoom in (2, 6, 10, 17):
+            arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            self.assertEqual(arrays['sum'].shape, (len(arrays['id']), 2))
+            for i in numpy.flatnonzero(arrays['count'] > 1)[:50]:
+                leaves = [leaf['id'] for leaf in index.getLeaves(int(arrays['id'][i]), limit=5000)]
+                values = attributes[leaves]
+                numpy.testing.assert_allclose(arrays['sum'][i], numpy.nansum(values, axis=0))
+                numpy.testing.assert_array_equal(arrays['min'][i], numpy.fmin.reduce(values, axis=0))
+                numpy.testing.assert_array_equal(arrays['max'][i], numpy.fmax.reduce(values, axis=0))
+
+        # a point's aggregates are its own values, with a missing value summing to 0
+        arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=17)
+        ids = arrays['id']
+        numpy.testing.assert_array_equal(arrays['min'], attributes[ids])
+        numpy.testing.assert_array_equal(arrays['sum'], numpy.nan_to_num(attributes[ids]))
+
+        clusters = index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=2)
+        arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=2)
+        self.assertEqual(clusters[0]['sum'], arrays['sum'][0].tolist())
+        tile = index.getTile(2, 2, 1)
+        self.assertEqual(tile['max'].shape, (len(tile['id']), 2))
+
+        # one attribute as a 1-D array; indexes without attributes return none
+        single = pysupercluster.SuperCluster(points, attributes=attributes[:, 0])
+        arrays = single.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=0)
+        self.assertEqual(arrays['sum'].sum(), attributes[:, 0].sum())
+        plain = pysupercluster.SuperCluster(points)
+        self.assertEqual(plain.num_attributes, 0)
+        self.assertNotIn('sum', plain.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=0))
+
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, attributes=attributes[:10])
+
+    def test_attributes_parallel_save_load(self):
+        rng = numpy.random.RandomState(5)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 40000),
+            rng.uniform(-35, 35, 40000),
+        ])
+        attributes = rng.randint(0, 2, (40000, 3)).astype(numpy.float64)
+
+        serial = pysupercluster.SuperCluster(points, attributes=attributes)
+        parallel = pysupercluster.SuperCluster(points, attributes=attributes, threads=4)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            serial.save(path)
+            loaded = pysupercluster.SuperCluster.load(path)
+
+        self.assertEqual(loaded.num_attributes, 3)
+        for zoom in (0, 5, 12, 17):
+            expected = serial.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            for index in (parallel, loaded):
+                arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+                for key in ('id', 'count', 'sum', 'min', 'max'):
+                    numpy.testing.assert_array_equal(arrays[key], expected[key])
+
+    def test_filter(self):
+        rng = numpy.random.RandomState(6)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 5000),
+            rng.uniform(-35, 35, 5000),
+        ])
+        mask = rng.uniform(size=5000) < 0.2
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512,
+                                            attributes=numpy.ones(5000))
+        view = index.filter(mask)
+        self.assertEqual(view.count, mask.sum())
+        self.assertGreater(view.nbytes, 0)
+
+        for zoom in (0, 3, 6, 10, 17):
+            clusters = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom)
+            filtered = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom, filter=view)
+            self.assertNotIn('sum', filtered)
+            self.assertEqual(filtered['count'].sum(), mask.sum())
+
+            # counts are exact and clusters keep their unfiltered position
+            by_id = {i: k for k, i in enumerate(clusters['id'].tolist())}
+            leaf_ids = []
+            for k in range(len(filtered['id'])):
+                cluster_id, count = int(filtered['id'][k]), int(filtered['count'][k])
+                if count == 1:
+                    self.assertTrue(mask[cluster_id])
+                    self.assertAlmostEqual(filtered['longitude'][k], points[cluster_id, 0])
+                    leaf_ids.append(cluster_id)
+                    continue
+                self.assertAlmostEqual(filtered['longitude'][k], clusters['longitude'][by_id[cluster_id]])
+                leaves = [leaf['id'] for leaf in index.getLeaves(cluster_id, limit=5000)]
+                self.assertEqual(mask[leaves].sum(), count)
+
+                matching = [leaf['id'] for leaf in index.getLeaves(cluster_id, limit=5000, filter=view)]
+                self.assertEqual(sorted(matching), sorted(i for i in leaves if mask[i]))
+                leaf_ids.extend(matching)
+                children = index.getChildren(cluster_id, filter=view)
+                self.assertEqual(sum(c['count'] for c in children), count)
+                self.assertGreaterEqual(index.getClusterExpansionZoom(cluster_id, filter=view),
+                                        index.getClusterExpansionZoom(cluster_id))
+            self.assertEqual(sorted(leaf_ids), numpy.flatnonzero(mask).tolist())
+
+        tile = index.getTile(2, 2, 1, filter=view)
+        self.assertTrue(mask[tile['id'][tile['count'] == 1]].all())
+        batch = index.getClustersBatch([[-180, -90, 180, 90, 4]], filter=view)
+        self.assertEqual(batch['count'].sum(), mask.sum())
+
+        # a loaded index gives the same counts
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            index.save(path)
+            loaded = pysupercluster.SuperCluster.load(path)
+        expected = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=5, filter=view)
+        arrays = loaded.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=5,
+                                          filter=loaded.filter(mask))
+        for key in ('id', 'count', 'longitude'):
+            numpy.testing.assert_array_equal(arrays[key], expected[key])
+
+        # clusters without matching points are dropped
+        none = index.filter(numpy.zeros(5000, dtype=bool))
+        self.assertEqual(index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=3, filter=none), [])
+        cluster_id = max(index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=3),
+                         key=lambda c: c['count'])['id']
+        with self.assertRaises(ValueError):
+            index.getChildren(cluster_id, filter=none)
+
+        with self.assertRaises(ValueError):
+            index.filter(mask[:10])
+        with self.assertRaises(ValueError):
+            loaded.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=3, filter=view)
+        with self.assertRaises(TypeError):
+            index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=3, filter=mask)
+
+    def test_weights(self):
+        rng = numpy.random.RandomState(8)
+        points = numpy.column_stack([
+            rng.uniform(-20, 50, 3000),
+            rng.uniform(-35, 35, 3000),
+        ])
+        weights = rng.randint(1, 6, 3000)
+        # the same points input one by one, in the same order
+        expanded = numpy.repeat(points, weights, axis=0)
+        plain = pysupercluster.SuperCluster(expanded, min_zoom=0, max_zoom=16, radius=40, extent=512)
+        index = pysupercluster.SuperCluster(points, min_zoom=0, max_zoom=16, radius=40, extent=512,
+                                            weights=weights)
+
+        def summary(index, zoom, **kwargs):
+            arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom, **kwargs)
+            return sorted(zip(
+                arrays['count'].tolist(),
+                numpy.round(arrays['longitude'], 6).tolist(),
+                numpy.round(arrays['latitude'], 6).tolist()))
+
+        # points at one position cluster like their weighted point on every zoom level
+        for zoom in range(0, 17):
+            self.assertEqual(summary(index, zoom), summary(plain, zoom))
+
+        # a weighted point matches with its whole weight, or with part of it
+        mask = rng.uniform(size=3000) < 0.3
+        view = index.filter(mask)
+        self.assertEqual(view.count, weights[mask].sum())
+        self.assertEqual(summary(index, 4, filter=view), summary(plain, 4, filter=plain.filter(numpy.repeat(mask, weights))))
+        counts = numpy.minimum(weights, 2) * mask
+        partial = index.filter(counts)
+        self.assertEqual(partial.count, counts.sum())
+        for zoom in (0, 8, 17):
+            arrays = index.getClustersArrays(top_left=(-180, 90), bottom_right=(180, -90), zoom=zoom, filter=partial)
+            self.assertEqual(arrays['count'].sum(), counts.sum())
+        with self.assertRaises(ValueError):
+            index.filter(weights + 1)
+        with self.assertRaises(ValueError):
+            index.filter(-mask.astype(numpy.int64))
+
+        # leaf offsets count weights; a weighted point straddling the offset is returned
+        top = max(index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=3), key=lambda c: c['count'])
+        leaves = index.getLeaves(top['id'], limit=100000)
+        self.assertEqual(sum(leaf['count'] for leaf in leaves), top['count'])
+        self.assertTrue(all(leaf['expansion_zoom'] is None for leaf in leaves))
+        offset = leaves[0]['count'] + 1
+        covered = numpy.cumsum([leaf['count'] for leaf in leaves])
+        first = int(numpy.searchsorted(covered, offset, side='right'))
+        self.assertEqual(index.getLeaves(top['id'], limit=3, offset=offset), leaves[first:first + 3])
+
+        # a filtered cluster left with one weighted point expands past the last zoom level
+        single = [cluster for cluster in index.getClusters(top_left=(-180, 90), bottom_right=(180, -90), zoom=10,
+                                                           filter=view)
+                  if cluster['expansion_zoom'] is not None and cluster['count'] > 1
+                  and len(index.getLeaves(cluster['id'], limit=2, filter=view)) == 1]
+        self.assertTrue(single)
+        for cluster in single:
+            self.assertEqual(index.getClusterExpansionZoom(cluster['id'], filter=view), 17)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            index.save(path)
+            loaded = pysupercluster.SuperCluster.load(path)
+        self.assertEqual(summary(loaded, 5), summary(index, 5))
+        self.assertEqual(loaded.getLeaves(top['id'], limit=100000), leaves)
+
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, weights=weights[:10])
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, weights=numpy.zeros(3000, dtype=numpy.int64))
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points[:2], weights=[2 ** 31, 2 ** 31])
+        with self.assertRaises(TypeError):
+            pysupercluster.SuperCluster(points, weights=numpy.ones(3000))
+
+    def test_load_invalid(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            with self.assertRaises(FileNotFoundError):
+                pysupercluster.SuperCluster.load(path)
+
+            with open(path, 'wb') as f:
+                f.write(b'not an index' * 100)
+            with self.assertRaises(ValueError):
+                pysupercluster.SuperCluster.load(path)
+
+            # truncated file
+            pysupercluster.SuperCluster(numpy.ones((10, 2))).save(path)
+            with open(path, 'rb+') as f:
+                f.truncate(os.path.getsize(path) - 8)
+            with self.assertRaises(ValueError):
+                pysupercluster.SuperCluster.load(path)
+
+    def test_invalid_threads(self):
+        points = numpy.ones((1, 2))
+
+        with self.assertRaises(ValueError):
+            pysupercluster.SuperCluster(points, threads=-1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+"""
+Per-key single-flight coordination for expensive builds
+"""
+import threading
+import logging
+from typing import Dict, Any, Callable, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """An in-flight call and the threads waiting on it"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is running block and receive the same result. If the function raises,
+    every waiter receives the same exception and the key is released, so
+    the next call retries instead of seeing a cached failure.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        Run fn once per key among concurrent callers
+
+        Args:
+            key: Key identifying the work
+            fn: Function to run
+            *args, **kwargs: Arguments passed to fn
+
+        Returns:
+            Tuple of (result, shared) where shared is True if this caller
+            waited on another caller's execution
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            logger.debug(f"Waiting on in-flight build for key: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def in_flight(self) -> Dict[str, int]:
+        """Return the keys currently being built and their waiter counts"""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
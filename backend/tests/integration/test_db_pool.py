@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Integration test for the database connection pool
+Runs against the database configured in .env.local, or any local MySQL/MariaDB
+(e.g. `docker run -e MARIADB_ALLOW_EMPTY_ROOT_PASSWORD=1 -p 3306:3306 mariadb`)
+"""
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import pymysql
+import pytest
+
+# Add parent directory to path to import the modules if needed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Load environment variables from .env.local file in the project root
+env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env.local')
+load_dotenv(env_path)
+
+import db
+from db_pool import ConnectionPool
+
+@pytest.fixture
+def pool():
+    """Fixture to provide a small pool over the configured database"""
+    try:
+        db.get_connection().close()
+    except pymysql.err.MySQLError as e:
+        pytest.skip(f"No database available: {e}")
+    
+    pool = ConnectionPool(db.get_connection, size=2, timeout=10, ping_interval=0)
+    yield pool
+    pool.close()
+
+def test_connections_are_reused(pool):
+    """Test that sequential queries share one server connection"""
+    thread_ids = set()
+    for _ in range(5):
+        with pool.connection() as connection:
+            thread_ids.add(connection.thread_id())
+    
+    assert len(thread_ids) == 1
+    assert pool.get_stats()["connects"] == 1
+
+def test_killed_connection_is_replaced(pool):
+    """Test that the health check replaces a connection the server closed"""
+    connection = pool.acquire()
+    other = pool.acquire()
+    victim = connection.thread_id()
+    pool.release(connection)
+    
+    with other.cursor() as cursor:
+        cursor.execute("KILL %s", (victim,))
+    with pool.connection() as replacement:
+        assert replacement.thread_id() not in (victim, other.thread_id())
+    pool.release(other)
+    
+    assert pool.get_stats()["health_check_failures"] >= 1
+
+def test_concurrent_queries_from_executor(pool):
+    """Test that executor threads share the bounded pool"""
+    def query(i):
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT %s AS value, SLEEP(0.05)", (i,))
+                return cursor.fetchone()["value"]
+    
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        assert list(executor.map(query, range(12))) == list(range(12))
+    
+    stats = pool.get_stats()
+    assert stats["open"] <= 2
+    assert stats["waits"] > 0
@@ -13,8 +13,10 @@ import numpy as np
 # Add parent directory to path to import the modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from main import app
+from main import app, API_KEY, API_KEY_NAME
+from index_manager import IndexGeneration
 from .test_index_manager import MockSuperCluster, SAMPLE_GEOJSON
+from .test_mvt import decode_tile
 
 # Create a TestClient for the FastAPI app
 client = TestClient(app)
@@ -34,20 +36,85 @@ class MockSuperCluster:
                 'expansion_zoom': zoom + 1,
                 'longitude': 0.5,
                 'latitude': 0.5
+            },
+            {
+                'id': 0,
+                'count': 1,
+                'expansion_zoom': None,
+                'longitude': 0.0,
+                'latitude': 0.0
             }
         ]
+    
+    def getClustersArrays(self, top_left, bottom_right, zoom):
+        clusters = self.getClusters(top_left, bottom_right, zoom)
+        return {
+            'longitude': np.array([c['longitude'] for c in clusters], dtype=np.float64),
+            'latitude': np.array([c['latitude'] for c in clusters], dtype=np.float64),
+            'count': np.array([c['count'] for c in clusters], dtype=np.int64),
+            'id': np.array([c['id'] for c in clusters], dtype=np.int64),
+            'expansion_zoom': np.array([-1 if c['expansion_zoom'] is None else c['expansion_zoom']
+                                        for c in clusters], dtype=np.int32)
+        }
+    
+    def getChildren(self, cluster_id):
+        if cluster_id != 1:
+            raise ValueError("No cluster with the specified id.")
+        return [
+            {'id': 0, 'count': 1, 'expansion_zoom': None, 'longitude': 0.0, 'latitude': 0.0},
+            {'id': 9, 'count': 3, 'expansion_zoom': 7, 'longitude': 1.0, 'latitude': 1.0}
+        ]
+    
+    def getLeaves(self, cluster_id, limit=10, offset=0):
+        self.getChildren(cluster_id)
+        leaves = [{'id': i, 'count': 1, 'expansion_zoom': None, 'longitude': 0.0, 'latitude': 0.0}
+                  for i in range(2)]
+        return leaves[offset:offset + limit]
+    
+    def getClusterExpansionZoom(self, cluster_id):
+        self.getChildren(cluster_id)
+        return 6
+    
+    def getTile(self, z, x, y):
+        tile = self.getClustersArrays(None, None, z)
+        tile['x'] = np.array([256, 0], dtype=np.int32)
+        tile['y'] = np.array([256, 512], dtype=np.int32)
+        return tile
+
+class MockLayerSuperCluster(MockSuperCluster):
+    """Index built with layer attributes: the cluster holds one graduate and two featured points"""
+    def getClustersArrays(self, top_left, bottom_right, zoom):
+        arrays = super().getClustersArrays(top_left, bottom_right, zoom)
+        arrays['sum'] = np.array([[1.0, 2.0, 0.0], [1.0, 1.0, 0.0]])
+        return arrays
 
 class MockIndexManager:
     def __init__(self):
         self.calls = []
-        self.indexes = {}
+        self.generations = {}
+        self.layer_names = []
+    
+    def get_cached_generation(self, filters=None):
+        self.calls.append(('get_cached_generation', filters))
+        return self.generations.get('test_key')
+    
+    def get_generation(self, filters=None, force_refresh=False):
+        self.calls.append(('get_generation', filters))
+        generation_id = len(self.generations) + 1
+        self.generations['test_key'] = IndexGeneration(
+            'test_key', generation_id, MockSuperCluster(), SAMPLE_GEOJSON, f'W/"test-{generation_id}"')
+        return self.generations['test_key']
     
     def get_index(self, filters=None, force_refresh=False):
-        self.calls.append(('get_index', filters))
-        return 'test_key', MockSuperCluster()
+        generation = self.get_generation(filters, force_refresh)
+        return generation.key, generation.index
+    
+    def get_generation_by_key(self, index_key):
+        return self.generations.get(index_key)
     
-    def get_original_features(self, index_key):
-        return SAMPLE_GEOJSON
+    extent = 512
+    min_zoom = 0
+    max_zoom = 16
     
     def get_stats(self):
         return {
@@ -112,5 +179,165 @@ def test_api_error_cases():
     })
     assert response.status_code == 422
 
+def test_get_clusters_cold_then_cached(mock_index_manager):
+    """Test that cold filters build in the executor and cached ones are answered inline"""
+    params = {"west": -180, "south": -85, "east": 180, "north": 85, "zoom": 4}
+    headers = {API_KEY_NAME: API_KEY}
+    
+    response = client.get("/api/getClusters", params=params, headers=headers)
+    assert response.status_code == 200
+    assert [c[0] for c in mock_index_manager.calls] == ['get_cached_generation', 'get_generation']
+    
+    mock_index_manager.calls.clear()
+    response = client.get("/api/getClusters", params=params, headers=headers)
+    assert response.status_code == 200
+    assert [c[0] for c in mock_index_manager.calls] == ['get_cached_generation']
+    features = response.json()["features"]
+    assert features[0]["properties"] == {
+        "cluster": True,
+        "cluster_id": "1",
+        "point_count": 2,
+        "point_count_abbreviated": 2,
+        "expansion_zoom": 5
+    }
+    assert features[1] == SAMPLE_GEOJSON[0]
+
+def test_get_clusters_layer_counts(mock_index_manager):
+    """Test that clusters report layer counts on request, and only when enabled"""
+    params = {"west": -180, "south": -85, "east": 180, "north": 85, "zoom": 4, "include_layer_counts": True}
+    headers = {API_KEY_NAME: API_KEY}
+    
+    assert client.get("/api/getClusters", params=params, headers=headers).status_code == 400
+    
+    mock_index_manager.layer_names = ['graduate-points', 'featured-points', 'entrepreneur-points']
+    mock_index_manager.generations['test_key'] = IndexGeneration(
+        'test_key', 1, MockLayerSuperCluster(), SAMPLE_GEOJSON, 'W/"test-1"')
+    features = client.get("/api/getClusters", params=params, headers=headers).json()["features"]
+    assert features[0]["properties"]["layer_counts"] == {
+        'graduate-points': 1, 'featured-points': 2, 'entrepreneur-points': 0
+    }
+    assert features[1] == SAMPLE_GEOJSON[0]
+    
+    # Counts are opt-in per request
+    params["include_layer_counts"] = False
+    features = client.get("/api/getClusters", params=params, headers=headers).json()["features"]
+    assert "layer_counts" not in features[0]["properties"]
+
+def test_get_tile(mock_index_manager):
+    """Test that tiles are encoded as cacheable vector tiles"""
+    headers = {API_KEY_NAME: API_KEY}
+    
+    response = client.get("/api/tiles/4/8/5.mvt", params={"gender": "female"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert mock_index_manager.calls[-1] == ('get_generation', {'gender': 'female'})
+    assert response.headers["etag"] == 'W/"test-1"'
+    
+    layer = decode_tile(response.content)["clusters"]
+    assert layer["extent"] == 512
+    assert [f["geometry"] for f in layer["features"]] == [(256, 256), (0, 512)]
+    assert layer["features"][0]["id"] == 1
+    assert layer["features"][0]["properties"] == {
+        "cluster": True,
+        "cluster_id": "1",
+        "point_count": 2,
+        "point_count_abbreviated": 2,
+        "expansion_zoom": 5
+    }
+    expected = {k: v for k, v in SAMPLE_GEOJSON[0]["properties"].items() if v is not None}
+    assert layer["features"][1]["properties"] == expected
+
+def test_get_tile_revalidation(mock_index_manager):
+    """Test that a tile of the current generation revalidates with 304 and a new generation misses"""
+    headers = {API_KEY_NAME: API_KEY}
+    
+    etag = client.get("/api/tiles/4/8/5.mvt", headers=headers).headers["etag"]
+    response = client.get("/api/tiles/4/8/5.mvt", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    
+    mock_index_manager.generations['test_key'] = IndexGeneration(
+        'test_key', 2, MockSuperCluster(), SAMPLE_GEOJSON, 'W/"test-2"')
+    response = client.get("/api/tiles/4/8/5.mvt", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == 'W/"test-2"'
+    assert response.content
+
+def test_get_tile_versioned_urls(mock_index_manager):
+    """Test that only tile URLs naming the current data version are cached without revalidation"""
+    headers = {API_KEY_NAME: API_KEY}
+    
+    response = client.get("/api/tiles.json", params={"is_featured": True}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-store"
+    tilejson = response.json()
+    assert tilejson["version"] == "test-1"
+    assert tilejson["tiles"] == ["http://testserver/api/tiles/{z}/{x}/{y}.mvt?is_featured=true&v=test-1"]
+    assert (tilejson["minzoom"], tilejson["maxzoom"]) == (0, 16)
+    
+    url = tilejson["tiles"][0].format(z=4, x=8, y=5)
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "private, max-age=86400, immutable"
+    
+    # After a rebuild the old URL still answers, but must be revalidated
+    mock_index_manager.generations['test_key'] = IndexGeneration(
+        'test_key', 2, MockSuperCluster(), SAMPLE_GEOJSON, 'W/"test-2"')
+    response = client.get(url, headers=headers)
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert response.headers["etag"] == 'W/"test-2"'
+    assert client.get("/api/tiles.json", headers=headers).json()["version"] == "test-2"
+
+def test_get_tile_out_of_range():
+    """Test that tile coordinates are validated"""
+    headers = {API_KEY_NAME: API_KEY}
+    
+    assert client.get("/api/tiles/2/4/0.mvt", headers=headers).status_code == 400
+    assert client.get("/api/tiles/-1/0/0.mvt", headers=headers).status_code == 422
+
+def test_load_invalid_zooms():
+    """Test that zoom ranges the extension cannot build are rejected"""
+    features = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [0.0, 0.0]}, "properties": {}}]
+    
+    response = client.post("/api/load/zooms", json={"features": features, "options": {"minZoom": -1}})
+    assert response.status_code == 422
+    response = client.post("/api/load/zooms", json={"features": features, "options": {"maxZoom": 31}})
+    assert response.status_code == 422
+    response = client.post("/api/load/zooms", json={"features": features, "options": {"minZoom": 5, "maxZoom": 3}})
+    assert response.status_code == 400
+    
+    response = client.post("/api/load/zooms", json={"features": features, "options": {"minZoom": 2, "maxZoom": 3}})
+    assert response.status_code == 200
+
+def test_drill_down(mock_index_manager):
+    """Test getChildren, getLeaves and getClusterExpansionZoom on a cached filter index"""
+    mock_index_manager.get_index({})
+    
+    response = client.post("/api/getChildren/test_key", json={"clusterId": "1"})
+    assert response.status_code == 200
+    features = response.json()["features"]
+    assert features[0] == SAMPLE_GEOJSON[0]
+    assert features[1]["properties"]["cluster_id"] == "9"
+    assert features[1]["properties"]["expansion_zoom"] == 7
+    
+    response = client.post("/api/getLeaves/test_key", json={"clusterId": "1", "limit": 1, "offset": 1})
+    assert response.status_code == 200
+    assert response.json()["features"] == [SAMPLE_GEOJSON[1]]
+    
+    response = client.post("/api/getClusterExpansionZoom/test_key", json={"clusterId": "1"})
+    assert response.status_code == 200
+    assert response.json() == {"expansion_zoom": 6}
+
+def test_drill_down_errors(mock_index_manager):
+    """Test unknown indexes, unknown clusters and malformed ids"""
+    assert client.post("/api/getChildren/missing", json={"clusterId": "1"}).status_code == 404
+    
+    mock_index_manager.get_index({})
+    assert client.post("/api/getChildren/test_key", json={"clusterId": "2"}).status_code == 404
+    assert client.post("/api/getLeaves/test_key", json={"clusterId": "2"}).status_code == 404
+    assert client.post("/api/getClusterExpansionZoom/test_key", json={"clusterId": "x"}).status_code == 400
+
 if __name__ == "__main__":
     test_api() 
\ No newline at end of file
@@ -0,0 +1,53 @@
+import pytest
+import sys
+import os
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_policy import IndexCachePolicy
+
+MB = 1024 * 1024
+
+def test_unbounded_policy_never_evicts():
+    """Test that a policy without bounds keeps everything"""
+    policy = IndexCachePolicy()
+    for i in range(100):
+        policy.record_build(f"key{i}", 10, 0.1, MB)
+    
+    assert policy.select_victims({}, now=1000.0) == []
+
+def test_entry_bound_evicts_least_valuable():
+    """Test that cheap, stale entries go before expensive, recent ones"""
+    policy = IndexCachePolicy(max_entries=2)
+    policy.record_build("cheap_old", 100, 0.01, MB)
+    policy.record_build("cheap_new", 100, 0.01, MB)
+    policy.record_build("costly_old", 100000, 5.0, MB)
+    last_accessed = {"cheap_old": 0.0, "cheap_new": 990.0, "costly_old": 0.0}
+    
+    assert policy.select_victims(last_accessed, now=1000.0) == ["cheap_old"]
+
+def test_memory_bound():
+    """Test eviction by memory budget"""
+    policy = IndexCachePolicy(max_memory_mb=3)
+    for i in range(5):
+        policy.record_build(f"key{i}", 10, 0.1, MB)
+    last_accessed = {f"key{i}": float(i) for i in range(5)}
+    
+    assert policy.select_victims(last_accessed, now=10.0) == ["key0", "key1"]
+
+def test_pinned_keys_are_kept():
+    """Test that pinned entries are neither evicted nor counted"""
+    policy = IndexCachePolicy(max_entries=1, max_memory_mb=1)
+    policy.record_build("all", 10, 0.1, 100 * MB)
+    policy.record_build("key", 10, 0.1, MB // 2)
+    
+    assert policy.select_victims({}, now=10.0) == []
+    
+    policy.record_build("other", 10, 0.1, MB // 2)
+    assert policy.select_victims({"key": 1.0, "other": 9.0}, now=10.0) == ["key"]
+    
+    policy.record_eviction("key")
+    stats = policy.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["recent_evictions"][0]["key"] == "key"
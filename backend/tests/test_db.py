@@ -7,9 +7,16 @@ from typing import Dict, List, Any
 # Add parent directory to path to import the modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import pymysql
+
+import db
 from db import (
     execute_query,
     load_learner_points,
+    load_learner_store,
+    load_learner_changes,
+    LoadProgress,
+    LEARNER_COLUMNS,
     convert_to_geojson,
     generate_filter_key
 )
@@ -56,6 +63,13 @@ def mock_db_connection():
         
         yield mock_conn
 
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    """Give every test its own connection pool"""
+    db.close_pool()
+    yield
+    db.close_pool()
+
 @patch('db.get_connection')
 def test_execute_query(mock_get_connection):
     """Test the execute_query function"""
@@ -72,7 +86,26 @@ def test_execute_query(mock_get_connection):
     # Verify results
     assert result == SAMPLE_DB_POINTS
     mock_cursor.execute.assert_called_once()
+    
+    # The connection goes back to the pool and is reused by the next query
+    mock_connection.close.assert_not_called()
+    execute_query("SELECT * FROM test_table")
+    mock_get_connection.assert_called_once()
+    assert db.get_pool_stats()["acquires"] == 2
+    assert db.get_pool_stats()["idle"] == 1
+
+@patch('db.get_connection')
+def test_execute_query_error_discards_connection(mock_get_connection):
+    """Test that a connection which raised is closed instead of reused"""
+    mock_connection = MagicMock()
+    mock_connection.cursor.return_value.__enter__.return_value.execute.side_effect = pymysql.err.OperationalError(2013, "Lost connection")
+    mock_get_connection.return_value = mock_connection
+    
+    with pytest.raises(pymysql.err.OperationalError):
+        execute_query("SELECT 1")
+    
     mock_connection.close.assert_called_once()
+    assert db.get_pool_stats()["open"] == 0
 
 @patch('db.execute_query')
 def test_load_learner_points_no_filters(mock_execute_query):
@@ -114,6 +147,102 @@ def test_load_learner_points_with_filters(mocker):
         assert len(result) == 1
         assert result[0]['id'] == 1
 
+@patch('db.get_connection')
+def test_load_learner_store(mock_get_connection):
+    """Test streaming learner points into a feature store in chunks, without counting them first"""
+    rows = [
+        tuple(dict(point, full_name=None).get(column) for column in LEARNER_COLUMNS)
+        for point in SAMPLE_DB_POINTS * 3
+    ]
+    stream_cursor = MagicMock()
+    stream_cursor.fetchmany.side_effect = [rows[:4], rows[4:], []]
+    mock_connection = MagicMock()
+    mock_connection.cursor.return_value.__enter__.side_effect = [stream_cursor]
+    mock_get_connection.return_value = mock_connection
+    
+    progress = LoadProgress()
+    store = load_learner_store(filters={'gender': 'female'}, chunk_size=4, progress=progress)
+    
+    # Rows are read from a server-side cursor in chunks of chunk_size
+    assert mock_connection.cursor.call_args_list[0][0] == (pymysql.cursors.SSCursor,)
+    assert stream_cursor.execute.call_count == 1
+    stream_cursor.fetchmany.assert_called_with(4)
+    query, params = stream_cursor.execute.call_args[0]
+    assert "gender = %s" in query and "LIMIT %s" in query
+    assert params[0] == 'female'
+    assert db.get_pool_stats()["in_use"] == 0
+    
+    assert len(store) == 6
+    assert list(store.view()) == convert_to_geojson([dict(p, full_name=None) for p in SAMPLE_DB_POINTS * 3])
+    assert progress.as_dict()['rows_loaded'] == 6
+    assert progress.as_dict()['percent'] == 100.0
+    assert not progress.as_dict()['running']
+
+@patch('db.get_connection')
+def test_load_learner_store_estimate(mock_get_connection):
+    """Test that an unfiltered load reports progress against the table's row estimate"""
+    rows = [
+        tuple(dict(point, full_name=None).get(column) for column in LEARNER_COLUMNS)
+        for point in SAMPLE_DB_POINTS * 3
+    ]
+    estimate_cursor = MagicMock()
+    estimate_cursor.fetchone.return_value = {'count': 4}
+    stream_cursor = MagicMock()
+    seen = []
+    def fetch(size):
+        seen.append(progress.as_dict())
+        return [rows[:4], rows[4:], []][len(seen) - 1]
+    stream_cursor.fetchmany.side_effect = fetch
+    mock_connection = MagicMock()
+    mock_connection.cursor.return_value.__enter__.side_effect = [estimate_cursor, stream_cursor]
+    mock_get_connection.return_value = mock_connection
+    
+    progress = LoadProgress()
+    store = load_learner_store(chunk_size=4, progress=progress)
+    
+    query, params = estimate_cursor.execute.call_args[0]
+    assert "information_schema.TABLES" in query and "COUNT" not in query
+    assert len(store) == 6
+    
+    # The estimate is low: progress stops at 100% until the load finishes with the exact count
+    assert [s['percent'] for s in seen] == [0.0, 100.0, 100.0]
+    assert all(s['rows_expected_approximate'] for s in seen)
+    final = progress.as_dict()
+    assert (final['rows_expected'], final['rows_expected_approximate'], final['percent']) == (6, False, 100.0)
+
+@patch('db.get_connection')
+def test_load_learner_changes(mock_get_connection):
+    """Test loading changed rows and skipping those already applied at the watermark"""
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = [
+        ('user1', None, 'Kenya', 1.0, 2.0, 'female', 1, 0, 0, 0, 0, 5),
+        ('user2', None, 'Kenya', None, None, 'male', 1, 0, 0, 0, 0, 5),
+        ('user3', None, 'Ghana', 3.0, 4.0, 'male', 0, 0, 0, 0, 0, 7),
+        ('user4', None, 'Ghana', 3.0, 4.0, 'male', 0, 0, 0, 0, 0, 7)
+    ]
+    mock_connection = MagicMock()
+    mock_connection.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_get_connection.return_value = mock_connection
+    
+    rows, watermark, seen = load_learner_changes('updated_at', 5, {'user1'})
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert "updated_at >= %s" in query and "ORDER BY" in query
+    assert params == (5,)
+    assert [row[0] for row in rows] == ['user2', 'user3', 'user4']
+    assert len(rows[0]) == len(LEARNER_COLUMNS)
+    assert (watermark, seen) == (7, {'user3', 'user4'})
+    
+    with pytest.raises(ValueError):
+        load_learner_changes('updated_at; DROP TABLE x', 5)
+    
+    # Without a watermark (empty table at the full load) every row is read
+    rows, watermark, seen = load_learner_changes('updated_at', None)
+    query, params = mock_cursor.execute.call_args[0]
+    assert "updated_at IS NOT NULL" in query and params == ()
+    assert [row[0] for row in rows] == ['user1', 'user2', 'user3', 'user4']
+    assert (watermark, seen) == (7, {'user3', 'user4'})
+
 def test_convert_to_geojson():
     """Test converting database points to GeoJSON format"""
     # Call function
@@ -0,0 +1,136 @@
+import pytest
+import sys
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+def make_pool(**kwargs):
+    """Create a pool over mock connections"""
+    connect = MagicMock(side_effect=lambda: MagicMock(open=True))
+    return ConnectionPool(connect, **kwargs), connect
+
+def test_reuses_released_connections():
+    """Test that released connections are handed out again"""
+    pool, connect = make_pool(size=2)
+    
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    
+    assert first is second
+    assert connect.call_count == 1
+    assert pool.get_stats()["acquires"] == 2
+    assert pool.get_stats()["idle"] == 1
+
+def test_size_is_bounded():
+    """Test that callers beyond the pool size wait for a release"""
+    pool, connect = make_pool(size=1, timeout=5)
+    connection = pool.acquire()
+    
+    def release_later():
+        time.sleep(0.05)
+        pool.release(connection)
+    
+    thread = threading.Thread(target=release_later)
+    thread.start()
+    assert pool.acquire() is connection
+    thread.join()
+    
+    stats = pool.get_stats()
+    assert connect.call_count == 1
+    assert stats["waits"] == 1
+    assert stats["wait_time_seconds"] > 0
+    assert stats["in_use"] == 1
+
+def test_timeout():
+    """Test that acquire gives up when every connection stays in use"""
+    pool, _ = make_pool(size=1)
+    pool.acquire()
+    
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.01)
+    assert pool.get_stats()["timeouts"] == 1
+
+def test_error_discards_connection():
+    """Test that a connection is closed if the with block raises"""
+    pool, connect = make_pool(size=1)
+    
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError("query failed")
+    
+    connection.close.assert_called_once()
+    assert pool.get_stats()["open"] == 0
+    with pool.connection() as replacement:
+        assert replacement is not connection
+
+def test_failed_connect_frees_slot():
+    """Test that a failed connect does not leak a pool slot"""
+    pool = ConnectionPool(MagicMock(side_effect=OSError("refused")), size=1)
+    
+    for _ in range(2):
+        with pytest.raises(OSError):
+            pool.acquire(timeout=0.01)
+    assert pool.get_stats()["open"] == 0
+
+def test_health_check_replaces_dead_connection():
+    """Test that idle connections failing a ping are replaced"""
+    pool, connect = make_pool(size=1, ping_interval=0)
+    with pool.connection() as dead:
+        pass
+    dead.ping.side_effect = OSError("server has gone away")
+    
+    with pool.connection() as connection:
+        assert connection is not dead
+    
+    dead.close.assert_called_once()
+    assert connect.call_count == 2
+    assert pool.get_stats()["health_check_failures"] == 1
+
+def test_concurrent_use():
+    """Test that concurrent threads never hold more than size connections"""
+    pool, connect = make_pool(size=3)
+    in_use = []
+    lock = threading.Lock()
+    active = [0]
+    
+    def work():
+        for _ in range(20):
+            with pool.connection():
+                with lock:
+                    active[0] += 1
+                    in_use.append(active[0])
+                time.sleep(0.001)
+                with lock:
+                    active[0] -= 1
+    
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert max(in_use) <= 3
+    assert connect.call_count <= 3
+    assert pool.get_stats()["acquires"] == 160
+    assert pool.get_stats()["in_use"] == 0
+
+def test_close():
+    """Test that closing the pool closes idle connections"""
+    pool, _ = make_pool(size=2)
+    with pool.connection() as connection:
+        pass
+    
+    pool.close()
+    
+    connection.close.assert_called_once()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
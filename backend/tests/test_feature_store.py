@@ -0,0 +1,181 @@
+import pytest
+import sys
+import os
+import numpy as np
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import convert_to_geojson
+from feature_store import FeatureStore, FeatureStoreBuilder, StringColumn, CategoricalColumn, NULL_CODE
+
+# Sample data returned from database
+SAMPLE_DB_POINTS = [
+    {
+        'hashed_email': 'user1',
+        'full_name': 'Amára Ñoño',
+        'country_of_residence': 'Kenya',
+        'latitude': 1.2921,
+        'longitude': 36.8219,
+        'gender': 'female',
+        'is_graduate_learner': 1,
+        'is_wage_employed': 0,
+        'is_running_a_venture': 1,
+        'is_featured': 0,
+        'is_featured_video': None
+    },
+    {
+        'hashed_email': 'user2',
+        'full_name': None,
+        'country_of_residence': None,
+        'latitude': None,
+        'longitude': 8.6753,
+        'gender': 'male',
+        'is_graduate_learner': 1,
+        'is_wage_employed': 1,
+        'is_running_a_venture': 0,
+        'is_featured': 1,
+        'is_featured_video': 0
+    },
+    {
+        'hashed_email': 'user3',
+        'full_name': None,
+        'country_of_residence': 'Nigeria',
+        'latitude': 9.0820,
+        'longitude': 8.6753,
+        'gender': None,
+        'is_graduate_learner': 0,
+        'is_wage_employed': 1,
+        'is_running_a_venture': 0,
+        'is_featured': 1,
+        'is_featured_video': 1
+    }
+]
+
+def test_features_match_convert_to_geojson():
+    """Test that features built from the store match convert_to_geojson"""
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    
+    assert len(store) == 2
+    assert list(store.view()) == convert_to_geojson(SAMPLE_DB_POINTS)
+
+def test_column_types():
+    """Test the column encodings used by the store"""
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    
+    assert store.coordinates.dtype == np.float64
+    assert store.coordinates.shape == (2, 2)
+    assert store.flags['is_featured_video'].dtype == np.int8
+    assert list(store.flags['is_featured_video']) == [NULL_CODE, 1]
+    assert store.categoricals['gender'].categories == ['female']
+    assert list(store.categoricals['gender'].codes) == [0, NULL_CODE]
+
+def test_string_column():
+    """Test the offsets-based string column"""
+    column = StringColumn.from_values(['abc', None, '', 'Ñoño'])
+    
+    assert len(column) == 4
+    assert [column[i] for i in range(4)] == ['abc', None, '', 'Ñoño']
+    assert list(column.offsets) == [0, 3, 3, 3, 9]
+
+def test_categorical_column():
+    """Test the dictionary-encoded categorical column"""
+    column = CategoricalColumn.from_values(['Kenya', 'Nigeria', 'Kenya', None])
+    
+    assert list(column.codes) == [0, 1, 0, NULL_CODE]
+    assert column.code_of('Nigeria') == 1
+    assert column.code_of('Ghana') is None
+    assert column[2] == 'Kenya'
+    assert column[3] is None
+
+def test_builder_chunks_match_from_points():
+    """Test that appending rows in chunks past the initial capacity matches from_points"""
+    columns = list(SAMPLE_DB_POINTS[0])
+    points = SAMPLE_DB_POINTS * 5
+    rows = [tuple(point[column] for column in columns) for point in points]
+    
+    builder = FeatureStoreBuilder(columns, capacity=2)
+    for start in range(0, len(rows), 4):
+        builder.append(rows[start:start + 4])
+    store = builder.finish()
+    expected = FeatureStore.from_points(points)
+    
+    assert len(store) == 10
+    assert list(store.view()) == list(expected.view())
+    assert store.categoricals['country_of_residence'].categories == ['Kenya', 'Nigeria']
+    assert list(store.ids.offsets) == list(expected.ids.offsets)
+
+def test_builder_without_string_columns():
+    """Test that missing id and name columns are stored as empty strings"""
+    builder = FeatureStoreBuilder(['latitude', 'longitude'])
+    builder.append([(1.5, 2.5), (0, 3.0)])
+    store = builder.finish()
+    
+    assert len(store) == 1
+    assert store.coordinates.tolist() == [[2.5, 1.5]]
+    assert store.view()[0]['properties'] == {'id': '', 'full_name': ''}
+
+def test_string_column_find():
+    """Test looking up rows by value"""
+    column = StringColumn.from_values(['abc', None, 'de', 'abc', 'Ñoño'])
+    
+    assert list(column.find(['abc', 'Ñoño', 'missing'])) == [0, 3, 4]
+    assert list(column.find([])) == []
+
+def test_apply_changes():
+    """Test applying updated, inserted and deleted rows to a copy of the store"""
+    columns = list(SAMPLE_DB_POINTS[0])
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS + [dict(SAMPLE_DB_POINTS[0], hashed_email='user4')])
+    changes = [
+        tuple(dict(SAMPLE_DB_POINTS[2], gender='female', country_of_residence='Ghana')[c] for c in columns),
+        tuple(dict(SAMPLE_DB_POINTS[0], latitude=None)[c] for c in columns),
+        tuple(dict(SAMPLE_DB_POINTS[0], hashed_email='user5', full_name='New')[c] for c in columns)
+    ]
+    
+    updated, row_map = store.apply_changes(columns, changes)
+    
+    assert list(row_map) == [-1, -1, 0]
+    assert [f['properties']['id'] for f in updated.view()] == ['user4', 'user3', 'user5']
+    assert updated.view()[1]['properties']['country'] == 'Ghana'
+    assert updated.view()[2]['properties']['full_name'] == 'New'
+    assert updated.categoricals['country_of_residence'].categories == ['Kenya', 'Nigeria', 'Ghana']
+    assert updated.view()[0] == store.view()[2]
+    assert len(store) == 3
+
+def test_filtered_view():
+    """Test that views index into the store without copying rows"""
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    view = store.view(np.array([1], dtype=np.int64))
+    
+    assert len(view) == 1
+    assert view.store is store
+    assert view[0]['properties']['id'] == 'user3'
+    assert view.coordinates().tolist() == [[8.6753, 9.0820]]
+    with pytest.raises(IndexError):
+        view[1]
+
+def test_empty_store():
+    """Test building a store without valid rows"""
+    store = FeatureStore.from_points([])
+    
+    assert len(store) == 0
+    assert store.coordinates.shape == (0, 2)
+    assert len(store.view()) == 0
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load(tmp_path, mmap):
+    """Test that a saved store loads back with identical features"""
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    store.save(str(tmp_path))
+    
+    loaded = FeatureStore.load(str(tmp_path), mmap=mmap)
+    
+    assert list(loaded.view()) == list(store.view())
+    assert loaded.categoricals['gender'].code_of('male') == store.categoricals['gender'].code_of('male')
+    assert isinstance(loaded.coordinates, np.memmap) == mmap
+
+def test_save_load_empty_store(tmp_path):
+    """Test saving a store without rows"""
+    FeatureStore.from_points([]).save(str(tmp_path))
+    
+    assert len(FeatureStore.load(str(tmp_path))) == 0
@@ -0,0 +1,76 @@
+import pytest
+import sys
+import os
+import numpy as np
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_store import FeatureStore
+from filter_engine import BitmapFilterEngine
+
+def make_points(count):
+    """Generate deterministic learner rows"""
+    genders = ['female', 'male', None]
+    countries = ['Kenya', 'Nigeria', 'Ghana', 'Egypt']
+    return [
+        {
+            'hashed_email': f'user{i}',
+            'full_name': f'Learner {i}',
+            'country_of_residence': countries[i % 4],
+            'latitude': 1.0 + i * 0.001,
+            'longitude': 30.0 + i * 0.001,
+            'gender': genders[i % 3],
+            'is_graduate_learner': i % 2,
+            'is_wage_employed': (i // 2) % 2,
+            'is_running_a_venture': None if i % 5 == 0 else (i // 3) % 2,
+            'is_featured': int(i % 7 == 0),
+            'is_featured_video': 0
+        }
+        for i in range(count)
+    ]
+
+def python_filter(points, filters):
+    """Reference implementation: the original per-feature filter loop"""
+    result = []
+    for i, point in enumerate(points):
+        include = True
+        for key, value in filters.items():
+            expected = (1 if value else 0) if isinstance(value, bool) else value
+            if point.get(key) != expected:
+                include = False
+                break
+        if include:
+            result.append(i)
+    return result
+
+@pytest.fixture
+def engine():
+    return BitmapFilterEngine(FeatureStore.from_points(make_points(1000)))
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {'gender': 'female'},
+    {'country_of_residence': 'Kenya', 'is_graduate_learner': True},
+    {'is_running_a_venture': False},
+    {'gender': 'male', 'is_wage_employed': True, 'is_featured': True},
+    {'country_of_residence': 'Ghana', 'is_featured_video': True},
+])
+def test_select_matches_python_filter(engine, filters):
+    """Test bitmap selection against the reference filter loop"""
+    expected = python_filter(make_points(1000), filters)
+    assert engine.select(filters).tolist() == expected
+
+def test_unknown_value(engine):
+    """Test that an unknown categorical value matches nothing"""
+    assert len(engine.select({'country_of_residence': 'Atlantis'})) == 0
+
+def test_select_restricted_rows(engine):
+    """Test restricting a selection to a subset of rows"""
+    rows = np.arange(0, 1000, 10)
+    selected = engine.select({'is_graduate_learner': False}, rows)
+    assert selected.tolist() == rows.tolist()
+
+def test_bitmaps_are_packed(engine):
+    """Test that bitmaps use one bit per row"""
+    assert engine.bitmaps[('gender', 'female')].nbytes == 125
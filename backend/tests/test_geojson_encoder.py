@@ -0,0 +1,127 @@
+import pytest
+import sys
+import os
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ClusterResponse, cluster_feature
+from feature_store import FeatureStore
+from geojson_encoder import encode_cluster_response, enable_fragments, get_fragments, FeatureFragments
+
+POINTS = [
+    {'hashed_email': 'user1', 'full_name': 'Zoë Ndlovu', 'country_of_residence': 'Kenya', 'latitude': 1.2921,
+     'longitude': 36.8219, 'gender': 'Female', 'is_graduate_learner': 1, 'is_wage_employed': None,
+     'is_running_a_venture': 1, 'is_featured': 0, 'is_featured_video': 0},
+    {'hashed_email': 'user2', 'full_name': 'Ama "AJ" Mensah\\', 'country_of_residence': None, 'latitude': -0.00001,
+     'longitude': 1e-7, 'gender': 'Male', 'is_graduate_learner': 0, 'is_wage_employed': 1,
+     'is_running_a_venture': 0, 'is_featured': 1, 'is_featured_video': 0},
+    {'hashed_email': 'user3', 'full_name': None, 'country_of_residence': 'Côte d’Ivoire', 'latitude': -33.9249,
+     'longitude': 18.4241, 'gender': None, 'is_graduate_learner': 1, 'is_wage_employed': 0,
+     'is_running_a_venture': 0, 'is_featured': 0, 'is_featured_video': 1},
+]
+
+def clusters(ids, counts, expansion_zooms):
+    """Result arrays as returned by getClustersArrays"""
+    return {
+        'longitude': np.array([36.8219, 0.1 + 0.2, -179.99999999, 1e-7, 18.4241][:len(ids)]),
+        'latitude': np.array([1.2921, -0.00001, 85.0511287798, -2.5e-5, -33.9249][:len(ids)]),
+        'count': np.array(counts, dtype=np.int64),
+        'id': np.array(ids, dtype=np.int64),
+        'expansion_zoom': np.array(expansion_zooms, dtype=np.int32)
+    }
+
+# A route serialized by FastAPI through the response model, as /api/getClusters was
+model_app = FastAPI()
+served = {}
+
+@model_app.get("/clusters", response_model=ClusterResponse)
+def served_clusters():
+    return {"features": served["features"]}
+
+model_client = TestClient(model_app)
+
+def served_json(feature_list):
+    """The bytes FastAPI sends for these features from a response_model route"""
+    served["features"] = feature_list
+    return model_client.get("/clusters").content
+
+def model_json(result, features):
+    """The body FastAPI sends for the same result through the response model"""
+    return served_json([
+        cluster_feature(longitude, latitude, count, cluster_id, expansion_zoom, features)
+        for longitude, latitude, count, cluster_id, expansion_zoom in zip(
+            result['longitude'].tolist(), result['latitude'].tolist(), result['count'].tolist(),
+            result['id'].tolist(), result['expansion_zoom'].tolist())
+    ])
+
+RESULT = clusters([0, 1089, 2, 7, 1], [1, 40, 1, 1, 1], [-1, 6, -1, -1, -1])
+
+def test_matches_response_model():
+    """Test that clusters, points and unknown point ids encode byte for byte like the model"""
+    features = FeatureStore.from_points(POINTS).view()
+    assert encode_cluster_response(RESULT, features) == model_json(RESULT, features)
+
+def test_matches_with_fragments():
+    """Test that lazily cached and precomputed fragments give the same bytes"""
+    store = FeatureStore.from_points(POINTS)
+    expected = model_json(RESULT, store.view())
+
+    fragments = enable_fragments(store)
+    assert get_fragments(store) is fragments
+    partial = clusters([0, 1089, 2], [1, 40, 1], [-1, 6, -1])
+    assert encode_cluster_response(partial, store.view()) == model_json(partial, store.view())
+    assert fragments.cached == 2
+    assert encode_cluster_response(RESULT, store.view()) == expected
+
+    fragments.precompute()
+    assert fragments.cached == 3
+    assert encode_cluster_response(RESULT, store.view()) == expected
+
+def test_filtered_view_and_lists():
+    """Test that point ids resolve through filtered views and plain feature lists"""
+    store = FeatureStore.from_points(POINTS)
+    enable_fragments(store).precompute()
+    view = store.view(np.array([2, 0]))
+    result = clusters([0, 1], [1, 1], [-1, -1])
+
+    assert encode_cluster_response(result, view) == model_json(result, view)
+    assert encode_cluster_response(result, list(view)) == model_json(result, view)
+
+def test_layer_counts():
+    """Test that layer counts are added to clusters only, matching the model"""
+    features = FeatureStore.from_points(POINTS).view()
+    result = dict(RESULT, sum=np.array([[1.0, 0.0], [31.0, 4.0], [1.0, 0.0], [0.0, 0.0], [0.0, 1.0]]))
+    names = ['graduate-points', 'featured-points']
+    expected = served_json([
+        cluster_feature(36.8219, 1.2921, 1, 0, -1, features),
+        cluster_feature(0.1 + 0.2, -0.00001, 40, 1089, 6, features,
+                        {'graduate-points': 31, 'featured-points': 4}),
+        cluster_feature(-179.99999999, 85.0511287798, 1, 2, -1, features),
+        cluster_feature(1e-7, -2.5e-5, 1, 7, -1, features),
+        cluster_feature(18.4241, -33.9249, 1, 1, -1, features),
+    ])
+    
+    assert encode_cluster_response(result, features, names) == expected
+    assert encode_cluster_response(result, features) == model_json(RESULT, features)
+
+def test_empty_result():
+    """Test an empty query result"""
+    result = clusters([], [], [])
+    assert encode_cluster_response(result, []) == b'{"features":[]}'
+
+def test_fragments_carried_over_changes():
+    """Test that unchanged rows keep their fragments after apply_changes"""
+    store = FeatureStore.from_points(POINTS)
+    enable_fragments(store).precompute()
+    columns = list(POINTS[0].keys())
+    changed = dict(POINTS[0], full_name='Zoë N.')
+    new_store, row_map = store.apply_changes(columns, [tuple(changed[c] for c in columns)])
+
+    fragments = enable_fragments(new_store, store, row_map)
+    assert fragments.cached == 2
+    assert fragments[2] == FeatureFragments(new_store)[2]
+    assert b'Zo\xc3\xab N.' in fragments[2]
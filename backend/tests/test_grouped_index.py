@@ -0,0 +1,132 @@
+import pytest
+import sys
+import os
+import numpy as np
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grouped_index import GroupedIndex, group_coordinates, pysupercluster
+from filtered_index import FilteredIndexView
+from feature_store import FeatureStore
+from index_snapshot import save_snapshot, load_snapshot
+
+OPTIONS = {"min_zoom": 0, "max_zoom": 16, "radius": 40, "extent": 512, "node_size": 64}
+
+def make_points(count=4000, locations=600):
+    """Points drawn from fewer locations, rounded like learner coordinates"""
+    rng = np.random.RandomState(0)
+    sites = np.round(np.column_stack([rng.uniform(-20, 50, locations), rng.uniform(-35, 35, locations)]), 5)
+    return sites[rng.randint(0, locations, count)]
+
+def assert_same_clusters(index, expected, zoom, **kwargs):
+    """Compare counts and positions, which match up to rounding of the centroids"""
+    summaries = []
+    for source in (index, expected):
+        arrays = source.getClustersArrays((-180, 90), (180, -90), zoom, **kwargs)
+        rows = np.column_stack([arrays['count'], arrays['longitude'], arrays['latitude']])
+        summaries.append(rows[np.lexsort(rows.T[::-1])])
+    assert summaries[0].shape == summaries[1].shape
+    np.testing.assert_array_equal(summaries[0][:, 0], summaries[1][:, 0])
+    np.testing.assert_allclose(summaries[0][:, 1:], summaries[1][:, 1:], atol=1e-9)
+
+def all_points(index, zoom, **kwargs):
+    """Ids of every point under the clusters of a zoom level"""
+    arrays = index.getClustersArrays((-180, 90), (180, -90), zoom, **kwargs)
+    ids = []
+    for cluster_id, count in zip(arrays['id'].tolist(), arrays['count'].tolist()):
+        if count == 1:
+            ids.append(cluster_id)
+        else:
+            leaves = index.getLeaves(cluster_id, limit=count + 1, **kwargs)
+            assert len(leaves) == count
+            ids.extend(leaf['id'] for leaf in leaves)
+    return sorted(ids)
+
+def test_group_coordinates():
+    """Test that points are grouped by location in order of first occurrence"""
+    coordinates = np.array([[1.0, 2.0], [0.0, 0.0], [1.0, 2.0], [0.0, -0.0], [3.0, 2.0]])
+    members, offsets = group_coordinates(coordinates)
+    assert members.tolist() == [0, 2, 1, 3, 4]
+    assert offsets.tolist() == [0, 2, 4, 5]
+
+def test_grouped_index_matches_points():
+    """Test that clustering locations gives the clusters of the points"""
+    points = make_points()
+    plain = pysupercluster.SuperCluster(points, **OPTIONS)
+    index = GroupedIndex.build(points, **OPTIONS)
+    assert index.point_count == 4000
+    assert index.location_count == len(np.unique(points, axis=0))
+
+    for zoom in (0, 3, 7, 12, 16):
+        assert_same_clusters(index, plain, zoom)
+    for zoom in (0, 8, 17):
+        assert all_points(index, zoom) == list(range(4000))
+
+    # Single points keep their own coordinates
+    arrays = index.getClustersArrays((-180, 90), (180, -90), 17)
+    singles = arrays['count'] == 1
+    np.testing.assert_allclose(arrays['longitude'][singles], points[arrays['id'][singles], 0])
+
+def test_grouped_index_drill_down():
+    """Test children, paginated leaves and expansion zooms by public id"""
+    points = make_points()
+    index = GroupedIndex.build(points, **OPTIONS)
+    top = max(index.getClusters((-180, 90), (180, -90), 2), key=lambda c: c['count'])
+
+    leaves = index.getLeaves(top['id'], limit=10000)
+    pages = [index.getLeaves(top['id'], limit=7, offset=offset) for offset in range(0, top['count'], 7)]
+    assert [leaf['id'] for page in pages for leaf in page] == [leaf['id'] for leaf in leaves]
+    assert sum(child['count'] for child in index.getChildren(top['id'])) == top['count']
+    assert index.getClusterExpansionZoom(top['id']) > 2
+
+    # A location with several points is a cluster of them that expands past max_zoom
+    arrays = index.getClustersArrays((-180, 90), (180, -90), 17)
+    group_id = int(arrays['id'][np.argmax(arrays['count'])])
+    assert int(arrays['expansion_zoom'][np.argmax(arrays['count'])]) == 17
+    children = index.getChildren(group_id)
+    assert len(children) == arrays['count'].max()
+    assert all((points[child['id']] == points[children[0]['id']]).all() for child in children)
+    assert index.getLeaves(group_id, limit=2, offset=1) == children[1:3]
+    assert index.getClusterExpansionZoom(group_id) == 17
+
+    for invalid in (0, index.point_count + 32 * index.location_count, 10 ** 9):
+        with pytest.raises(ValueError):
+            index.getChildren(invalid)
+
+def test_grouped_index_filter_and_attributes():
+    """Test filtered queries and attribute sums over grouped points"""
+    points = make_points()
+    rng = np.random.RandomState(1)
+    mask = rng.uniform(size=4000) < 0.3
+    attributes = rng.randint(0, 2, (4000, 2)).astype(np.float64)
+    plain = pysupercluster.SuperCluster(points, attributes=attributes, **OPTIONS)
+    index = GroupedIndex.build(points, attributes, **OPTIONS)
+
+    view, plain_view = FilteredIndexView(index, mask), FilteredIndexView(plain, mask)
+    assert view.point_count == mask.sum()
+    for zoom in (0, 6, 12):
+        assert_same_clusters(view, plain_view, zoom)
+    for zoom in (0, 17):
+        assert all_points(view, zoom) == np.flatnonzero(mask).tolist()
+
+    # Location sums add up to exact cluster sums
+    for zoom in (0, 9):
+        arrays = index.getClustersArrays((-180, 90), (180, -90), zoom)
+        np.testing.assert_array_equal(arrays['sum'].sum(axis=0), attributes.sum(axis=0))
+
+def test_grouped_index_snapshot(tmp_path):
+    """Test that a grouped index is saved and mapped with its groups"""
+    points = make_points(count=500, locations=100)
+    store = FeatureStore.from_points([
+        {'hashed_email': f'user{i}', 'longitude': float(lng), 'latitude': float(lat)}
+        for i, (lng, lat) in enumerate(points)
+    ])
+    index = GroupedIndex.build(store.coordinates, **OPTIONS)
+    save_snapshot(str(tmp_path), "all", index, store, OPTIONS)
+
+    loaded, _, _ = load_snapshot(str(tmp_path), "all", OPTIONS)
+    assert isinstance(loaded, GroupedIndex)
+    assert loaded.location_count == index.location_count
+    for zoom in (0, 10, 17):
+        assert loaded.getClusters((-180, 90), (180, -90), zoom) == index.getClusters((-180, 90), (180, -90), zoom)
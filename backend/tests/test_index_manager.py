@@ -2,6 +2,9 @@ import pytest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import gc
+import threading
+import time
 import numpy as np
 from typing import Dict, List, Any
 
@@ -9,6 +12,10 @@ from typing import Dict, List, Any
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from index_manager import IndexManager
+from feature_store import FeatureStore
+from filtered_index import FilteredIndexView
+from grouped_index import GroupedIndex
+from pysupercluster import SuperCluster
 
 # Sample test data
 SAMPLE_POINTS = [
@@ -66,13 +73,17 @@ SAMPLE_COORDINATES = np.array([
 
 class MockSuperCluster:
     """Mock SuperCluster implementation for testing"""
-    def __init__(self, points_array=None, min_zoom=0, max_zoom=16, radius=40, extent=512, min_points=2):
+    def __init__(self, points_array=None, min_zoom=0, max_zoom=16, radius=40, extent=512, min_points=2, threads=1, node_size=64,
+                 attributes=None):
         self.points_array = points_array if points_array is not None else np.array([])
         self.min_zoom = min_zoom
         self.max_zoom = max_zoom
         self.radius = radius
         self.extent = extent
         self.min_points = min_points
+        self.threads = threads
+        self.node_size = node_size
+        self.attributes = attributes
     
     def getClusters(self, top_left, bottom_right, zoom):
         """Return mock clusters based on zoom level"""
@@ -97,13 +108,12 @@ class MockSuperCluster:
 @pytest.fixture
 def mock_dependencies():
     """Mock dependencies for the index manager"""
-    with patch('index_manager.load_learner_points') as mock_load_points, \
-         patch('index_manager.convert_to_geojson') as mock_convert, \
+    with patch('index_manager.FeatureStore.from_points', side_effect=FeatureStore.from_points) as mock_convert, \
+         patch('index_manager.load_learner_store') as mock_load_points, \
          patch('index_manager.pysupercluster.SuperCluster') as mock_supercluster:
         
-        # Configure mocks
-        mock_load_points.return_value = SAMPLE_DB_POINTS
-        mock_convert.return_value = SAMPLE_GEOJSON
+        # Configure mocks (the streaming loader builds its store from the sample rows)
+        mock_load_points.side_effect = lambda filters=None, **kwargs: FeatureStore.from_points(SAMPLE_DB_POINTS)
         mock_supercluster.side_effect = MockSuperCluster
         
         yield {
@@ -243,15 +253,20 @@ def test_get_index_force_refresh(mock_dependencies):
     mock_dependencies['convert'].reset_mock()
     mock_dependencies['supercluster'].reset_mock()
     
-    # Second call with force_refresh should not use cache
+    # Second call with force_refresh keeps serving the cached index while it is rebuilt
     second_key, second_index = manager.get_index(filters, force_refresh=True)
-    
-    # Verify the result
     assert second_key == first_key
-    assert second_index is not first_index  # Should be a different object (refreshed)
+    assert second_index is first_index
+    manager.pending_refreshes[first_key].result(timeout=10)
+    
+    # The rebuilt index replaces it
+    third_key, third_index = manager.get_index(filters)
+    assert third_key == first_key
+    assert third_index is not first_index  # Should be a different object (refreshed)
+    assert not manager.pending_refreshes
     
     # Verify cache state
-    assert manager.cache_hits == 0
+    assert manager.cache_hits == 2
     assert manager.cache_misses == 2
     
     # Verify mocks were called on second request
@@ -259,6 +274,43 @@ def test_get_index_force_refresh(mock_dependencies):
     mock_dependencies['convert'].assert_called_once()
     mock_dependencies['supercluster'].assert_called_once()
 
+def test_generations(mock_dependencies):
+    """Test that each build publishes a new generation and old ones live as long as they are held"""
+    manager = IndexManager()
+    
+    first = manager.get_generation({'gender': 'Female'})
+    assert manager.get_cached_generation({'gender': 'Female'}) is first
+    assert manager.get_generation_by_key(first.key) is first
+    assert first.features is manager.get_original_features(first.key)
+    
+    second = manager.refresh_index({'gender': 'Female'}).result(timeout=10)
+    assert second.id > first.id
+    assert second.etag != first.etag
+    assert manager.get_generation_by_key(first.key) is second
+    
+    # The replaced generation stays intact while a request holds it
+    assert first.index is not second.index
+    assert len(first.features) == len(second.features)
+    stats = manager.get_stats()
+    assert stats["generations"][first.key]["id"] == second.id
+    assert stats["generations"][first.key]["refreshing"] is False
+    assert stats["retired_generations_in_use"] == 1
+    
+    del first
+    gc.collect()
+    assert manager.get_stats()["retired_generations_in_use"] == 0
+
+def test_refresh_failure_keeps_generation(mock_dependencies):
+    """Test that a failed background rebuild keeps serving the current generation"""
+    manager = IndexManager()
+    generation = manager.get_generation({'gender': 'Female'})
+    
+    mock_dependencies['supercluster'].side_effect = Exception("build failed")
+    future = manager.refresh_index({'gender': 'Female'})
+    with pytest.raises(Exception):
+        future.result(timeout=10)
+    assert manager.get_generation_by_key(generation.key) is generation
+
 def test_get_original_features():
     """Test getting original GeoJSON features"""
     manager = IndexManager()
@@ -310,4 +362,380 @@ def test_clear_cache():
     # Verify results
     assert manager.indexes == {}
     assert manager.geojson_cache == {}
-    assert manager.last_accessed == {}
\ No newline at end of file
+    assert manager.last_accessed == {}
+
+def test_filtered_index_uses_all_store(mock_dependencies):
+    """Test that filtered entries are index arrays into the "all" store"""
+    manager = IndexManager()
+    manager.get_index({})
+    mock_dependencies['load_points'].reset_mock()
+    
+    index_key, _ = manager.get_index({'gender': 'Male', 'is_featured': True})
+    
+    assert index_key == "gender=Male_is_featured=1"
+    mock_dependencies['load_points'].assert_not_called()
+    
+    features = manager.get_original_features(index_key)
+    assert features.store is manager.geojson_cache["all"].store
+    assert list(features.rows) == [1]
+    assert features[0]['properties']['id'] == 'user2'
+    assert features[0]['geometry']['coordinates'] == [8.6753, 9.0820]
+
+def test_filtered_index_from_cached_superset(mock_dependencies):
+    """Test that a filtered index is derived from the smallest cached superset"""
+    manager = IndexManager()
+    manager.get_index({})
+    manager.get_index({'is_graduate_learner': True})
+    manager.get_index({'gender': 'Male'})
+    
+    with patch.object(manager, '_filter_features', wraps=manager._filter_features) as mock_filter:
+        index_key, _ = manager.get_index({'gender': 'Male', 'is_featured': True})
+    
+    # gender=Male (1 point) is smaller than is_graduate_learner=1 (2 points)
+    assert mock_filter.call_args.args[0] is manager.geojson_cache['gender=Male']
+    features = manager.get_original_features(index_key)
+    assert features.store is manager.geojson_cache["all"].store
+    assert list(features.rows) == [1]
+    
+    generations = manager.get_stats()["generations"]
+    assert generations[index_key]["source"] == {"key": "gender=Male", "points": 1}
+    assert generations["gender=Male"]["source"] == {"key": "all", "points": 2}
+    assert generations["all"]["source"] is None
+    
+    # Entries of unrelated or broader filters are not supersets
+    assert manager._smallest_superset({'gender': 'Female'}, manager.geojson_cache["all"])[0] == "all"
+    assert manager._smallest_superset({'gender': 'Male'}, manager.geojson_cache["all"], exclude='gender=Male')[0] == "all"
+
+def test_filtered_index_no_matches(mock_dependencies):
+    """Test filtering on a value that never occurs"""
+    manager = IndexManager()
+    manager.get_index({})
+    
+    index_key, _ = manager.get_index({'country_of_residence': 'Ghana'})
+    
+    assert len(manager.get_original_features(index_key)) == 0
+
+def test_cache_eviction(mock_dependencies):
+    """Test that the filtered index cache is bounded and "all" stays pinned"""
+    manager = IndexManager(max_cached_indexes=1)
+    manager.get_index({})
+    manager.get_index({'gender': 'Male'})
+    manager.get_index({'gender': 'Female'})
+    
+    assert set(manager.indexes) == {"all", "gender=Female"}
+    assert set(manager.geojson_cache) == {"all", "gender=Female"}
+    
+    eviction = manager.get_stats()["eviction"]
+    assert eviction["evictions"] == 1
+    assert eviction["recent_evictions"][0]["key"] == "gender=Male"
+
+def test_concurrent_misses_build_once(mock_dependencies):
+    """Test that concurrent misses for one key share a single build"""
+    manager = IndexManager()
+    manager.get_index({})
+    
+    def slow_supercluster(*args, **kwargs):
+        time.sleep(0.2)
+        return MockSuperCluster(*args, **kwargs)
+    mock_dependencies['supercluster'].reset_mock()
+    mock_dependencies['supercluster'].side_effect = slow_supercluster
+    
+    results = []
+    def worker():
+        results.append(manager.get_index({'gender': 'Male'}))
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert mock_dependencies['supercluster'].call_count == 1
+    assert len({id(index) for _, index in results}) == 1
+    assert manager.coalesced_builds + manager.cache_hits == 4
+
+def test_failed_build_releases_waiters(mock_dependencies):
+    """Test that a failed build reaches every waiter and is not cached"""
+    manager = IndexManager()
+    manager.get_index({})
+    
+    def failing_supercluster(*args, **kwargs):
+        time.sleep(0.2)
+        raise RuntimeError("build failed")
+    mock_dependencies['supercluster'].side_effect = failing_supercluster
+    
+    errors = []
+    def worker():
+        try:
+            manager.get_index({'gender': 'Male'})
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(errors) == 3
+    assert "gender=Male" not in manager.indexes
+    assert "gender=Male" not in manager.geojson_cache
+    
+    # The next request retries the build
+    mock_dependencies['supercluster'].side_effect = MockSuperCluster
+    index_key, index = manager.get_index({'gender': 'Male'})
+    assert manager.indexes[index_key] is index
+
+def test_get_cached_index(mock_dependencies):
+    """Test looking up an index without building it"""
+    manager = IndexManager()
+    
+    assert manager.get_cached_index({'gender': 'Male'}) is None
+    mock_dependencies['supercluster'].assert_not_called()
+    
+    index_key, index = manager.get_index({'gender': 'Male'})
+    assert manager.get_cached_index({'gender': 'Male'}) == (index_key, index)
+    assert manager.cache_hits == 1
+
+def test_snapshot_saved_after_build(mock_dependencies, tmp_path):
+    """Test that the "all" index is saved as a snapshot after a database load"""
+    manager = IndexManager(snapshot_dir=str(tmp_path))
+    
+    with patch('index_manager.save_snapshot') as mock_save:
+        manager.get_index({})
+        manager.get_index({'gender': 'Male'})
+    
+    mock_save.assert_called_once()
+    root, key, _, store, options = mock_save.call_args[0]
+    assert (root, key, len(store)) == (str(tmp_path), "all", 2)
+    assert options["node_size"] == 64
+    assert manager.get_stats()["snapshot"]["source"] == "database"
+
+def test_snapshot_skips_database(mock_dependencies, tmp_path):
+    """Test that a usable snapshot is served without loading the database"""
+    manager = IndexManager(snapshot_dir=str(tmp_path))
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    snapshot_index = MockSuperCluster()
+    
+    with patch('index_manager.load_snapshot', return_value=(snapshot_index, store, {"created": 1.0})):
+        index_key, index = manager.get_index({})
+    
+    assert (index_key, index) == ("all", snapshot_index)
+    assert manager.get_stats()["snapshot"]["source"] == "snapshot"
+    mock_dependencies['load_points'].assert_not_called()
+    
+    # filtered indexes are built from the mapped store
+    manager.get_index({'gender': 'Male'})
+    assert len(manager.geojson_cache["gender=Male"]) == 1
+    mock_dependencies['load_points'].assert_not_called()
+
+def test_data_version_shared_through_snapshot(mock_dependencies, tmp_path):
+    """Test that ETags name the data version, which workers attached to one snapshot share"""
+    manager = IndexManager(snapshot_dir=str(tmp_path))
+    with patch('index_manager.save_snapshot') as mock_save:
+        built = manager.get_generation({})
+    assert mock_save.call_args[1]["metadata"]["data_version"] == built.version
+    assert built.etag == f'W/"{built.version}"'
+    
+    # Filtered indexes derived from "all" carry its version
+    assert manager.get_generation({'gender': 'Male'}).version == built.version
+    
+    pointer = {"created": 1.0, "directory": "all-1", "data_version": built.version}
+    store = FeatureStore.from_points(SAMPLE_DB_POINTS)
+    for _ in range(2):
+        worker = IndexManager(snapshot_dir=str(tmp_path))
+        with patch('index_manager.load_snapshot', return_value=(MockSuperCluster(), store, pointer)):
+            assert worker.get_generation({}).etag == built.etag
+    
+    # A new database load is a new version
+    assert manager.refresh_index({}).result(timeout=10).version != built.version
+
+def test_shared_memory_mode(mock_dependencies, tmp_path):
+    """Test that shared-memory mode builds "all" under the cross-process builder lock"""
+    from index_snapshot import SHARED_MEMORY_DIR
+    assert IndexManager(shared_memory=True).snapshot_dir == SHARED_MEMORY_DIR
+    
+    manager = IndexManager(shared_memory=True, snapshot_dir=str(tmp_path))
+    with patch('index_manager.builder_lock') as mock_lock, \
+         patch('index_manager.load_snapshot', return_value=None) as mock_load, \
+         patch('index_manager.save_snapshot') as mock_save:
+        mock_lock.return_value.__exit__.return_value = False
+        manager.get_index({})
+        manager.get_index({'gender': 'Male'})
+    
+    # only "all" is shared; it is looked up and published while holding the lock
+    mock_lock.assert_called_once_with(str(tmp_path), "all")
+    mock_load.assert_called_once()
+    mock_save.assert_called_once()
+    assert manager.get_stats()["snapshot"]["shared_memory"] is True
+
+def learner_row(hashed_email, latitude, longitude, gender, country, is_featured=0):
+    """A changed learner row as returned by load_learner_changes"""
+    return (hashed_email, None, country, latitude, longitude, gender, 1, 0, 0, is_featured, 0)
+
+def test_refresh_changes(mock_dependencies):
+    """Test that changed rows are applied and affected indexes swapped in"""
+    manager = IndexManager(watermark_column='updated_at')
+    with patch('index_manager.get_learner_watermark', return_value=10):
+        _, all_index = manager.get_index({})
+    _, female_index = manager.get_index({'gender': 'Female'})
+    _, male_index = manager.get_index({'gender': 'Male'})
+    old_all = manager.get_generation_by_key("all")
+    
+    # user2 (Male) moves; a new Female learner appears
+    changes = [learner_row('user2', 10.0, 9.0, 'Male', 'Nigeria'), learner_row('user3', 5.0, 5.0, 'Female', 'Ghana')]
+    with patch('index_manager.load_learner_changes', return_value=(changes, 12, {'user3'})) as mock_changes:
+        result = manager.refresh_changes()
+    
+    mock_changes.assert_called_once_with('updated_at', 10, set())
+    assert result["status"] == "applied"
+    assert sorted(result["rebuilt"]) == ["gender=Female", "gender=Male"]
+    assert manager.watermark == 12
+    
+    all_features = manager.get_original_features("all")
+    assert manager.indexes["all"] is not all_index
+    assert [f['properties']['id'] for f in all_features] == ['user1', 'user2', 'user3']
+    assert all_features[1]['geometry']['coordinates'] == [9.0, 10.0]
+    assert manager.filter_engine.store is all_features.store
+    assert [f['properties']['id'] for f in manager.get_original_features('gender=Female')] == ['user1', 'user3']
+    
+    # A request still holding the replaced generation keeps the features its index was built from
+    assert old_all.index is all_index
+    assert [f['properties']['id'] for f in old_all.features] == ['user1', 'user2']
+    assert manager.get_generation_by_key("all").id > old_all.id
+    assert manager.get_stats()["delta_refresh"]["rows_applied"] == 2
+
+def test_refresh_remaps_unaffected_indexes(mock_dependencies):
+    """Test that indexes no changed row enters or leaves keep their index"""
+    manager = IndexManager(watermark_column='updated_at')
+    with patch('index_manager.get_learner_watermark', return_value=10):
+        manager.get_index({})
+    _, male_index = manager.get_index({'gender': 'Male'})
+    
+    # user1 (Female) is deleted by clearing its coordinates
+    with patch('index_manager.load_learner_changes', return_value=([learner_row('user1', None, None, 'Female', 'Kenya')], 11, set())):
+        result = manager.refresh_changes()
+    
+    assert result["rebuilt"] == []
+    assert manager.indexes['gender=Male'] is male_index
+    features = manager.get_original_features('gender=Male')
+    assert features.store is manager.geojson_cache["all"].store
+    assert list(features.rows) == [0]
+    assert features[0]['properties']['id'] == 'user2'
+    assert len(manager.get_original_features("all")) == 1
+
+def test_refresh_without_changes(mock_dependencies):
+    """Test that a refresh without changed rows keeps every index"""
+    manager = IndexManager(watermark_column='updated_at')
+    manager.refresh_changes()  # nothing loaded yet
+    with patch('index_manager.get_learner_watermark', return_value=10):
+        _, all_index = manager.get_index({})
+    
+    with patch('index_manager.load_learner_changes', return_value=([], 10, set())):
+        assert manager.refresh_changes()["status"] == "unchanged"
+    assert manager.indexes["all"] is all_index
+    assert IndexManager().refresh_changes() == {"status": "disabled"}
+
+def test_refresh_after_empty_load(mock_dependencies):
+    """Test that a table empty at the full load is refreshed from the beginning"""
+    manager = IndexManager(watermark_column='updated_at')
+    with patch('index_manager.get_learner_watermark', return_value=None):
+        manager.get_index({})
+    
+    changes = [learner_row('user3', 5.0, 5.0, 'Female', 'Ghana')]
+    with patch('index_manager.load_learner_changes', return_value=(changes, 3, {'user3'})) as mock_changes:
+        assert manager.refresh_changes()["status"] == "applied"
+    mock_changes.assert_called_once_with('updated_at', None, set())
+    assert manager.watermark == 3
+    
+    # A watermark that could not be read still disables refreshes
+    with patch('index_manager.get_learner_watermark', side_effect=Exception("no column")):
+        manager.refresh_index({}).result(timeout=10)
+    assert manager.refresh_changes()["status"] == "skipped"
+
+def test_json_fragments_precomputed(mock_dependencies):
+    """Test that the "all" features are encoded when it is built with precomputed fragments"""
+    manager = IndexManager(json_fragments="precompute")
+    manager.get_index({})
+    assert manager.get_stats()["json_fragments"] == {"mode": "precompute", "cached": len(SAMPLE_DB_POINTS)}
+    
+    with pytest.raises(ValueError):
+        IndexManager(json_fragments="eager")
+
+def test_layer_counts(mock_dependencies):
+    """Test that indexes aggregate the layer flags when layer counts are enabled"""
+    manager = IndexManager(layer_counts=True)
+    assert manager.layer_names == ['graduate-points', 'featured-points', 'entrepreneur-points']
+    manager.get_index({})
+    
+    attributes = mock_dependencies['supercluster'].call_args.kwargs['attributes']
+    # user1 is a graduate entrepreneur, user2 a featured graduate
+    assert attributes.tolist() == [[1.0, 0.0, 1.0], [1.0, 1.0, 0.0]]
+    assert manager._snapshot_options()["layer_counts"] == manager.layer_names
+    
+    # Filtered indexes aggregate the rows they keep; without layer counts nothing is passed
+    manager.get_index({'gender': 'Male'})
+    assert mock_dependencies['supercluster'].call_args.kwargs['attributes'].tolist() == [[1.0, 1.0, 0.0]]
+    IndexManager().get_index({'gender': 'Male'})
+    assert 'attributes' not in mock_dependencies['supercluster'].call_args.kwargs
+
+def test_group_points(mock_dependencies):
+    """Test that learners at identical coordinates are clustered as one weighted location"""
+    mock_dependencies['supercluster'].side_effect = SuperCluster
+    twin = dict(SAMPLE_DB_POINTS[0], hashed_email='user3', gender='Male')
+    mock_dependencies['load_points'].side_effect = \
+        lambda filters=None, **kwargs: FeatureStore.from_points(SAMPLE_DB_POINTS + [twin])
+    manager = IndexManager(group_points=True, filter_views=True)
+    generation = manager.get_generation({})
+    
+    assert isinstance(generation.index, GroupedIndex)
+    assert mock_dependencies['supercluster'].call_args.kwargs['weights'].tolist() == [2, 1]
+    clusters = generation.index.getClustersArrays((-180, 90), (180, -90), 17)
+    assert sorted(clusters['count'].tolist()) == [1, 2]
+    group_id = int(clusters['id'][clusters['count'] == 2][0])
+    assert int(clusters['expansion_zoom'][clusters['count'] == 2][0]) == 17
+    assert generation.features[int(clusters['id'][clusters['count'] == 1][0])]['properties']['id'] == 'user2'
+    leaves = generation.index.getLeaves(group_id, limit=10)
+    assert [generation.features[leaf['id']]['properties']['id'] for leaf in leaves] == ['user1', 'user3']
+    assert generation.index.getClusterExpansionZoom(group_id) == 17
+    assert manager.get_stats()['generations']['all']['locations'] == 2
+    
+    # Filter views count the matching learners of each location
+    view = manager.get_generation({'gender': 'Male'})
+    assert isinstance(view.index, FilteredIndexView)
+    clusters = view.index.getClustersArrays((-180, 90), (180, -90), 17)
+    assert sorted(view.features[i]['properties']['id'] for i in clusters['id'].tolist()) == ['user2', 'user3']
+
+def test_filter_views(mock_dependencies):
+    """Test that filter views answer filters from the all index without building one"""
+    mock_dependencies['supercluster'].side_effect = SuperCluster
+    manager = IndexManager(filter_views=True, watermark_column='updated_at')
+    with patch('index_manager.get_learner_watermark', return_value=10):
+        manager.get_index({})
+    builds = mock_dependencies['supercluster'].call_count
+    
+    generation = manager.get_generation({'gender': 'Male'})
+    assert mock_dependencies['supercluster'].call_count == builds
+    assert isinstance(generation.index, FilteredIndexView)
+    assert generation.features is manager.generations['all'].features
+    clusters = generation.index.getClustersArrays((-180, 90), (180, -90), 0)
+    assert clusters['count'].tolist() == [1]
+    assert generation.features[int(clusters['id'][0])]['properties']['id'] == 'user2'
+    stats = manager.get_stats()
+    assert stats['generations']['gender=Male']['points'] == 1
+    assert stats['generations']['gender=Male']['filter_view'] is True
+    assert stats['object_memory']['geojson_entries']['gender=Male']['size_mb'] == 0
+    
+    # A refresh redoes the view over the new all index
+    changes = [learner_row('user3', 5.0, 5.0, 'Male', 'Ghana')]
+    with patch('index_manager.load_learner_changes', return_value=(changes, 12, {'user3'})):
+        result = manager.refresh_changes()
+    assert result['rebuilt'] == ['gender=Male']
+    refreshed = manager.get_generation({'gender': 'Male'})
+    assert refreshed.index.index is manager.generations['all'].index
+    assert refreshed.index.point_count == 2
+    assert mock_dependencies['supercluster'].call_count == builds + 1
+    
+    # Without the option filtered indexes are built
+    mock_dependencies['supercluster'].side_effect = MockSuperCluster
+    manager = IndexManager()
+    manager.get_index({})
+    assert not isinstance(manager.get_generation({'gender': 'Male'}).index, FilteredIndexView)
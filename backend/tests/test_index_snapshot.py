@@ -0,0 +1,136 @@
+import pytest
+import sys
+import os
+import time
+import threading
+import multiprocessing
+import numpy as np
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_store import FeatureStore
+from index_snapshot import save_snapshot, load_snapshot, builder_lock, pysupercluster
+
+OPTIONS = {"min_zoom": 0, "max_zoom": 16, "radius": 40, "extent": 512, "node_size": 64}
+
+def make_store(count=500):
+    rng = np.random.RandomState(0)
+    points = [
+        {
+            'hashed_email': f'user{i}',
+            'full_name': f'Learner {i}',
+            'latitude': float(rng.uniform(-30, 30)),
+            'longitude': float(rng.uniform(-20, 50)),
+            'gender': 'female' if i % 2 else 'male',
+            'is_featured': i % 3 == 0
+        }
+        for i in range(count)
+    ]
+    return FeatureStore.from_points(points)
+
+@pytest.fixture
+def snapshot(tmp_path):
+    store = make_store()
+    index = pysupercluster.SuperCluster(store.coordinates)
+    save_snapshot(str(tmp_path), "all", index, store, OPTIONS)
+    return str(tmp_path), index, store
+
+def test_round_trip(snapshot):
+    """Test that a loaded snapshot answers queries like the saved index"""
+    root, index, store = snapshot
+    
+    loaded_index, loaded_store, pointer = load_snapshot(root, "all", OPTIONS)
+    
+    assert pointer["rows"] == len(store)
+    assert list(loaded_store.view()) == list(store.view())
+    for zoom in (0, 4, 8, 17):
+        assert loaded_index.getClusters((-180, 90), (180, -90), zoom) == index.getClusters((-180, 90), (180, -90), zoom)
+
+def test_missing_snapshot(tmp_path):
+    """Test that a directory without a snapshot loads nothing"""
+    assert load_snapshot(str(tmp_path), "all", OPTIONS) is None
+
+def test_options_mismatch(snapshot):
+    """Test that snapshots built with other options are ignored"""
+    root, _, _ = snapshot
+    
+    assert load_snapshot(root, "all", dict(OPTIONS, radius=80)) is None
+
+def test_max_age(snapshot):
+    """Test that snapshots older than max_age are ignored"""
+    root, _, _ = snapshot
+    time.sleep(0.05)
+    
+    assert load_snapshot(root, "all", OPTIONS, max_age=0.01) is None
+    assert load_snapshot(root, "all", OPTIONS, max_age=60) is not None
+
+def test_resave_replaces_snapshot(snapshot):
+    """Test that saving again publishes the new snapshot and removes the old one"""
+    root, _, _ = snapshot
+    old_index, _, _ = load_snapshot(root, "all", OPTIONS)
+    
+    store = make_store(100)
+    directory = save_snapshot(root, "all", pysupercluster.SuperCluster(store.coordinates), store, OPTIONS)
+    
+    _, loaded_store, _ = load_snapshot(root, "all", OPTIONS)
+    assert len(loaded_store) == 100
+    assert sorted(os.listdir(root)) == sorted(["all.json", os.path.basename(directory)])
+    
+    # an index mapped before the replacement keeps working
+    assert sum(c['count'] for c in old_index.getClusters((-180, 90), (180, -90), 0)) == 500
+
+def test_corrupt_index_file(snapshot):
+    """Test that a damaged index file is reported as no snapshot"""
+    root, _, _ = snapshot
+    _, _, pointer = load_snapshot(root, "all", OPTIONS)
+    with open(os.path.join(root, pointer["directory"], "index.bin"), "r+b") as f:
+        f.write(b"garbage!")
+    
+    assert load_snapshot(root, "all", OPTIONS) is None
+
+def test_builder_lock_is_exclusive(tmp_path):
+    """Test that holders of the builder lock never overlap"""
+    events = []
+    def worker(name):
+        with builder_lock(str(tmp_path), "all"):
+            events.append((name, "start"))
+            time.sleep(0.05)
+            events.append((name, "end"))
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(events) == 6
+    for start, end in zip(events[::2], events[1::2]):
+        assert start[0] == end[0] and (start[1], end[1]) == ("start", "end")
+
+def _attach_or_build(root, results):
+    """Worker process: attach to the published snapshot or build and publish it"""
+    with builder_lock(root, "all"):
+        loaded = load_snapshot(root, "all", OPTIONS)
+        if loaded is None:
+            store = make_store()
+            save_snapshot(root, "all", pysupercluster.SuperCluster(store.coordinates), store, OPTIONS)
+            loaded = load_snapshot(root, "all", OPTIONS)
+            results.put("built")
+        else:
+            results.put("attached")
+    index, store, _ = loaded
+    assert sum(c['count'] for c in index.getClusters((-180, 90), (180, -90), 0)) == len(store)
+
+def test_one_process_builds(tmp_path):
+    """Test that of several processes starting together only one builds"""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=_attach_or_build, args=(str(tmp_path), results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    assert sorted(results.get() for _ in processes) == ["attached", "attached", "built"]
@@ -0,0 +1,137 @@
+import pytest
+import sys
+import os
+import struct
+
+# Add parent directory to path to import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mvt import LayerEncoder, encode_tile
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+def _fields(data):
+    """Iterate over (field, wire_type, value) of a protobuf message"""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        else:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        yield field, wire_type, value
+
+def _packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def _decode_value(data):
+    for field, _, value in _fields(data):
+        if field == 1:
+            return value.decode("utf-8")
+        if field == 3:
+            return value
+        if field == 5:
+            return value
+        if field == 6:
+            return _unzigzag(value)
+        if field == 7:
+            return bool(value)
+
+def decode_tile(data):
+    """Reference decoder for point layers: {name: {extent, features}}"""
+    layers = {}
+    for _, _, layer_data in _fields(data):
+        layer = {"features": []}
+        raw_features, keys, values = [], [], []
+        for field, _, value in _fields(layer_data):
+            if field == 1:
+                name = value.decode("utf-8")
+            elif field == 2:
+                raw_features.append(value)
+            elif field == 3:
+                keys.append(value.decode("utf-8"))
+            elif field == 4:
+                values.append(_decode_value(value))
+            elif field == 5:
+                layer["extent"] = value
+            elif field == 15:
+                layer["version"] = value
+
+        for raw in raw_features:
+            feature = {"id": None, "properties": {}}
+            for field, _, value in _fields(raw):
+                if field == 1:
+                    feature["id"] = value
+                elif field == 2:
+                    tags = _packed(value)
+                    feature["properties"] = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+                elif field == 3:
+                    feature["type"] = value
+                elif field == 4:
+                    command, x, y = _packed(value)
+                    assert command == 9
+                    feature["geometry"] = (_unzigzag(x), _unzigzag(y))
+            layer["features"].append(feature)
+        layers[name] = layer
+    return layers
+
+def test_round_trip():
+    """Test that encoded points and properties decode back"""
+    layer = LayerEncoder("clusters", extent=512)
+    layer.add_point(10, 20, {"cluster": True, "point_count": 300, "cluster_id": "42"}, feature_id=42)
+    layer.add_point(-5, 600, {"full_name": "Learner é", "offset": -3, "ratio": 0.5, "gender": None})
+
+    decoded = decode_tile(encode_tile([layer]))["clusters"]
+
+    assert decoded["version"] == 2
+    assert decoded["extent"] == 512
+    first, second = decoded["features"]
+    assert first == {
+        "id": 42,
+        "type": 1,
+        "geometry": (10, 20),
+        "properties": {"cluster": True, "point_count": 300, "cluster_id": "42"}
+    }
+    assert second["id"] is None
+    assert second["geometry"] == (-5, 600)
+    assert second["properties"] == {"full_name": "Learner é", "offset": -3, "ratio": 0.5}
+
+def test_values_are_interned():
+    """Test that repeated keys and values are stored once per layer"""
+    layer = LayerEncoder("clusters")
+    for i in range(100):
+        layer.add_point(i, i, {"cluster": True, "gender": "female"})
+
+    assert len(layer.keys) == 2
+    assert len(layer.values) == 2
+
+def test_bool_and_int_values_are_distinct():
+    """Test that True and 1 are not merged into one value"""
+    layer = LayerEncoder("clusters")
+    layer.add_point(0, 0, {"cluster": True, "point_count": 1})
+
+    decoded = decode_tile(encode_tile([layer]))["clusters"]
+    assert decoded["features"][0]["properties"] == {"cluster": True, "point_count": 1}
+
+def test_empty_tile():
+    """Test that a tile without features encodes to an empty message"""
+    assert encode_tile([LayerEncoder("clusters")]) == b""